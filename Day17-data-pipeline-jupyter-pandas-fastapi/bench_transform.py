@@ -0,0 +1,193 @@
+"""
+NOTES:
+    - How much faster is pipeline/transform.py than the notebook? Times
+      three ways of cleaning the combined dataset:
+        notebook = 2_cleanup_and_transform_data_v2.ipynb as it was:
+            df.apply(remove_symbols_and_convert, axis=1), then the % columns
+            and the sort as separate steps
+        regex = the same steps, but the money columns done per column with
+            .str.replace(r"[$,]", regex=True) + pd.to_numeric()
+        pipeline = transform.clean()
+    - On the real 12k rows and on a synthetic dataset (default 10M rows)
+      made by sampling the real rows, so it has the same mix of values.
+      The row-wise apply would take ages on 10M rows, so it only runs up to
+      --apply-max-rows and is extrapolated from 12k rows in the output.
+    - Every method's result is checked against transform.clean() (the
+      sorted values of the money and Year columns, ties can come out in
+      another order).
+    - Run it from the Day17 directory:
+        python bench_transform.py
+        python bench_transform.py --rows 1000000 --output bench.json
+"""
+
+import argparse
+import json
+import time
+import typing as t
+
+import numpy as np
+import pandas as pd
+
+from pipeline.load import COMBINED_CSV
+from pipeline.transform import MONEY_COLUMNS, RENAMES, clean, read_combined
+
+
+# ====== The notebook's version
+def remove_symbols_from_str(str_value: str) -> str:
+    """
+    Removes '$,' symbols/punctuation from values.
+    """
+    cleaned_str_value: str = str_value.replace("$", "").replace(",", "")
+    return cleaned_str_value
+
+
+def convert_str_to_int(str_value: str) -> int:
+    """
+    Converts the string value to integer data type.
+    """
+    try:
+        int_value: int = int(str_value)
+    except ValueError:
+        # Some currencies have "-" values
+        int_value: int = 0
+    return int_value
+
+
+def remove_symbols_and_convert(row, cols: t.List[str] = MONEY_COLUMNS):
+    for col in cols:
+        row[col] = convert_str_to_int(remove_symbols_from_str(row[col]))
+    return row
+
+
+def _finish(df: pd.DataFrame) -> pd.DataFrame:
+    # The notebook's last steps: the % columns and the Worldwide Rank
+    df["Domestic_%"] = df["Domestic"] / df["Worldwide"]
+    df["Foreign_%"] = df["Foreign"] / df["Worldwide"]
+    df.sort_values(by=["Worldwide"], ascending=False, inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    df["Rank"] = df.index + 1
+    return df
+
+
+def _renamed(raw: pd.DataFrame) -> pd.DataFrame:
+    df = raw.rename(columns=RENAMES)
+    df.columns = df.columns.str.replace(" ", "_")
+    # The notebook's pd.read_csv() made this a number by itself
+    df["Year"] = df["Year"].astype(np.int64)
+    return df
+
+
+def clean_notebook(raw: pd.DataFrame) -> pd.DataFrame:
+    df = _renamed(raw).astype(object)
+    df = df.apply(remove_symbols_and_convert, axis=1)
+    for col in MONEY_COLUMNS:
+        df[col] = df[col].astype(np.int64)
+    return _finish(df)
+
+
+def clean_regex(raw: pd.DataFrame) -> pd.DataFrame:
+    df = _renamed(raw)
+    for col in MONEY_COLUMNS:
+        numbers = pd.to_numeric(
+            df[col].str.replace(r"[$,]", "", regex=True), errors="coerce"
+        )
+        df[col] = numbers.fillna(0).astype(np.int64)
+    return _finish(df)
+
+
+METHODS: t.Dict[str, t.Callable[[pd.DataFrame], pd.DataFrame]] = {
+    "notebook": clean_notebook,
+    "regex": clean_regex,
+    "pipeline": clean,
+}
+
+
+def synthetic(raw: pd.DataFrame, rows: int, seed: int = 0) -> pd.DataFrame:
+    """rows rows sampled (with replacement) from the real dataset."""
+    picks = np.random.default_rng(seed).integers(0, len(raw), rows)
+    return raw.take(picks).reset_index(drop=True)
+
+
+def _signature(df: pd.DataFrame) -> t.Dict[str, np.ndarray]:
+    # Tied Worldwide values may come out in another order, so compare the
+    # sorted values of each column (and keep no full DataFrame around)
+    return {
+        name: np.sort(df[name].to_numpy()) for name in MONEY_COLUMNS + ["Year"]
+    }
+
+
+def run(
+    raw: pd.DataFrame, apply_max_rows: int
+) -> t.Dict[str, t.Optional[float]]:
+    timings: t.Dict[str, t.Optional[float]] = {}
+    expected = None
+    for name, method in reversed(list(METHODS.items())):
+        if name == "notebook" and len(raw) > apply_max_rows:
+            timings[name] = None
+            continue
+        started = time.perf_counter()
+        result = method(raw)
+        timings[name] = time.perf_counter() - started
+        signature = _signature(result)
+        del result
+        if expected is None:
+            expected = signature
+        elif any(
+            not np.array_equal(signature[key], expected[key])
+            for key in expected
+        ):
+            raise AssertionError(f"{name} doesn't match transform.clean()")
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark transform.clean()")
+    parser.add_argument("--source", default=COMBINED_CSV)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--apply-max-rows", type=int, default=100_000)
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    raw = read_combined(args.source)
+    results = []
+    per_row = None
+    datasets = {
+        "real": lambda: raw,
+        "synthetic": lambda: synthetic(raw, args.rows),
+    }
+    for label, make in datasets.items():
+        # Only one synthetic dataset in memory at a time
+        data = make()
+        timings = run(data, args.apply_max_rows)
+        if timings["notebook"] is not None:
+            per_row = timings["notebook"] / len(data)
+        estimated = timings["notebook"] is None and per_row is not None
+        notebook = per_row * len(data) if estimated else timings["notebook"]
+        results.append(
+            {
+                "dataset": label,
+                "rows": len(data),
+                "seconds": timings,
+                "notebook_estimated": estimated,
+                "speedup_vs_notebook": round(notebook / timings["pipeline"], 1),
+                "speedup_vs_regex": round(
+                    timings["regex"] / timings["pipeline"], 1
+                ),
+            }
+        )
+        print(
+            f"{label:10} {len(data):>10} rows  notebook "
+            f"{'~' if estimated else ''}{notebook:9.2f}s  "
+            f"regex {timings['regex']:7.2f}s  "
+            f"pipeline {timings['pipeline']:7.3f}s  "
+            f"({results[-1]['speedup_vs_notebook']}x / "
+            f"{results[-1]['speedup_vs_regex']}x faster)"
+        )
+        del data
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
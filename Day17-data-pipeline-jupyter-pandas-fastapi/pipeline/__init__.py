@@ -0,0 +1,9 @@
+"""
+The notebooks' steps as importable code, so they can run without Jupyter:
+    load.py = data/*.csv -> cache/movies-box-office-dataset.csv
+    transform.py = that -> cache/movies-box-office-dataset-cleaned.csv
+        (+ .feather, typed and memory-mappable, what the server reads,
+        and a .version file the server polls to pick up new data)
+    run.py = both of them, skipping what's up to date (python -m
+        pipeline.run), built on the little stage runner in dag.py
+"""
@@ -0,0 +1,332 @@
+"""
+NOTES:
+    - A tiny make-like runner for the pipeline's steps. Each Stage says
+      what it reads (inputs) and writes (outputs), as files or directories
+      (= every file in them). A stage that reads another stage's output
+      runs after it, stages that don't depend on each other run at the
+      same time (in a thread pool, the work itself is pandas/pyarrow and
+      file IO, which mostly don't hold the GIL).
+    - Up to date = the sha256 of every input AND every output is what it
+      was after the last successful run. Those are kept in a state file
+      (cache/pipeline-state.json), using load.fingerprint(), so a file is
+      only hashed again when its size or mtime changed. Up to date stages
+      are skipped; if an earlier stage ran but wrote the same bytes, the
+      next one is still skipped.
+    - List a stage's own code as one of its inputs (e.g. transform.py),
+      so changing how a step works reruns it too.
+    - When a stage fails, the stages that depend on it don't run, the
+      others still do. Every stage gets a StageResult with its timing.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+import time
+import typing as t
+
+from pipeline.load import _write_atomic, fingerprint
+
+STATE_VERSION = 1
+
+RAN = "ran"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"  # a stage it depends on failed
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Params:
+        name = Unique name, e.g. "load"
+        run = Does the work, called with no arguments
+        inputs = Files/directories the stage reads
+        outputs = Files the stage writes
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: t.Callable[[], t.Any],
+        inputs: t.Sequence[str] = (),
+        outputs: t.Sequence[str] = (),
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def __repr__(self) -> str:
+        return f"<Stage {self.name}>"
+
+
+class StageResult:
+    """
+    What happened to a Stage.
+
+    Params:
+        name = The Stage's name
+        status = RAN, SKIPPED, FAILED or BLOCKED
+        seconds = How long it took, checking the hashes included
+        error = The exception, when it FAILED
+    """
+
+    def __init__(
+        self,
+        name: str,
+        status: str,
+        seconds: float = 0.0,
+        error: t.Optional[BaseException] = None,
+    ):
+        self.name = name
+        self.status = status
+        self.seconds = seconds
+        self.error = error
+
+    def __repr__(self) -> str:
+        return f"<StageResult {self.name} {self.status} {self.seconds:.3f}s>"
+
+
+def read_state(path: str) -> t.Dict[str, t.Any]:
+    """Stage name -> {"inputs", "outputs"} fingerprints, {} if unknown."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if state.get("version") != STATE_VERSION:
+        return {}
+    return state.get("stages", {})
+
+
+def write_state(path: str, stages: t.Dict[str, t.Any]) -> None:
+    def write(tmp_path: str) -> None:
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"version": STATE_VERSION, "stages": stages},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _write_atomic(path, write)
+
+
+def expand(paths: t.Sequence[str]) -> t.List[str]:
+    """Files and directories -> files (a directory's files, sorted)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if os.path.isfile(os.path.join(path, name))
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def dependencies(stages: t.Sequence[Stage]) -> t.Dict[str, t.Set[str]]:
+    """
+    Stage name -> names of the stages it has to wait for (the ones that
+    write one of its inputs). Raises ValueError on a cycle.
+    """
+    writers: t.Dict[str, str] = {}
+    for stage in stages:
+        for path in stage.outputs:
+            path = os.path.abspath(path)
+            if path in writers:
+                raise ValueError(
+                    f"{path} is written by both {writers[path]} and "
+                    f"{stage.name}"
+                )
+            writers[path] = stage.name
+    graph = {
+        stage.name: {
+            writers[os.path.abspath(path)]
+            for path in stage.inputs
+            if os.path.abspath(path) in writers
+        }
+        - {stage.name}
+        for stage in stages
+    }
+
+    # Kahn's algorithm, only to find cycles
+    waiting = {name: set(deps) for name, deps in graph.items()}
+    ready = [name for name, deps in waiting.items() if not deps]
+    while ready:
+        done = ready.pop()
+        for name, deps in waiting.items():
+            if done in deps:
+                deps.discard(done)
+                if not deps:
+                    ready.append(name)
+    if any(waiting.values()):
+        cycle = sorted(name for name, deps in waiting.items() if deps)
+        raise ValueError(f"Stages depend on each other: {cycle}")
+    return graph
+
+
+class Runner:
+    """
+    Runs Stages in dependency order, skipping the up to date ones.
+
+    Params:
+        stages = The Stages (names must be unique)
+        state_path = JSON file with the hashes of the last successful runs
+        jobs = How many stages may run at the same time
+    """
+
+    def __init__(
+        self, stages: t.Sequence[Stage], state_path: str, jobs: int = 2
+    ):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Stage names must be unique: {names}")
+        self.stages = {stage.name: stage for stage in stages}
+        self.graph = dependencies(stages)
+        self.state_path = state_path
+        self.jobs = max(jobs, 1)
+        self._state: t.Dict[str, t.Any] = {}
+        self._lock = threading.Lock()  # guards self._state
+
+    def _fingerprints(
+        self, paths: t.List[str], previous: t.Dict[str, t.Any]
+    ) -> t.Optional[t.Dict[str, t.Any]]:
+        # None if one of the files doesn't exist
+        entries = {}
+        for path in paths:
+            if not os.path.exists(path):
+                return None
+            entries[path] = fingerprint(path, previous.get(path))
+        return entries
+
+    @staticmethod
+    def _hashes(entries: t.Optional[t.Dict[str, t.Any]]) -> t.Dict[str, str]:
+        return {
+            path: entry["sha256"] for path, entry in (entries or {}).items()
+        }
+
+    def _run_stage(self, stage: Stage, force: bool) -> StageResult:
+        started = time.perf_counter()
+        with self._lock:
+            previous = self._state.get(stage.name, {})
+        known = {**previous.get("inputs", {}), **previous.get("outputs", {})}
+
+        inputs = self._fingerprints(expand(stage.inputs), known)
+        if inputs is None:
+            missing = [p for p in expand(stage.inputs) if not os.path.exists(p)]
+            error = FileNotFoundError(f"Missing inputs: {missing}")
+            return StageResult(
+                stage.name, FAILED, time.perf_counter() - started, error
+            )
+        outputs = self._fingerprints(stage.outputs, known)
+        up_to_date = (
+            not force
+            and previous
+            and outputs is not None
+            and self._hashes(inputs) == self._hashes(previous.get("inputs"))
+            and self._hashes(outputs) == self._hashes(previous.get("outputs"))
+        )
+        if up_to_date:
+            status = SKIPPED
+        else:
+            try:
+                stage.run()
+            except Exception as e:
+                return StageResult(
+                    stage.name, FAILED, time.perf_counter() - started, e
+                )
+            outputs = self._fingerprints(stage.outputs, {})
+            if outputs is None:
+                error = FileNotFoundError(
+                    f"{stage.name} didn't write all of {stage.outputs}"
+                )
+                return StageResult(
+                    stage.name, FAILED, time.perf_counter() - started, error
+                )
+            status = RAN
+
+        with self._lock:
+            # Even when skipped: remembers new mtimes, so the files aren't
+            # hashed again next time
+            self._state[stage.name] = {"inputs": inputs, "outputs": outputs}
+        return StageResult(stage.name, status, time.perf_counter() - started)
+
+    def run(
+        self, force: t.Union[bool, t.Collection[str]] = False
+    ) -> t.List[StageResult]:
+        """
+        Run every stage that isn't up to date. force=True (or a collection
+        of stage names) runs those stages no matter what.
+        Returns a StageResult per stage, in the order they finished.
+        """
+        forced = set(self.stages) if force is True else set(force or ())
+        if forced - set(self.stages):
+            raise ValueError(
+                f"Unknown stages: {sorted(forced - set(self.stages))}"
+            )
+        self._state = read_state(self.state_path)
+
+        results: t.Dict[str, StageResult] = {}
+        waiting = {name: set(deps) for name, deps in self.graph.items()}
+        running: t.Dict[concurrent.futures.Future, str] = {}
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as pool:
+            while waiting or running:
+                for name in [n for n, deps in waiting.items() if not deps]:
+                    del waiting[name]
+                    future = pool.submit(
+                        self._run_stage, self.stages[name], name in forced
+                    )
+                    running[future] = name
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    result = future.result()
+                    results[running.pop(future)] = result
+                    self._finish(result, waiting, results)
+                    self._save()
+        return list(results.values())
+
+    def _finish(
+        self,
+        result: StageResult,
+        waiting: t.Dict[str, t.Set[str]],
+        results: t.Dict[str, StageResult],
+    ) -> None:
+        if result.status != FAILED:
+            for deps in waiting.values():
+                deps.discard(result.name)
+            return
+        # Nothing downstream of a failed stage can run
+        blocked = [result.name]
+        while blocked:
+            failed = blocked.pop()
+            for name in [n for n, deps in waiting.items() if failed in deps]:
+                del waiting[name]
+                results[name] = StageResult(name, BLOCKED)
+                blocked.append(name)
+
+    def _save(self) -> None:
+        with self._lock:
+            write_state(self.state_path, self._state)
+
+
+def report(results: t.Sequence[StageResult], seconds: float) -> str:
+    """
+    The per stage timings as a small table, seconds = the whole run (less
+    than the sum when stages ran at the same time).
+    """
+    width = max([len(result.name) for result in results] + [5])
+    lines = [
+        f"{result.name:<{width}}  {result.status:<7}  {result.seconds:8.3f}s"
+        + (f"  {result.error!r}" if result.error else "")
+        for result in results
+    ]
+    lines.append(f"{'total':<{width}}  {'':<7}  {seconds:8.3f}s")
+    return "\n".join(lines)
@@ -0,0 +1,288 @@
+"""
+NOTES:
+    - Step 1 of the pipeline, what 1_load_and_combine_data.ipynb does: read
+      every data/<year>.csv, add "year" and "filename" columns and concat
+      them all into cache/movies-box-office-dataset.csv.
+    - The notebook re-reads all ~20 years every time, even if only 2020.csv
+      changed. load_and_combine() keeps a manifest (cache/manifest.json)
+      of every source file it combined: size, mtime and a sha256 of its
+      contents. On the next run:
+        * nothing added/removed/changed -> skip the run, don't even open
+          the combined CSV
+        * some years changed -> read the cached combined CSV, drop the rows
+          of the changed/removed years and splice in just those years
+    - Checking a file is an os.stat(). Only when size or mtime differ do we
+      hash it, so a 'touch' (or a fresh git checkout) doesn't count as a
+      change but an edit that keeps the size does.
+    - Everything is read as str (dtype=str, keep_default_na=False), so
+      values like "$1,234" or "-" are written back exactly as they came in
+      and a spliced file is byte for byte what a full rebuild would give.
+      Rows are ordered by filename, then by their order in that file.
+    - With workers=N (> 1) the files that have to be read are parsed in a
+      pool of N processes (pd.read_csv() holds the GIL for most of its
+      work, so threads wouldn't help). pool.map() hands the DataFrames
+      back in the order of the files, whichever finishes first, and
+      they're concatenated ONCE, so the output is the same as with one
+      worker. Each DataFrame is pickled back to this process, so it only
+      pays off with many (or big) files and more than one CPU.
+    - The pool's processes come from a "forkserver", not a plain fork() of
+      this process: run.py calls us from one of its threads, and a fork()
+      of a multi-threaded process only copies the calling thread, so a
+      lock another thread held at that moment stays locked in the child
+      forever. The fork server is a fresh single-threaded process started
+      once, and the workers are forked from it instead.
+    - The combined CSV is written to a temp file and os.replace()d, then
+      the manifest. If we crash in between, the manifest no longer matches
+      the output (we keep the output's size/mtime in it too) and the next
+      run rebuilds everything.
+    - Run it with:
+        python -m pipeline.load            # from the Day17 directory
+        python -m pipeline.load --force    # ignore the manifest
+        python -m pipeline.load --workers 4
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import typing as t
+
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")  # raw
+CACHE_DIR = os.path.join(BASE_DIR, "cache")  # processed
+COMBINED_CSV = os.path.join(CACHE_DIR, "movies-box-office-dataset.csv")
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(
+    path: str, previous: t.Optional[t.Dict[str, t.Any]] = None
+) -> t.Dict[str, t.Any]:
+    """
+    {size, mtime_ns, sha256} of a file. The hash of 'previous' is reused
+    when size and mtime haven't changed.
+    """
+    stat = os.stat(path)
+    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if (
+        previous is not None
+        and previous.get("size") == entry["size"]
+        and previous.get("mtime_ns") == entry["mtime_ns"]
+    ):
+        entry["sha256"] = previous["sha256"]
+    else:
+        entry["sha256"] = file_hash(path)
+    return entry
+
+
+def read_manifest(path: str) -> t.Dict[str, t.Any]:
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def _write_atomic(path: str, write: t.Callable[[str], None]) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_manifest(path: str, manifest: t.Dict[str, t.Any]) -> None:
+    def write(tmp_path: str) -> None:
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    _write_atomic(path, write)
+
+
+def read_year(path: str) -> pd.DataFrame:
+    """One data/<year>.csv with its "year" and "filename" columns added."""
+    filename = os.path.basename(path)
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    df["year"] = filename.replace(".csv", "")  # or filename[:4]
+    df["filename"] = filename
+    return df
+
+
+def read_years(paths: t.List[str], workers: int = 1) -> t.List[pd.DataFrame]:
+    """read_year() every path, in a pool of workers processes if > 1."""
+    if workers <= 1 or len(paths) <= 1:
+        return [read_year(path) for path in paths]
+    workers = min(workers, len(paths))
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("forkserver")
+    ) as pool:
+        # map() yields in the order of paths. A few files per task, so
+        # lots of small files don't cost a round trip each.
+        chunksize = max(len(paths) // (workers * 4), 1)
+        return list(pool.map(read_year, paths, chunksize=chunksize))
+
+
+def source_files(data_dir: str) -> t.List[str]:
+    return sorted(
+        name for name in os.listdir(data_dir) if name.endswith(".csv")
+    )
+
+
+class LoadResult:
+    """
+    What load_and_combine() did.
+
+    Params:
+        skipped = Nothing changed, the output was left alone
+        read = Source files that were (re)read
+        removed = Source files that are gone since the last run
+        rows = Rows in the combined dataset (None when skipped)
+        seconds = How long it took
+    """
+
+    def __init__(
+        self,
+        skipped: bool,
+        read: t.List[str],
+        removed: t.List[str],
+        rows: t.Optional[int],
+        seconds: float,
+    ):
+        self.skipped = skipped
+        self.read = read
+        self.removed = removed
+        self.rows = rows
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        if self.skipped:
+            return f"<LoadResult skipped {self.seconds:.3f}s>"
+        return (
+            f"<LoadResult read={self.read} removed={self.removed} "
+            f"rows={self.rows} {self.seconds:.3f}s>"
+        )
+
+
+def load_and_combine(
+    data_dir: str = DATA_DIR,
+    output: str = COMBINED_CSV,
+    manifest_path: t.Optional[str] = None,
+    force: bool = False,
+    workers: int = 1,
+) -> LoadResult:
+    """
+    Combine data_dir/*.csv into output, re-reading only the files that
+    changed since the last run (see NOTES).
+
+    Params:
+        data_dir = Directory with the <year>.csv files
+        output = Combined CSV to write
+        manifest_path = Where to keep the manifest (default: next to
+            output, as manifest.json)
+        force = Re-read every file
+        workers = Processes to read the files with (0 = one per CPU)
+    """
+    started = time.perf_counter()
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if manifest_path is None:
+        manifest_path = os.path.join(os.path.dirname(output), "manifest.json")
+    manifest = {} if force else read_manifest(manifest_path)
+    previous: t.Dict[str, t.Dict] = manifest.get("files", {})
+
+    # The cached output is only any use if it's the one the manifest
+    # describes
+    output_ok = False
+    if manifest and os.path.exists(output):
+        stat = os.stat(output)
+        output_ok = manifest.get("output") == {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+    if not output_ok:
+        previous = {}
+
+    names = source_files(data_dir)
+    files = {
+        name: fingerprint(os.path.join(data_dir, name), previous.get(name))
+        for name in names
+    }
+    changed = [
+        name
+        for name in names
+        if previous.get(name, {}).get("sha256") != files[name]["sha256"]
+    ]
+    removed = sorted(set(previous) - set(files))
+
+    if not changed and not removed:
+        if files != previous:
+            # Only mtimes moved (e.g. touch), remember them so we don't
+            # hash those files again next time
+            manifest["files"] = files
+            write_manifest(manifest_path, manifest)
+        return LoadResult(True, [], [], None, time.perf_counter() - started)
+
+    frames = []
+    if previous:
+        cached = pd.read_csv(output, dtype=str, keep_default_na=False)
+        frames.append(cached[~cached["filename"].isin(changed + removed)])
+    frames.extend(
+        read_years([os.path.join(data_dir, name) for name in changed], workers)
+    )
+    combined = pd.concat(frames, ignore_index=True)
+    # Stable: rows of one file keep their order
+    combined.sort_values("filename", kind="stable", inplace=True)
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    _write_atomic(output, lambda path: combined.to_csv(path, index=False))
+    stat = os.stat(output)
+    write_manifest(
+        manifest_path,
+        {
+            "version": MANIFEST_VERSION,
+            "output": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+            "files": files,
+        },
+    )
+    return LoadResult(
+        False, changed, removed, len(combined), time.perf_counter() - started
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Combine data/*.csv")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output", default=COMBINED_CSV)
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="0 = one per CPU"
+    )
+    args = parser.parse_args()
+    print(
+        load_and_combine(
+            args.data_dir, args.output, force=args.force, workers=args.workers
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+NOTES:
+    - Both notebooks' steps as one command, see dag.py for how stages are
+      skipped and scheduled:
+        load      = data/*.csv -> cache/movies-box-office-dataset.csv
+        transform = that -> the cleaned CSV + Feather (+ .version, which
+                    makes a running server pick up the new data)
+    - Each stage's own module is one of its inputs, so editing e.g.
+      transform.py reruns the transform even if the data didn't change.
+    - Run it with:
+        python -m pipeline.run             # from the Day17 directory
+        python -m pipeline.run --force     # run every stage anyway
+        python -m pipeline.run --force transform
+"""
+
+import argparse
+import os
+import sys
+import time
+import typing as t
+
+from pipeline import dag, load, transform
+
+STATE_FILE = os.path.join(load.CACHE_DIR, "pipeline-state.json")
+
+
+def _source(module: t.Any) -> str:
+    return os.path.abspath(module.__file__)
+
+
+def stages(
+    data_dir: str = load.DATA_DIR,
+    cache_dir: str = load.CACHE_DIR,
+    workers: int = 1,
+) -> t.List[dag.Stage]:
+    """The pipeline's stages, reading data_dir and writing to cache_dir."""
+    combined = os.path.join(cache_dir, os.path.basename(load.COMBINED_CSV))
+    cleaned = os.path.join(cache_dir, os.path.basename(transform.CLEANED_CSV))
+    feather = os.path.join(
+        cache_dir, os.path.basename(transform.CLEANED_FEATHER)
+    )
+    return [
+        dag.Stage(
+            "load",
+            lambda: load.load_and_combine(data_dir, combined, workers=workers),
+            inputs=[data_dir, _source(load)],
+            outputs=[combined],
+        ),
+        dag.Stage(
+            "transform",
+            lambda: transform.cleanup_and_transform(combined, cleaned, feather),
+            inputs=[combined, _source(transform)],
+            outputs=[cleaned, feather, transform.version_path(feather)],
+        ),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the Day17 pipeline")
+    parser.add_argument(
+        "--force",
+        nargs="*",
+        metavar="STAGE",
+        help="Run these stages (all when none given) even if up to date",
+    )
+    parser.add_argument("--data-dir", default=load.DATA_DIR)
+    parser.add_argument("--cache-dir", default=load.CACHE_DIR)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="For the load stage"
+    )
+    parser.add_argument("--jobs", type=int, default=2, help="Stages at once")
+    args = parser.parse_args()
+
+    runner = dag.Runner(
+        stages(args.data_dir, args.cache_dir, args.workers),
+        os.path.join(args.cache_dir, os.path.basename(STATE_FILE)),
+        jobs=args.jobs,
+    )
+    # --force = everything, --force transform = just that one
+    force = args.force == [] or set(args.force or ())
+    started = time.perf_counter()
+    try:
+        results = runner.run(force)
+    except ValueError as e:  # --force with an unknown stage
+        parser.error(str(e))
+    print(dag.report(results, time.perf_counter() - started))
+    if any(result.status in (dag.FAILED, dag.BLOCKED) for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
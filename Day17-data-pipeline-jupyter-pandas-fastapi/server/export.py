@@ -0,0 +1,75 @@
+"""
+NOTES:
+    - /box-office/export hands the WHOLE dataset to bulk consumers (the
+      nightly sync jobs) as NDJSON (one JSON object per line) or CSV,
+      without ever building one giant list of Dicts or one giant JSON
+      document in memory.
+    - The rows come straight from the Dataset's pyarrow Table, which is
+      memory-mapped from the Feather file (see store.py).
+      Table.to_batches(EXPORT_CHUNK_ROWS) slices it into fixed-size record
+      batches without copying anything, and only one batch at a time is
+      turned into text. So memory stays at ~one chunk, however big the
+      dataset gets, and the client starts receiving rows right away.
+    - CSV chunks are written by pyarrow's CSV writer (C++, no Python
+      object per value). NDJSON needs a Dict per row for json.dumps(), but
+      only for the rows of the current chunk.
+    - An export keeps the Dataset it started with: if the pipeline
+      publishes a new version halfway through, this export still finishes
+      with the old one, and the next export gets the new one.
+"""
+
+import io
+import json
+import os
+import typing as t
+
+import pyarrow as pa
+import pyarrow.csv as csv
+
+from store import Dataset
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "1000"))
+
+# format -> media type
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _batches(dataset: Dataset, chunk_rows: int) -> t.Iterator[pa.RecordBatch]:
+    return iter(dataset.table.to_batches(max_chunksize=chunk_rows))
+
+
+def iter_ndjson(
+    dataset: Dataset, chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> t.Iterator[bytes]:
+    """Yield the dataset as NDJSON, chunk_rows rows per chunk."""
+    for batch in _batches(dataset, chunk_rows):
+        lines = [json.dumps(row) for row in batch.to_pylist()]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_csv(
+    dataset: Dataset, chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> t.Iterator[bytes]:
+    """Yield the dataset as CSV (header first), chunk_rows rows per chunk."""
+    buffer = io.BytesIO()
+    with csv.CSVWriter(buffer, dataset.table.schema) as writer:
+        for batch in _batches(dataset, chunk_rows):
+            writer.write_batch(batch)
+            # Hand over what's been written so far and start over
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def export(
+    dataset: Dataset, export_format: str, chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> t.Iterator[bytes]:
+    """The chunks of the dataset in export_format (see EXPORT_FORMATS)."""
+    if export_format == "csv":
+        return iter_csv(dataset, chunk_rows)
+    return iter_ndjson(dataset, chunk_rows)
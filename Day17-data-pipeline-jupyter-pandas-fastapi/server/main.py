@@ -1,18 +1,27 @@
-import os
+import base64
+import binascii
+import contextlib
+import json
 import typing as t
-import pandas as pd
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
-BASE_DIR = os.path.dirname(
-    os.path.dirname(os.path.abspath(__file__))
-)  # /17-data-pipeline
-CACHE_DIR = os.path.join(BASE_DIR, "cache")
-# print(os.path.abspath(__file__))  # .../main.py
-# print(BASE_DIR)  # /Users.../17-data-pipeline-jupyter-pandas-fastapi
-# print(CACHE_DIR)  # /Users/.../17-data-pipeline-jupyter-pandas-fastapi/cache
-dataset = os.path.join(CACHE_DIR, "movies-box-office-dataset-cleaned.csv")
+# The dataset is loaded once at startup and swapped when the pipeline
+# publishes a new version, see store.py
+from export import EXPORT_FORMATS, export
+from store import Dataset, box_office
 
-app = FastAPI()
+MAX_LIMIT = 1000
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI) -> t.AsyncIterator[None]:
+    box_office.start()
+    yield
+    box_office.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/")
@@ -20,17 +29,136 @@ def read_root():
     return {"Hello": "World"}
 
 
+def parse_sort(dataset: Dataset, sort: str) -> t.Tuple[str, bool]:
+    """?sort=-Worldwide -> ("Worldwide", True), in any case."""
+    columns = {name.lower(): name for name in dataset.names}
+    column = columns.get(sort.lstrip("-").lower())
+    if column is None:
+        raise HTTPException(
+            400, f"Can't sort by {sort!r}, try one of {dataset.names}"
+        )
+    return column, sort.startswith("-")
+
+
+def parse_fields(
+    dataset: Dataset, fields: t.Optional[str]
+) -> t.Optional[t.List[str]]:
+    """?fields=Rank,Worldwide -> ["Rank", "Worldwide"], None for all."""
+    if not fields:
+        return None
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in dataset.names]
+    if unknown:
+        raise HTTPException(
+            400, f"Unknown fields {unknown}, try some of {dataset.names}"
+        )
+    return selected
+
+
+# A cursor is where the next page starts in the sorted rows, plus what it
+# was sorted/filtered by and the dataset version, so it can't be used with
+# another query or after the data changed (the positions would be off).
+def encode_cursor(version: str, query: t.Dict[str, t.Any], start: int) -> str:
+    state = json.dumps({"v": version, "q": query, "i": start})
+    return base64.urlsafe_b64encode(state.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, version: str, query: t.Dict[str, t.Any]) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded))
+        start = int(state["i"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(400, "Invalid cursor")
+    if state.get("q") != query:
+        raise HTTPException(400, "The cursor is for another query")
+    if state.get("v") != version:
+        raise HTTPException(
+            400, "The dataset changed, start again without a cursor"
+        )
+    return start
+
+
 @app.get("/box-office")
-def read_box_office_data():
+def read_box_office_data(
+    limit: int = Query(100, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: t.Optional[str] = None,
+    year: t.Optional[int] = None,
+    min_worldwide: t.Optional[int] = None,
+    sort: str = "Rank",
+    fields: t.Optional[str] = None,
+):
     """
-    Retrieve box office dataset using Pandas.
+    Retrieve one page of the box office dataset (the current version, see
+    store.py).
+
+    Query params:
+        limit = Rows per page (default 100, at most MAX_LIMIT)
+        offset = Rows to skip
+        cursor = next_cursor of the previous page, to get the next one
+        year = Only movies from this year
+        min_worldwide = Only movies with at least this Worldwide gross
+        sort = Column to sort by, prefix with "-" for descending
+            e.g. ?sort=-Worldwide (default Rank)
+        fields = Columns to return, e.g. ?fields=Rank,Release_Group
     """
-    df = pd.read_csv(dataset)
-    # Return a DICT of the Rank column in our CSV:
+    dataset = box_office.get()
+    column, descending = parse_sort(dataset, sort)
+    selected = parse_fields(dataset, fields)
+    query = {"sort": sort, "year": year, "min_worldwide": min_worldwide}
+    start = 0
+    if cursor:
+        start = decode_cursor(cursor, dataset.version, query)
+
+    # Only the rows of this page are turned into Dicts:
     # {'Rank': 7095, 'Release_Group': 'Rififi 2000 Re-release', 'Worldwide': 463593, 'Domesti
     # c': 460226, 'Domestic_%': 0.992737163848462, 'Foreign': 3367, 'Foreign_%': 0.007262836151538094, 'Year': 2000
     # , 'Filename': '2000.csv'}
-    return df.to_dict("Rank")
+    total, positions, next_start = dataset.query(
+        column, descending, year, min_worldwide, start, offset, limit
+    )
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_cursor": (
+            None
+            if next_start is None
+            else encode_cursor(dataset.version, query, next_start)
+        ),
+        "data": dataset.take(positions, selected),
+    }
+
+
+@app.get("/box-office/export")
+def export_box_office_data(
+    export_format: str = Query("ndjson", alias="format")
+):
+    """
+    Stream the whole box office dataset as NDJSON or CSV, a fixed number
+    of rows at a time (see export.py).
+
+    Query params:
+        format = ndjson (default) or csv
+    """
+    media_type = EXPORT_FORMATS.get(export_format)
+    if media_type is None:
+        formats = list(EXPORT_FORMATS)
+        raise HTTPException(
+            400, f"Unknown format {export_format!r}, try one of {formats}"
+        )
+    dataset = box_office.get()
+    return StreamingResponse(
+        export(dataset, export_format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="box-office.{export_format}"'
+            ),
+            "X-Dataset-Version": dataset.version,
+        },
+    )
 
 
 # test_df = pd.read_csv(dataset)
@@ -0,0 +1,409 @@
+"""
+NOTES:
+    - read_box_office_data() used to pd.read_csv() the cleaned dataset on
+      EVERY request. Now it's loaded ONCE, when the app starts, into a
+      Dataset: an immutable snapshot (a pyarrow Table, memory-mapped from
+      the Feather file pipeline/transform.py writes) plus its version.
+    - How do we notice the pipeline published new data? transform.py
+      writes the Feather file's sha256 into a .version file next to it,
+      AFTER the Feather itself is in place. DatasetStore polls that tiny
+      file every 'check_interval' seconds from a background thread. When
+      the version in it changed, the thread loads the new Dataset and
+      swaps the reference in one assignment. Requests only ever read that
+      reference: they never parse anything or wait for a reload, and one
+      that already has the old Dataset keeps using it until it's done.
+    - The pipeline os.replace()s the Feather file, so the old Dataset's
+      memory map still points at the old (now unlinked) file, which the OS
+      keeps around until nothing maps it anymore.
+    - No .version file (e.g. the pipeline hasn't run since this was added):
+      the version is the Feather's size + mtime. No Feather at all: the CSV
+      is parsed, and its size + mtime are the version.
+    - Dataset.memoize() keeps anything computed from a Dataset (NumPy
+      columns, indexes, ...) on it, so they're thrown away together with
+      the old data after a swap.
+    - query() answers /box-office?sort=&year=&min_worldwide= pages from
+      indexes built the first time they're needed (see memoize()):
+        * sort_order(): row positions sorted by a column. No filter: a
+          page is just order[offset:offset + limit].
+        * year_order(): sorted by Year, then by the column. Every year is
+          one contiguous slice of it, found with np.searchsorted().
+        * min_worldwide, sorted by Worldwide (or by Rank, which the
+          pipeline assigns in Worldwide order, checked once per Dataset):
+          the matching rows are one contiguous run at the start (highest
+          first) or the end of the sorted sequence, and how many there are
+          is one np.searchsorted(). So a page is a slice, like no filter.
+        * min_worldwide, any other sort: the indexes of the matching rows
+          in the sorted sequence are found with one vectorized compare and
+          kept in a small LRU (MATCHES_CACHE_SIZE) per (sort, year,
+          minimum), so paging through them is a slice too. Thresholds are
+          chosen by clients, hence the bound instead of memoize().
+      Pagination state is just an index into that sorted sequence (the
+      "cursor"), so the next page starts exactly where this one ended.
+      There's only a next cursor when a matching row is left after it.
+"""
+
+import collections
+import logging
+import os
+import threading
+import typing as t
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))
+)  # /17-data-pipeline
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+BOX_OFFICE_CSV = os.path.join(
+    CACHE_DIR, "movies-box-office-dataset-cleaned.csv"
+)
+# Written next to the CSV by pipeline/transform.py. Typed columns, and
+# uncompressed so it can be memory-mapped instead of parsed.
+BOX_OFFICE_FEATHER = os.path.join(
+    CACHE_DIR, "movies-box-office-dataset-cleaned.feather"
+)
+# How many (sort, year, min_worldwide) match lists a Dataset keeps
+MATCHES_CACHE_SIZE = 64
+
+
+def version_path(feather_path: str) -> str:
+    """cache/x.feather -> cache/x.version (same as pipeline/transform.py)"""
+    return os.path.splitext(feather_path)[0] + ".version"
+
+
+def read_table(path: str) -> pa.Table:
+    """
+    Memory-map the Feather file: the table's columns point straight into
+    the file (the OS pages them in as they're used), nothing is parsed and
+    the dtypes come from the file.
+    """
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _stat_version(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+class Dataset:
+    """
+    An immutable snapshot of the cleaned dataset.
+
+    Params:
+        table = The columns (pyarrow Tables can't be changed in place)
+        version = Identifies the published data it came from
+    """
+
+    def __init__(self, table: pa.Table, version: str = ""):
+        self.table = table
+        self.version = version
+        self.names: t.List[str] = table.column_names
+        # See memoize()
+        self._cache: t.Dict[t.Hashable, t.Any] = {}
+        # Re-entrant: building one index can memoize() another
+        self._lock = threading.RLock()
+        # See matches(), least recently used first
+        self._matches: "collections.OrderedDict[t.Hashable, np.ndarray]" = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def memoize(self, key: t.Hashable, build: t.Callable[[], t.Any]) -> t.Any:
+        """
+        Compute something from this Dataset once and keep it for as
+        long as this version of the data is around.
+        """
+        value = self._cache.get(key)
+        if value is None:
+            with self._lock:
+                value = self._cache.get(key)
+                if value is None:
+                    value = self._cache[key] = build()
+        return value
+
+    def column(self, name: str) -> np.ndarray:
+        """A column as a (read-only) NumPy array, computed once."""
+        return self.memoize(
+            ("column", name),
+            lambda: self.table.column(name).to_numpy(),
+        )
+
+    def take(
+        self,
+        positions: t.Sequence[int],
+        fields: t.Optional[t.Sequence[str]] = None,
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """The rows at positions (in that order), only the given fields."""
+        table = self.table if fields is None else self.table.select(fields)
+        return table.take(np.asarray(positions, dtype=np.intp)).to_pylist()
+
+    def sort_order(self, name: str, descending: bool = False) -> np.ndarray:
+        """
+        Row positions sorted by a column. pyarrow sorts are stable, so ties
+        keep their row (Rank) order, ascending or descending.
+        """
+        direction = "descending" if descending else "ascending"
+        return self.memoize(
+            ("sort", name, descending),
+            lambda: pc.sort_indices(
+                self.table, sort_keys=[(name, direction)]
+            ).to_numpy(),
+        )
+
+    def year_order(
+        self, name: str, descending: bool = False
+    ) -> t.Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (order, years): row positions sorted by Year and then by
+        column, and the Year of each of them (to np.searchsorted() in).
+        """
+
+        def build() -> t.Tuple[np.ndarray, np.ndarray]:
+            direction = "descending" if descending else "ascending"
+            order = pc.sort_indices(
+                self.table,
+                sort_keys=[("Year", "ascending"), (name, direction)],
+            ).to_numpy()
+            return order, self.column("Year")[order]
+
+        return self.memoize(("year", name, descending), build)
+
+    def sequence(
+        self,
+        name: str,
+        descending: bool = False,
+        year: t.Optional[int] = None,
+    ) -> np.ndarray:
+        """Row positions sorted by column, only year's rows if given."""
+        if year is None:
+            return self.sort_order(name, descending)
+        order, years = self.year_order(name, descending)
+        lo = np.searchsorted(years, year, side="left")
+        hi = np.searchsorted(years, year, side="right")
+        return order[lo:hi]
+
+    def worldwide_in(
+        self,
+        name: str,
+        descending: bool = False,
+        year: t.Optional[int] = None,
+    ) -> np.ndarray:
+        """Worldwide of every row of sequence(name, ...), in that order."""
+        return self.memoize(
+            ("worldwide", name, descending, year),
+            lambda: self.column("Worldwide")[
+                self.sequence(name, descending, year)
+            ],
+        )
+
+    def count_at_least(self, minimum: int, year: t.Optional[int] = None) -> int:
+        """Number of rows (of year) with Worldwide >= minimum."""
+        worldwide = self.worldwide_in("Worldwide", False, year)
+        return len(worldwide) - int(np.searchsorted(worldwide, minimum))
+
+    def highest_worldwide_first(
+        self, name: str, descending: bool
+    ) -> t.Optional[bool]:
+        """
+        Whether sequence(name, descending) is in Worldwide order: True for
+        highest first, False for lowest first, None if it isn't.
+        """
+        if name == "Worldwide":
+            return descending
+        if name == "Rank":
+            # The pipeline numbers the Ranks by Worldwide, but check it
+            in_order = self.memoize(
+                ("rank_by_worldwide",),
+                lambda: bool(np.all(np.diff(self.worldwide_in("Rank")) <= 0)),
+            )
+            return not descending if in_order else None
+        return None
+
+    def matches(
+        self,
+        name: str,
+        descending: bool,
+        year: t.Optional[int],
+        min_worldwide: int,
+    ) -> np.ndarray:
+        """
+        Indexes into sequence(name, descending, year) of the rows with
+        Worldwide >= min_worldwide, see NOTES.
+        """
+        key = (name, descending, year, min_worldwide)
+        with self._lock:
+            found = self._matches.get(key)
+            if found is not None:
+                self._matches.move_to_end(key)
+                return found
+        found = np.flatnonzero(
+            self.worldwide_in(name, descending, year) >= min_worldwide
+        )
+        with self._lock:
+            self._matches[key] = found
+            while len(self._matches) > MATCHES_CACHE_SIZE:
+                self._matches.popitem(last=False)
+        return found
+
+    def query(
+        self,
+        sort: str = "Rank",
+        descending: bool = False,
+        year: t.Optional[int] = None,
+        min_worldwide: t.Optional[int] = None,
+        start: int = 0,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> t.Tuple[int, np.ndarray, t.Optional[int]]:
+        """
+        Find the row positions for one page of results.
+
+        Params:
+            sort, descending = Column to order by
+            year = Only rows of this Year
+            min_worldwide = Only rows with at least this Worldwide
+            start = Where to carry on in the sorted rows (a cursor)
+            offset = Matching rows to skip after start
+            limit = Rows per page
+
+        Returns:
+            (total number of matching rows, positions for the page,
+            the start of the next page or None if this is the last one)
+        """
+        sequence = self.sequence(sort, descending, year)
+        # The matching rows are sequence[lo:hi] when they're contiguous
+        lo, hi = 0, len(sequence)
+        if min_worldwide is not None:
+            highest_first = self.highest_worldwide_first(sort, descending)
+            if highest_first is None:
+                found = self.matches(sort, descending, year, min_worldwide)
+                first = int(np.searchsorted(found, start)) + offset
+                page = found[first : first + limit]
+                more = first + limit < len(found)
+                next_start = int(page[-1]) + 1 if more and len(page) else None
+                return len(found), sequence[page], next_start
+            total = self.count_at_least(min_worldwide, year)
+            if highest_first:
+                hi = total
+            else:
+                lo = len(sequence) - total
+        first = min(max(start, lo) + offset, hi)
+        end = min(first + limit, hi)
+        return hi - lo, sequence[first:end], end if end < hi else None
+
+    @classmethod
+    def load(
+        cls,
+        feather_path: str = BOX_OFFICE_FEATHER,
+        csv_path: str = BOX_OFFICE_CSV,
+    ) -> "Dataset":
+        """The Feather file if there is one (see NOTES), else the CSV."""
+        if os.path.exists(feather_path):
+            # Version first: if a new one is published in between we get
+            # new data with the old version, and just load it again on the
+            # next check (the other way around we'd never reload it)
+            version = current_version(feather_path)
+            return cls(read_table(feather_path), version)
+        version = _stat_version(csv_path)
+        df = pd.read_csv(csv_path)
+        return cls(pa.Table.from_pandas(df, preserve_index=False), version)
+
+
+def current_version(feather_path: str) -> str:
+    """What's published right now, see NOTES."""
+    try:
+        with open(version_path(feather_path)) as f:
+            version = f.read().strip()
+        if version:
+            return version
+    except FileNotFoundError:
+        pass
+    return _stat_version(feather_path)
+
+
+class DatasetStore:
+    """
+    Process wide holder of the latest published Dataset.
+
+    Params:
+        feather_path = Feather file written by the pipeline
+        csv_path = CSV to fall back to when there's no Feather file
+        check_interval = Seconds between checks of the version file
+    """
+
+    def __init__(
+        self,
+        feather_path: str = BOX_OFFICE_FEATHER,
+        csv_path: str = BOX_OFFICE_CSV,
+        check_interval: float = 1.0,
+    ):
+        self.feather_path = feather_path
+        self.csv_path = csv_path
+        self.check_interval = check_interval
+        self._dataset: t.Optional[Dataset] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: t.Optional[threading.Thread] = None
+
+    def _version(self) -> str:
+        if os.path.exists(self.feather_path):
+            return current_version(self.feather_path)
+        return _stat_version(self.csv_path)
+
+    def reload(self) -> bool:
+        """Load the published Dataset if it's new. Return True if it was."""
+        with self._lock:
+            if (
+                self._dataset is not None
+                and self._dataset.version == self._version()
+            ):
+                return False
+            # Single reference swap, readers see old or new, never both
+            self._dataset = Dataset.load(self.feather_path, self.csv_path)
+            return True
+
+    def get(self) -> Dataset:
+        """Return the current Dataset (loading it if nobody did yet)."""
+        dataset = self._dataset
+        if dataset is None:
+            self.reload()
+            dataset = self._dataset
+        return dataset
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.reload()
+            except Exception:
+                # Keep serving the old Dataset, try again next time
+                logger.exception("Couldn't reload the dataset")
+
+    def start(self) -> None:
+        """Load the Dataset now and keep watching for new versions."""
+        self.reload()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._watch, name="dataset-watcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# One store per process (per uvicorn worker)
+box_office = DatasetStore(
+    check_interval=float(os.environ.get("DATASET_CHECK_INTERVAL", "1"))
+)
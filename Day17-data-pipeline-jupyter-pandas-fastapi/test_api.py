@@ -0,0 +1,230 @@
+# Run with: python -m pytest Day17-data-pipeline-jupyter-pandas-fastapi
+import io
+import json
+import os
+import sys
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from fastapi.testclient import TestClient
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, "server"))
+
+import export  # noqa: E402
+import main  # noqa: E402
+import store  # noqa: E402
+from pipeline import transform  # noqa: E402
+
+
+@pytest.fixture
+def cleaned():
+    return pd.read_csv(store.BOX_OFFICE_CSV)
+
+
+def publish(df: pd.DataFrame, feather_path: str) -> str:
+    # What pipeline/transform.py does after cleaning
+    transform.write_feather(df, feather_path)
+    return transform.publish_version(feather_path)
+
+
+@pytest.fixture
+def box_office(cleaned, tmp_path, monkeypatch):
+    path = str(tmp_path / "cleaned.feather")
+    publish(cleaned.head(100), path)
+    box_office = store.DatasetStore(path, check_interval=60)
+    monkeypatch.setattr(main, "box_office", box_office)
+    return box_office
+
+
+# ====== store.py
+def test_store_swaps_only_when_a_new_version_is_published(box_office, cleaned):
+    first = box_office.get()
+    assert len(first) == 100
+    assert box_office.get() is first
+
+    # Same data written again: same version, nothing to load
+    publish(cleaned.head(100), box_office.feather_path)
+    assert not box_office.reload()
+    assert box_office.get() is first
+
+    version = publish(cleaned.head(10), box_office.feather_path)
+    assert box_office.reload()
+    second = box_office.get()
+    assert (len(second), second.version) == (10, version)
+    # The old snapshot still works for whoever holds it
+    assert first.take([99]) == [cleaned.iloc[99].to_dict()]
+
+
+def test_store_falls_back_to_the_csv(tmp_path, cleaned):
+    csv_path = str(tmp_path / "cleaned.csv")
+    cleaned.head(5).to_csv(csv_path, index=False)
+    box_office = store.DatasetStore(str(tmp_path / "missing"), csv_path)
+    dataset = box_office.get()
+    assert dataset.take(range(5)) == cleaned.head(5).to_dict("records")
+
+
+def test_watcher_logs_failed_reloads(box_office, monkeypatch, caplog):
+    box_office.check_interval = 0.01
+    box_office.start()
+    failed = threading.Event()
+
+    def reload():
+        failed.set()
+        raise OSError("half written")
+
+    monkeypatch.setattr(box_office, "reload", reload)
+    try:
+        assert failed.wait(5)
+    finally:
+        box_office.stop()
+    record = next(r for r in caplog.records if r.name == "store")
+    assert record.levelname == "ERROR"
+    assert "half written" in record.exc_text
+    # Still serving the Dataset it had
+    assert len(box_office.get()) == 100
+
+
+@pytest.mark.parametrize(
+    "sort", ["Rank", "-Rank", "Worldwide", "-Worldwide", "Year", "-Domestic_%"]
+)
+@pytest.mark.parametrize("year", [None, 2019, 1900])
+@pytest.mark.parametrize("min_worldwide", [None, 50_000_000])
+def test_query_matches_pandas(cleaned, sort, year, min_worldwide):
+    dataset = store.Dataset(pa.Table.from_pandas(cleaned))
+    column, descending = sort.lstrip("-"), sort.startswith("-")
+    expected = cleaned
+    if year is not None:
+        expected = expected[expected["Year"] == year]
+    if min_worldwide is not None:
+        expected = expected[expected["Worldwide"] >= min_worldwide]
+    expected = expected.sort_values(
+        column, ascending=not descending, kind="stable"
+    )
+
+    total, positions, _ = dataset.query(
+        column, descending, year, min_worldwide, offset=30, limit=20
+    )
+    assert total == len(expected)
+    assert positions.tolist() == expected.index[30:50].tolist()
+
+
+@pytest.mark.parametrize("sort", ["Rank", "-Worldwide", "Worldwide", "Year"])
+def test_query_cursor_ends_with_the_last_match(cleaned, sort):
+    dataset = store.Dataset(pa.Table.from_pandas(cleaned))
+    column, descending = sort.lstrip("-"), sort.startswith("-")
+    expected = cleaned[cleaned["Worldwide"] >= 400_000_000].sort_values(
+        column, ascending=not descending, kind="stable"
+    )
+    # All but the last match, then exactly the last one: no more after it
+    # (even though there are non-matching rows left to look at)
+    total, first, start = dataset.query(
+        column, descending, None, 400_000_000, limit=len(expected) - 1
+    )
+    assert total == len(expected) and start is not None
+    _, last, start = dataset.query(
+        column, descending, None, 400_000_000, start=start, limit=1
+    )
+    assert start is None
+    assert first.tolist() + last.tolist() == expected.index.tolist()
+
+
+def test_query_when_rank_is_not_in_worldwide_order(cleaned):
+    shuffled = cleaned.head(50).copy()
+    shuffled["Rank"] = shuffled["Rank"].to_numpy()[::-1]
+    dataset = store.Dataset(pa.Table.from_pandas(shuffled))
+    assert dataset.highest_worldwide_first("Rank", False) is None
+    expected = shuffled[shuffled["Worldwide"] >= 300_000_000].sort_values(
+        "Rank", kind="stable"
+    )
+    total, positions, _ = dataset.query(min_worldwide=300_000_000, limit=100)
+    assert total == len(expected)
+    assert positions.tolist() == expected.index.tolist()
+
+
+# ====== main.py
+@pytest.fixture
+def client(box_office):
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_box_office_is_loaded_at_startup(box_office, cleaned):
+    with TestClient(main.app) as client:
+        # The lifespan loaded it before any request
+        assert box_office._dataset is not None
+        response = client.get("/box-office")
+    assert response.status_code == 200
+    assert response.json()["data"] == cleaned.head(100).to_dict("records")
+    assert box_office._thread is None  # stopped on shutdown
+
+
+def test_box_office_cursor_pages(client, cleaned):
+    params = {"sort": "-Foreign", "min_worldwide": 10_000_000, "limit": 7}
+    movies = cleaned.head(100)  # What the box_office fixture published
+    expected = movies[movies["Worldwide"] >= 10_000_000].sort_values(
+        "Foreign", ascending=False, kind="stable"
+    )
+    ranks = []
+    page = client.get("/box-office", params={**params, "fields": "Rank"}).json()
+    while True:
+        assert page["total"] == len(expected)
+        ranks.extend(row["Rank"] for row in page["data"])
+        if page["next_cursor"] is None:
+            break
+        page = client.get(
+            "/box-office",
+            params={**params, "fields": "Rank", "cursor": page["next_cursor"]},
+        ).json()
+    assert ranks == expected["Rank"].tolist()
+
+
+def test_box_office_fields_and_errors(client, box_office, cleaned):
+    response = client.get(
+        "/box-office", params={"fields": "Release_Group,Year", "limit": 2}
+    )
+    assert response.json()["data"] == (
+        cleaned[["Release_Group", "Year"]].head(2).to_dict("records")
+    )
+
+    for params in (
+        {"sort": "Budget"},
+        {"fields": "Rank,Budget"},
+        {"cursor": "nope"},
+        {"limit": main.MAX_LIMIT + 1},
+    ):
+        assert client.get("/box-office", params=params).status_code in (
+            400,
+            422,
+        )
+
+    cursor = client.get("/box-office", params={"limit": 5}).json()
+    cursor = cursor["next_cursor"]
+    other = client.get("/box-office", params={"year": 2019, "cursor": cursor})
+    assert other.status_code == 400
+    publish(cleaned.head(50), box_office.feather_path)
+    box_office.reload()
+    stale = client.get("/box-office", params={"limit": 5, "cursor": cursor})
+    assert stale.status_code == 400
+
+
+def test_export_streams_every_row(client, cleaned):
+    movies = cleaned.head(100)  # What the box_office fixture published
+
+    response = client.get("/box-office/export", params={"format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    exported = pd.read_csv(io.BytesIO(response.content))
+    pd.testing.assert_frame_equal(exported, movies)
+
+    response = client.get("/box-office/export")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == movies.to_dict("records")
+    assert client.get("/box-office/export?format=xml").status_code == 400
+
+
+def test_export_chunks(box_office):
+    chunks = list(export.iter_ndjson(box_office.get(), chunk_rows=30))
+    assert [chunk.count(b"\n") for chunk in chunks] == [30, 30, 30, 10]
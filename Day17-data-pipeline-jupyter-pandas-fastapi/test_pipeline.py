@@ -0,0 +1,218 @@
+# Run with: python -m pytest Day17-data-pipeline-jupyter-pandas-fastapi
+import json
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline import dag, load, run, transform  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+# ====== load.py
+@pytest.fixture
+def data_dir(tmp_path):
+    directory = tmp_path / "data"
+    directory.mkdir()
+    for name in ("2018.csv", "2019.csv", "2020.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), directory / name)
+    return directory
+
+
+def test_load_skips_when_nothing_changed(data_dir, tmp_path, monkeypatch):
+    output = str(tmp_path / "cache" / "combined.csv")
+    first = load.load_and_combine(str(data_dir), output)
+    assert first.read == ["2018.csv", "2019.csv", "2020.csv"]
+
+    hashed = []
+    monkeypatch.setattr(
+        load, "file_hash", lambda path: hashed.append(path) or "x"
+    )
+    assert load.load_and_combine(str(data_dir), output).skipped
+    assert hashed == []  # size + mtime matched, nothing was even hashed
+
+
+def test_load_only_rereads_changed_years(data_dir, tmp_path):
+    output = str(tmp_path / "combined.csv")
+    load.load_and_combine(str(data_dir), output)
+    os.utime(data_dir / "2018.csv")  # same contents, not a change
+    with open(data_dir / "2020.csv", "a") as f:
+        f.write('999,New Movie,"$5","$5",100%,-,-\n')
+    os.remove(data_dir / "2019.csv")
+
+    result = load.load_and_combine(str(data_dir), output)
+    assert (result.read, result.removed) == (["2020.csv"], ["2019.csv"])
+    with open(output, "rb") as f:
+        spliced = f.read()
+    assert load.load_and_combine(str(data_dir), output, force=True).rows == (
+        result.rows
+    )
+    with open(output, "rb") as f:
+        assert f.read() == spliced
+    assert b"2019.csv" not in spliced and b"New Movie" in spliced
+
+
+def test_load_with_workers_matches_serial(data_dir, tmp_path):
+    serial = str(tmp_path / "serial.csv")
+    parallel = str(tmp_path / "parallel" / "combined.csv")
+    load.load_and_combine(str(data_dir), serial)
+    result = load.load_and_combine(str(data_dir), parallel, workers=2)
+    assert result.read == ["2018.csv", "2019.csv", "2020.csv"]
+    with open(serial, "rb") as a, open(parallel, "rb") as b:
+        assert a.read() == b.read()
+
+
+# ====== transform.py
+def test_parse_money():
+    values = ["$1,234", "-", "", "$0", "12a", None, "$" + "9" * 19, "$5"]
+    assert transform.parse_money(pd.Series(values)).tolist() == [
+        1234,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        5,
+    ]
+
+
+def test_clean_gives_0_shares_without_worldwide():
+    raw = pd.DataFrame(
+        {
+            "Rank": ["1", "2"],
+            "Release Group": ["A", "B"],
+            "Worldwide": ["-", "$10"],
+            "Domestic": ["-", "$10"],
+            "%": ["-", "100%"],
+            "Foreign": ["-", "-"],
+            "%.1": ["-", "-"],
+            "year": ["2019", "2019"],
+            "filename": ["2019.csv", "2019.csv"],
+        }
+    )
+    df = transform.clean(raw)
+    assert df["Domestic_%"].tolist() == [1.0, 0.0]
+    assert df["Foreign_%"].tolist() == [0.0, 0.0]
+    # So every row is valid JSON
+    json.dumps(df.to_dict("records"), allow_nan=False)
+
+
+def test_clean_matches_the_notebook():
+    raw = pd.DataFrame(
+        {
+            "Rank": ["1", "2", "3"],
+            "Release Group": ["A", "B", "C"],
+            "Worldwide": ["$100", "$300", "$100"],
+            "Domestic": ["$25", "-", "$100"],
+            "%": ["25%", "-", "100%"],
+            "Foreign": ["$75", "$300", "-"],
+            "%.1": ["75%", "100%", "-"],
+            "year": ["2019", "2020", "2019"],
+            "filename": ["2019.csv", "2020.csv", "2019.csv"],
+        }
+    )
+    df = transform.clean(raw)
+    assert list(df.columns) == transform.COLUMNS
+    # Highest Worldwide first, the A/C tie keeps its input order
+    assert df["Release_Group"].tolist() == ["B", "A", "C"]
+    assert df["Rank"].tolist() == [1, 2, 3]
+    assert df["Domestic"].tolist() == [0, 25, 100]
+    assert np.allclose(df["Foreign_%"], [1.0, 0.75, 0.0])
+    assert df["Year"].dtype == np.int64
+
+
+def test_cleanup_and_transform_writes_typed_feather(data_dir, tmp_path):
+    combined = str(tmp_path / "combined.csv")
+    load.load_and_combine(str(data_dir), combined)
+    output = str(tmp_path / "cleaned.csv")
+    output_feather = str(tmp_path / "cleaned.feather")
+    df = transform.cleanup_and_transform(combined, output, output_feather)
+
+    with pa.memory_map(output_feather) as source:
+        table = pa.ipc.open_file(source).read_all()
+    assert table.column_names == transform.COLUMNS
+    assert table.schema.field("Worldwide").type == pa.int64()
+    assert table.schema.field("Domestic_%").type == pa.float64()
+    pd.testing.assert_frame_equal(table.to_pandas(), df)
+    pd.testing.assert_frame_equal(pd.read_csv(output), df)
+
+
+# ====== dag.py / run.py
+def test_run_skips_up_to_date_stages(data_dir, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    state_path = os.path.join(cache_dir, "state.json")
+
+    def run_pipeline(**kwargs):
+        runner = dag.Runner(run.stages(str(data_dir), cache_dir), state_path)
+        return {r.name: r.status for r in runner.run(**kwargs)}
+
+    assert run_pipeline() == {"load": dag.RAN, "transform": dag.RAN}
+    assert os.path.exists(os.path.join(cache_dir, "manifest.json"))
+    assert run_pipeline() == {"load": dag.SKIPPED, "transform": dag.SKIPPED}
+    os.utime(data_dir / "2019.csv")  # same contents
+    assert run_pipeline() == {"load": dag.SKIPPED, "transform": dag.SKIPPED}
+    assert run_pipeline(force=["transform"]) == {
+        "load": dag.SKIPPED,
+        "transform": dag.RAN,
+    }
+    with open(data_dir / "2020.csv", "a") as f:
+        f.write('999,New Movie,"$5","$5",100%,-,-\n')
+    assert run_pipeline() == {"load": dag.RAN, "transform": dag.RAN}
+
+
+def test_runner_runs_independent_stages_together(tmp_path):
+    both_running = threading.Barrier(2, timeout=5)
+
+    def write(path, wait=False):
+        def run():
+            if wait:
+                both_running.wait()  # Times out unless they run together
+            with open(path, "w") as f:
+                f.write(os.path.basename(path))
+
+        return run
+
+    def fail():
+        raise RuntimeError("nope")
+
+    a, b, c = (str(tmp_path / name) for name in "abc")
+    runner = dag.Runner(
+        [
+            dag.Stage("c", write(c), inputs=[a, b], outputs=[c]),
+            dag.Stage("a", write(a, wait=True), outputs=[a]),
+            dag.Stage("b", write(b, wait=True), outputs=[b]),
+            dag.Stage("broken", fail, outputs=[str(tmp_path / "x")]),
+            dag.Stage(
+                "after-broken",
+                write(str(tmp_path / "y")),
+                inputs=[str(tmp_path / "x")],
+            ),
+        ],
+        str(tmp_path / "state.json"),
+        jobs=3,
+    )
+    results = {r.name: r.status for r in runner.run()}
+    assert results == {
+        "a": dag.RAN,
+        "b": dag.RAN,
+        "c": dag.RAN,
+        "broken": dag.FAILED,
+        "after-broken": dag.BLOCKED,
+    }
+    with pytest.raises(ValueError):
+        dag.Runner(
+            [
+                dag.Stage("a", fail, inputs=[b], outputs=[a]),
+                dag.Stage("b", fail, inputs=[a], outputs=[b]),
+            ],
+            str(tmp_path / "state.json"),
+        )
@@ -0,0 +1,219 @@
+"""
+NOTES:
+    - app() used to print() every key/value in 'environ' (~35 lines) on
+      EVERY request. print() to stdout under gunicorn is synchronous, so each
+      request waited on those writes before returning.
+    - AccessLog.log() now just builds a small Dict with the fields we care
+      about and drops it onto a queue.Queue. A background (daemon) thread
+      takes records off the queue, turns them into JSON lines and writes
+      them in batches. The request never waits on I/O.
+    - sample_rate lets us only log a fraction of requests (e.g. 0.01 = 1%).
+      5xx errors and "debug" requests are always logged.
+    - Debug mode is per request: send the debug header with the secret
+      debug token as its value and that request's full 'environ' is
+      logged, like the old print loop:
+        ACCESS_LOG_DEBUG_HEADER=X-Debug ACCESS_LOG_DEBUG_TOKEN=s3cret ...
+        curl -H "X-Debug: s3cret" localhost:8000/box-office
+      It's off unless both are configured: a debug request skips sampling
+      and writes out everything the client sent, so anyone who can send
+      it could flood the log. Even then, cookies, credentials (see
+      REDACTED) and the token itself are never written.
+    - If the queue is full (the writer can't keep up) records are dropped and
+      counted in 'dropped' rather than slowing requests down.
+    - The writer thread is started lazily on the first log() call, so each
+      gunicorn worker gets its own thread after forking.
+    - The writer is a daemon thread, which Python just abandons at exit. So
+      close() is registered with atexit to write out whatever is still
+      queued when a worker exits or gets restarted.
+"""
+
+import atexit
+import hmac
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import typing as t
+
+import settings
+
+# field name -> key in 'environ'
+ENVIRON_FIELDS: t.Dict[str, str] = {
+    "method": "REQUEST_METHOD",
+    "path": "PATH_INFO",
+    "query": "QUERY_STRING",
+    "remote_addr": "REMOTE_ADDR",
+    "user_agent": "HTTP_USER_AGENT",
+    "referer": "HTTP_REFERER",
+}
+# fields that come from the response rather than the request
+RESPONSE_FIELDS: t.Tuple[str, ...] = (
+    "time",
+    "status",
+    "bytes",
+    "duration_ms",
+    "pid",
+)
+FIELDS: t.List[str] = list(ENVIRON_FIELDS) + list(RESPONSE_FIELDS)
+# environ keys whose values never go into a debug record
+REDACTED: t.FrozenSet[str] = frozenset(
+    ["HTTP_COOKIE", "HTTP_AUTHORIZATION", "HTTP_PROXY_AUTHORIZATION"]
+)
+
+
+class AccessLog:
+    """
+    Sampled, structured (JSON lines) access log written off the
+    request thread.
+
+    Params:
+        stream = Where log lines go (default sys.stdout)
+        sample_rate = Fraction of requests to log, 0.0 - 1.0
+        fields = Names from FIELDS to include in each line
+        debug_header = Request header that turns on debug logging
+        debug_token = Value debug_header must have (no token = no debug)
+        queue_size = Max records waiting to be written
+    """
+
+    def __init__(
+        self,
+        stream: t.Optional[t.TextIO] = None,
+        sample_rate: float = 1.0,
+        fields: t.Iterable[str] = ("method", "path", "status"),
+        debug_header: str = "",
+        debug_token: str = "",
+        queue_size: int = 10000,
+    ):
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.fields: t.List[str] = [name.strip() for name in fields]
+        for name in self.fields:
+            if name not in FIELDS:
+                raise ValueError(
+                    f"Unknown access log field {name!r}, pick from {FIELDS}"
+                )
+        # "X-Debug" -> "HTTP_X_DEBUG" which is how it shows up in environ
+        self.debug_key = (
+            "HTTP_" + debug_header.upper().replace("-", "_")
+            if debug_header and debug_token
+            else None
+        )
+        self.debug_token = debug_token.encode("latin-1")
+        self.queue: "queue.Queue[t.Optional[t.Dict]]" = queue.Queue(queue_size)
+        self.dropped = 0
+        self._thread: t.Optional[threading.Thread] = None
+        self._pid: t.Optional[int] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "AccessLog":
+        return cls(
+            sample_rate=settings.ACCESS_LOG_SAMPLE_RATE,
+            fields=settings.ACCESS_LOG_FIELDS,
+            debug_header=settings.ACCESS_LOG_DEBUG_HEADER,
+            debug_token=settings.ACCESS_LOG_DEBUG_TOKEN,
+            queue_size=settings.ACCESS_LOG_QUEUE_SIZE,
+        )
+
+    def is_debug(self, environ: t.Dict) -> bool:
+        if self.debug_key is None:
+            return False
+        value = environ.get(self.debug_key)
+        # Constant time, so the token can't be guessed a byte at a time
+        return value is not None and hmac.compare_digest(
+            value.encode("latin-1"), self.debug_token
+        )
+
+    def log(
+        self, environ: t.Dict, status: str, bytes_sent: int, duration: float
+    ) -> None:
+        """Queue a log record for this request (if it's sampled)."""
+        debug = self.is_debug(environ)
+        if (
+            not debug
+            and status[0] != "5"
+            and (self.sample_rate <= 0 or random.random() >= self.sample_rate)
+        ):
+            return
+
+        response = {
+            "time": round(time.time(), 3),
+            "status": int(status[:3]),
+            "bytes": bytes_sent,
+            "duration_ms": round(duration * 1000, 3),
+            "pid": os.getpid(),
+        }
+        record = {}
+        for name in self.fields:
+            key = ENVIRON_FIELDS.get(name)
+            record[name] = environ.get(key) if key else response[name]
+        if debug:
+            # Same info the old print(k, v) loop showed, minus secrets
+            record["environ"] = {
+                k: (
+                    "[redacted]"
+                    if k in REDACTED or k == self.debug_key
+                    else str(v)
+                )
+                for k, v in environ.items()
+            }
+
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_writer(self) -> None:
+        # A forked worker inherits the Thread object but not the thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue.maxsize)
+            self._thread = threading.Thread(
+                target=self._write_forever, name="access-log", daemon=True
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _write_forever(self) -> None:
+        stream = self.stream or sys.stdout
+        records = self.queue
+        while True:
+            record = records.get()
+            lines = []
+            # Grab everything that's waiting so we write in batches
+            while record is not None:
+                lines.append(json.dumps(record, default=str))
+                try:
+                    record = records.get_nowait()
+                except queue.Empty:
+                    break
+            if lines:
+                stream.write("\n".join(lines) + "\n")
+                stream.flush()
+            if record is None:
+                return
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write out everything that's queued and stop the writer."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+        self._thread = None
+        self._pid = None
+
+
+access_log = AccessLog.from_settings()
+# close() only does something in the process that started the writer
+atexit.register(access_log.close)
@@ -0,0 +1,296 @@
+"""
+NOTES:
+    - ASGI is the async cousin of WSGI. Instead of
+        def app(environ, start_response) -> iterable of bytes
+      an ASGI app is a coroutine:
+        async def app(scope, receive, send)
+      'scope' is like environ, 'receive' gives us the request body and
+      'send' sends the status/headers and body chunks as Dicts.
+    - A sync gunicorn worker is busy for the whole request, including
+      waiting on slow clients. An ASGI server (uvicorn) runs one event loop
+      that can keep thousands of idle keep-alive connections open in one
+      process, e.g. all our clients polling /box-office.
+    - We don't rewrite the handlers as 'async def'. They use NumPy, read
+      files and format templates, which are all blocking. So asgi_app turns
+      the ASGI scope into a WSGI environ and runs the exact same app as
+      server.py (router, templates, dataset, caching, compression) in a
+      bounded thread pool (ASGI_THREADS). The event loop itself never
+      blocks, it just shuffles bytes.
+    - Pulling the next chunk of a streamed body may also block (formatting
+      rows, reading a file), so that runs in the pool too. Bodies that are
+      already in memory (iter([data])) are sent straight from the loop.
+    - Request bodies over MAX_BODY_SIZE get a 413 before the app ever
+      runs. If the client hangs up while we stream a body to it, we stop
+      pulling chunks (and stop keeping a pool thread busy for nobody).
+    - There's no wsgi.file_wrapper here, so static.py reads files in
+      chunks in the pool instead of using sendfile().
+    - Start it with:
+        uvicorn asgi:asgi_app
+      and gunicorn server:app keeps working as before.
+"""
+
+import asyncio
+import sys
+import tempfile
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from access_log import access_log
+from server import app, preload
+
+# Request bodies bigger than this are spooled to a temp file
+SPOOL_MAX_SIZE = 1024 * 1024
+
+_DONE = object()
+_LIST_ITER = type(iter([]))
+
+
+def _wsgi_str(value: str) -> str:
+    # WSGI strings are bytes decoded as latin-1, ASGI gives us utf-8 str
+    return value.encode("utf-8").decode("latin-1")
+
+
+def build_environ(scope: t.Dict, body: t.BinaryIO) -> t.Dict:
+    """Turn an ASGI http scope into a WSGI environ Dict."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    client = scope.get("client")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": _wsgi_str(scope.get("root_path", "")),
+        "PATH_INFO": _wsgi_str(scope["path"]),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "SERVER_SOFTWARE": "asgi_app",
+        "REMOTE_ADDR": client[0] if client else "",
+        "REMOTE_PORT": str(client[1]) if client else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        # We read the whole body first, so it's safe to read it to EOF
+        "wsgi.input_terminated": True,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        if name in environ:
+            # Repeated headers are joined like a WSGI server would
+            separator = "; " if name == "HTTP_COOKIE" else ", "
+            value = environ[name] + separator + value
+        environ[name] = value
+    return environ
+
+
+class _Disconnected(Exception):
+    """The client went away before sending the whole request."""
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class ASGIApp:
+    """
+    Serve a WSGI app over ASGI, running it in a thread pool.
+
+    Params:
+        wsgi_app = The app to run, e.g. server.app
+        threads = Max threads running the app at once
+        max_body_size = Largest request body we accept (bytes)
+    """
+
+    def __init__(
+        self, wsgi_app, threads: int = 32, max_body_size: int = 1024 * 1024
+    ):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_body_size = max_body_size
+        self._executor: t.Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.threads, thread_name_prefix="asgi"
+            )
+        return self._executor
+
+    async def __call__(self, scope: t.Dict, receive, send) -> None:
+        if scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+
+    async def lifespan(self, receive, send) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Load the dataset etc. before the first request needs it
+                try:
+                    await loop.run_in_executor(self.executor, preload)
+                except Exception as e:
+                    await send(
+                        {"type": "lifespan.startup.failed", "message": repr(e)}
+                    )
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+                access_log.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_body(self, scope: t.Dict, receive) -> t.BinaryIO:
+        """
+        Read the whole request body, up to max_body_size.
+
+        Raises:
+            _BodyTooLarge, _Disconnected
+        """
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit():
+                if int(value) > self.max_body_size:
+                    raise _BodyTooLarge()
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        size = 0
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    raise _Disconnected()
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > self.max_body_size:
+                    raise _BodyTooLarge()
+                body.write(chunk)
+                more_body = message.get("more_body", False)
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body
+
+    def run_app(self, environ: t.Dict) -> t.Tuple[str, t.List, t.List, t.Any]:
+        """Call the WSGI app (in a pool thread)."""
+        started: t.Dict[str, t.Any] = {}
+        written: t.List[bytes] = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started["status"] = status
+            started["headers"] = headers
+            # The old WSGI write() API, for completeness
+            return written.append
+
+        body = self.wsgi_app(environ, start_response)
+        return started["status"], started["headers"], written, body
+
+    async def http(self, scope: t.Dict, receive, send) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            request_body = await self.read_body(scope, receive)
+        except _Disconnected:
+            return
+        except _BodyTooLarge:
+            await send_error(send, 413, "Request body too large")
+            return
+        environ = build_environ(scope, request_body)
+        try:
+            status, headers, written, body = await loop.run_in_executor(
+                self.executor, self.run_app, environ
+            )
+        except Exception:
+            request_body.close()
+            await send_error(send, 500, "Internal Server Error")
+            raise
+
+        # The only thing left to receive is http.disconnect
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": int(status[:3]),
+                    "headers": [
+                        (
+                            name.lower().encode("latin-1"),
+                            value.encode("latin-1"),
+                        )
+                        for name, value in headers
+                    ],
+                }
+            )
+            for chunk in written:
+                await send_chunk(send, chunk)
+
+            chunks: t.Iterator[bytes] = iter(body)
+            # e.g. iter([data]) from send_response(), no need for a thread
+            in_memory = isinstance(body, list) or type(chunks) is _LIST_ITER
+            while not disconnected.is_set():
+                if in_memory:
+                    chunk = next(chunks, _DONE)
+                else:
+                    chunk = await loop.run_in_executor(
+                        self.executor, next, chunks, _DONE
+                    )
+                if chunk is _DONE:
+                    break
+                await send_chunk(send, chunk)
+            if not disconnected.is_set():
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+            # Always close it, even when the client went away: that's
+            # where StreamingBody logs and files get closed
+            close = getattr(body, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+            request_body.close()
+
+
+async def send_chunk(send, chunk: bytes) -> None:
+    if chunk:
+        await send(
+            {"type": "http.response.body", "body": chunk, "more_body": True}
+        )
+
+
+async def send_error(send, status: int, message: str) -> None:
+    data = message.encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(data)).encode("latin-1")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": data})
+
+
+# uvicorn asgi:asgi_app
+asgi_app = ASGIApp(
+    app, threads=settings.ASGI_THREADS, max_body_size=settings.MAX_BODY_SIZE
+)
@@ -0,0 +1,340 @@
+"""
+NOTES:
+    - Reproducible load test for server.py. It starts the app itself,
+      hammers a few paths at fixed concurrency levels and writes the
+      numbers to a JSON file (bench-results.json next to this file unless
+      --output says otherwise, wherever it's run from):
+        python bench.py                      # wsgiref, in this process
+        python bench.py --server gunicorn --workers 4
+        python bench.py --output new.json --compare old.json
+    - Servers:
+        wsgiref = the standard library's server (one thread per
+            connection) running in a thread of THIS process. No extra
+            dependencies, but our client threads share the GIL with it,
+            so the numbers are lower than the real thing.
+        gunicorn = 'gunicorn server:app' in a separate process (or
+            'python run.py' with --preload), the way we deploy it.
+    - The client is one thread per concurrent "user", each with its own
+      keep-alive http.client connection (reconnecting when the server
+      closes it, e.g. wsgiref speaks HTTP/1.0). Every level first warms up
+      for a moment so dataset loading/template compiling isn't measured.
+    - For every path + concurrency we report requests/second, p50/p95/p99
+      latency (ms), errors (5xx or connection errors), and the server's RSS
+      afterwards (VmRSS from /proc, master + workers for gunicorn), so it
+      needs Linux.
+    - --compare prints the change against an older results file and exits
+      with status 1 if req/s dropped or p99 grew by more than --threshold
+      (default 20%). That's what CI runs between versions.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import typing as t
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_PATHS = [
+    "/",
+    "/contact",
+    "/box-office?movies=10",
+    "/box-office?movies=1000",
+    "/no-such-page",
+]
+DEFAULT_CONCURRENCY = [1, 8, 32]
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kib(pids: t.Iterable[int]) -> int:
+    """Total VmRSS of some processes, in KiB (0 for ones that are gone)."""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+def _children(pid: int) -> t.List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+class Server:
+    """Runs the app on a free port, see the NOTES above."""
+
+    def __init__(
+        self, kind: str = "wsgiref", workers: int = 1, preload: bool = False
+    ):
+        self.kind = kind
+        self.workers = workers
+        self.preload = preload
+        self.port = _free_port()
+        self._httpd = None
+        self._process: t.Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "Server":
+        # Writing an access log line per request isn't what we're measuring
+        os.environ.setdefault("ACCESS_LOG_SAMPLE_RATE", "0")
+        if self.kind == "wsgiref":
+            sys.path.insert(0, BASE_DIR)
+            from server import app
+
+            self._httpd = make_server(
+                "127.0.0.1",
+                self.port,
+                app,
+                server_class=_ThreadingWSGIServer,
+                handler_class=_QuietHandler,
+            )
+            threading.Thread(
+                target=self._httpd.serve_forever, daemon=True
+            ).start()
+        else:
+            bind = f"127.0.0.1:{self.port}"
+            if self.preload:
+                command = [sys.executable, "run.py", "--bind", bind]
+                command += ["--workers", str(self.workers)]
+            else:
+                command = [sys.executable, "-m", "gunicorn", "server:app"]
+                command += ["--bind", bind, "--workers", str(self.workers)]
+            self._process = subprocess.Popen(
+                command,
+                cwd=BASE_DIR,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        self._wait_until_up()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait(10)
+
+    def _wait_until_up(self, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.kind} didn't start on port {self.port}")
+
+    def pids(self) -> t.List[int]:
+        if self._process is None:
+            return [os.getpid()]
+        return [self._process.pid] + _children(self._process.pid)
+
+
+def _client(
+    port: int,
+    path: str,
+    stop_at: float,
+    latencies: t.List[float],
+    errors: t.List[int],
+) -> None:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        try:
+            connection.request("GET", path, headers={"Accept-Encoding": "gzip"})
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors[0] += 1
+            if response.will_close:
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            errors[0] += 1
+            connection.close()
+            continue
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+
+
+def percentile(values: t.Sequence[float], q: float) -> float:
+    """values must be sorted"""
+    if not values:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def run_level(
+    server: Server,
+    path: str,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+) -> t.Dict[str, t.Any]:
+    """Drive one path with 'concurrency' clients for 'duration' seconds."""
+    results = []
+    for seconds in (warmup, duration):
+        stop_at = time.monotonic() + seconds
+        # One list per thread, list.append() is all they share
+        latencies: t.List[t.List[float]] = [[] for _ in range(concurrency)]
+        errors = [[0] for _ in range(concurrency)]
+        threads = [
+            threading.Thread(
+                target=_client,
+                args=(server.port, path, stop_at, latencies[i], errors[i]),
+            )
+            for i in range(concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results.append((time.perf_counter() - started, latencies, errors))
+
+    elapsed, latencies, errors = results[-1]
+    merged = sorted(value for values in latencies for value in values)
+    return {
+        "path": path,
+        "concurrency": concurrency,
+        "requests": len(merged),
+        "errors": sum(error[0] for error in errors),
+        "rps": round(len(merged) / elapsed, 1),
+        "p50_ms": round(percentile(merged, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(merged, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(merged, 0.99) * 1000, 3),
+        "rss_kib": rss_kib(server.pids()),
+    }
+
+
+def _git_version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(
+    old: t.Dict[str, t.Any], new: t.Dict[str, t.Any], threshold: float
+) -> t.List[str]:
+    """Return a line for every regression bigger than threshold."""
+    before = {(r["path"], r["concurrency"]): r for r in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        previous = before.get((result["path"], result["concurrency"]))
+        if previous is None:
+            continue
+        label = f"{result['path']} c={result['concurrency']}"
+        rps_change = result["rps"] / max(previous["rps"], 1e-9) - 1
+        p99_change = result["p99_ms"] / max(previous["p99_ms"], 1e-9) - 1
+        print(
+            f"{label:40} req/s {previous['rps']:>9} -> {result['rps']:>9} "
+            f"({rps_change:+.0%})  p99 {previous['p99_ms']:>8} -> "
+            f"{result['p99_ms']:>8} ms ({p99_change:+.0%})"
+        )
+        if rps_change < -threshold:
+            regressions.append(f"{label}: req/s {rps_change:+.0%}")
+        if p99_change > threshold:
+            regressions.append(f"{label}: p99 {p99_change:+.0%}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark server.py")
+    parser.add_argument(
+        "--server", choices=["wsgiref", "gunicorn"], default="wsgiref"
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--preload", action="store_true", help="Use run.py for gunicorn"
+    )
+    parser.add_argument("--path", action="append", dest="paths")
+    parser.add_argument(
+        "--concurrency", type=int, action="append", dest="levels"
+    )
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument(
+        "--output", default=os.path.join(BASE_DIR, "bench-results.json")
+    )
+    parser.add_argument("--compare", help="Older results file to check")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report: t.Dict[str, t.Any] = {
+        "version": _git_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "server": args.server,
+        "workers": 1 if args.server == "wsgiref" else args.workers,
+        "duration": args.duration,
+        "results": [],
+    }
+    with Server(args.server, args.workers, args.preload) as server:
+        for path in args.paths or DEFAULT_PATHS:
+            for concurrency in args.levels or DEFAULT_CONCURRENCY:
+                result = run_level(
+                    server, path, concurrency, args.duration, args.warmup
+                )
+                report["results"].append(result)
+                print(
+                    f"{path:40} c={concurrency:<4} {result['rps']:>9} req/s  "
+                    f"p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8}"
+                    f" ms  errors {result['errors']}  rss "
+                    f"{result['rss_kib'] // 1024} MiB"
+                )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(old, report, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
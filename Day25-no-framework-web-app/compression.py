@@ -0,0 +1,308 @@
+"""
+NOTES:
+    - WSGI "middleware" is just a WSGI app that wraps another WSGI app. It
+      gets the request first and sees the response on the way out, so it
+      can change either one without the inner app knowing about it:
+        app = CompressionMiddleware(app)
+    - Browsers tell us what they can decode in HTTP_ACCEPT_ENCODING
+      (e.g. "gzip, deflate, br"). We pick the best one we support, honouring
+      q-values ("gzip;q=0.5, br;q=1.0"). br needs the optional 'brotli'
+      package; without it we just never offer br.
+    - Only text-ish Content-Types above 'min_size' bytes are compressed.
+      Small bodies don't shrink enough to be worth the CPU.
+    - Buffered responses (ones with a Content-Length) are compressed once
+      and the result is kept in the response cache under "<etag>|<encoding>",
+      so a popular page is only ever gzipped once per version.
+    - Streamed responses (no Content-Length) are compressed chunk by chunk
+      with a streaming compressor that flushes after every chunk, so the
+      client still gets rows as soon as they're ready.
+    - Files served by static.py (they send Accept-Ranges) are left alone so
+      sendfile() and Range requests keep working. They use precompressed
+      .gz files instead.
+    - A compressed body is different bytes, so it needs a different STRONG
+      ETag: we add "-gzip"/"-br"/"-deflate" to it, but only when we really
+      compress the body. When the client sends that ETag back in
+      If-None-Match we strip the suffix (for the encoding we'd use now)
+      before the inner app compares it, and a 304 repeats exactly the ETag
+      the client sent, i.e. the one from the 200 it has. Every response we
+      could compress gets "Vary: Accept-Encoding" so shared caches keep the
+      variants apart.
+"""
+
+import typing as t
+import zlib
+
+import settings
+from metrics import phase
+from response import Response
+from response_cache import response_cache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+class _ZlibEncoder:
+    """Streaming gzip/deflate compressor."""
+
+    def __init__(self, wbits: int, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data: bytes) -> bytes:
+        # Z_SYNC_FLUSH pushes out everything so far without ending the stream
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    """Streaming brotli compressor."""
+
+    def __init__(self, level: int):
+        # Brotli quality goes 0-11, zlib levels 1-9. Stay fast per request.
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+# Content-Encoding -> function(level) returning an encoder, best first
+ENCODERS: t.Dict[str, t.Callable[[int], t.Any]] = {}
+if brotli is not None:
+    ENCODERS["br"] = _BrotliEncoder
+ENCODERS["gzip"] = lambda level: _ZlibEncoder(16 + zlib.MAX_WBITS, level)
+ENCODERS["deflate"] = lambda level: _ZlibEncoder(zlib.MAX_WBITS, level)
+
+
+def parse_accept_encoding(accept_encoding: str) -> t.Dict[str, float]:
+    """ "gzip;q=0.5, br" -> {"gzip": 0.5, "br": 1.0}"""
+    qualities: t.Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            qualities[name.strip().lower()] = quality
+    return qualities
+
+
+def accepts(accept_encoding: str, encoding: str) -> bool:
+    """Does the Accept-Encoding header allow this encoding?"""
+    qualities = parse_accept_encoding(accept_encoding)
+    return qualities.get(encoding, qualities.get("*", 0.0)) > 0
+
+
+def negotiate(accept_encoding: str) -> t.Optional[str]:
+    """
+    Pick a Content-Encoding from an Accept-Encoding header.
+    "gzip, deflate, br" -> "br" (or "gzip" without brotli installed)
+    """
+    if not accept_encoding:
+        return None
+    qualities = parse_accept_encoding(accept_encoding)
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODERS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        # ENCODERS is in order of preference, so ties keep the first
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _get_header(
+    headers: t.List[t.Tuple[str, str]], name: str
+) -> t.Optional[str]:
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(
+    headers: t.List[t.Tuple[str, str]], *names: str
+) -> t.List[t.Tuple[str, str]]:
+    names = tuple(name.lower() for name in names)
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+def _with_vary(headers: t.List[t.Tuple[str, str]]) -> t.List[t.Tuple[str, str]]:
+    vary = _get_header(headers, "Vary")
+    if not vary:
+        return headers + [("Vary", "Accept-Encoding")]
+    if "accept-encoding" not in vary.lower():
+        return _without(headers, "Vary") + [
+            ("Vary", f"{vary}, Accept-Encoding")
+        ]
+    return headers
+
+
+def _variant_etag(etag: str, encoding: str) -> str:
+    # '"abc"' -> '"abc-gzip"'
+    return f'{etag[:-1]}-{encoding}"'
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with gzip/deflate/br based on Accept-Encoding.
+
+    Params:
+        app = The WSGI app to wrap
+        min_size = Don't compress bodies smaller than this (bytes)
+        level = Compression level (zlib 1-9)
+        types = Content-Types (without ;charset) worth compressing
+    """
+
+    def __init__(
+        self,
+        app,
+        min_size: int = 1024,
+        level: int = 6,
+        types: t.Iterable[str] = ("text/html", "application/json"),
+    ):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.types = frozenset(types)
+
+    def _strip_etag_suffix(
+        self, environ: t.Dict, encoding: t.Optional[str]
+    ) -> bool:
+        """
+        Turn '"abc-gzip"' back into '"abc"' in If-None-Match so the inner
+        app can compare it. Returns True if the client sent a suffix.
+        """
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        if not if_none_match or encoding is None:
+            return False
+        suffix = f'-{encoding}"'
+        if suffix not in if_none_match:
+            return False
+        environ["HTTP_IF_NONE_MATCH"] = if_none_match.replace(suffix, '"')
+        return True
+
+    def __call__(self, environ: t.Dict, start_response):
+        encoding = negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        # Only an ETag we added ourselves, so only for compressed 200s
+        sent_variant = self._strip_etag_suffix(environ, encoding)
+
+        captured: t.Dict[str, t.Any] = {}
+
+        def capture(status, headers, exc_info=None):
+            captured["status"] = status
+            captured["headers"] = headers
+            captured["exc_info"] = exc_info
+
+        body = self.app(environ, capture)
+        status: str = captured["status"]
+        headers: t.List[t.Tuple[str, str]] = captured["headers"]
+
+        etag = _get_header(headers, "ETag")
+        if status[:3] == "304":
+            # A 304 must repeat the ETag of the 200 the client has. If that
+            # was a compressed one, the client sent us its variant ETag.
+            if sent_variant and etag is not None:
+                headers = _without(headers, "ETag") + [
+                    ("ETag", _variant_etag(etag, encoding))
+                ]
+            start_response(status, _with_vary(headers), captured["exc_info"])
+            return body
+
+        content_type = (_get_header(headers, "Content-Type") or "").split(";")
+        if content_type[0].strip() not in self.types:
+            start_response(status, headers, captured["exc_info"])
+            return body
+        headers = _with_vary(headers)
+
+        length = _get_header(headers, "Content-Length")
+        if (
+            encoding is None
+            or not status.startswith("200")
+            or environ.get("REQUEST_METHOD") == "HEAD"
+            or _get_header(headers, "Content-Encoding") is not None
+            # Files from static.py are sent byte for byte (sendfile/Range)
+            or _get_header(headers, "Accept-Ranges") is not None
+            or (length is not None and int(length) < self.min_size)
+        ):
+            start_response(status, headers, captured["exc_info"])
+            return body
+
+        headers = _without(headers, "Content-Length")
+        headers.append(("Content-Encoding", encoding))
+        if etag is not None:
+            # Same body, different bytes on the wire -> different ETag
+            headers = _without(headers, "ETag") + [
+                ("ETag", _variant_etag(etag, encoding))
+            ]
+
+        if length is None:
+            # Streamed response, compress as the chunks come through
+            start_response(status, headers, captured["exc_info"])
+            return _CompressedStream(body, ENCODERS[encoding](self.level))
+
+        with phase(environ, "encode"):
+            data = self._compress_buffered(body, encoding, etag)
+        headers.append(("Content-Length", str(len(data))))
+        start_response(status, headers, captured["exc_info"])
+        return iter([data])
+
+    def _compress_buffered(
+        self, body: t.Iterable[bytes], encoding: str, etag: t.Optional[str]
+    ) -> bytes:
+        try:
+            raw = b"".join(body)
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+
+        key = f"{etag}|{encoding}" if etag is not None else None
+        if key is not None:
+            cached = response_cache.get(key, f"compressed:{encoding}")
+            if cached is not None:
+                return cached.body
+
+        encoder = ENCODERS[encoding](self.level)
+        data = encoder.compress(raw) + encoder.finish()
+        if key is not None:
+            response_cache.put(
+                key,
+                Response(data),
+                settings.RESPONSE_CACHE_TTL,
+                f"compressed:{encoding}",
+            )
+        return data
+
+
+class _CompressedStream:
+    """WSGI iterable that compresses another iterable chunk by chunk."""
+
+    def __init__(self, body: t.Iterable[bytes], encoder):
+        self.body = body
+        self.encoder = encoder
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        for chunk in self.body:
+            if chunk:
+                compressed = self.encoder.compress(chunk)
+                if compressed:
+                    yield compressed
+        yield self.encoder.finish()
+
+    def close(self) -> None:
+        close = getattr(self.body, "close", None)
+        if close is not None:
+            close()
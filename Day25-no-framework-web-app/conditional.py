@@ -0,0 +1,158 @@
+"""
+NOTES:
+    - Our pages only change when the template file, the dataset CSV or our
+      code changes. So we can tell the browser/CDN "you already have this"
+      without rendering anything at all.
+    - An ETag is a fingerprint of a response. We build a STRONG one by
+      hashing everything the page depends on: the path + query string, the
+      template mtimes, the dataset version and CODE_VERSION. Since we don't
+      need the rendered page to compute it, a matching If-None-Match skips
+      the handler entirely and we answer "304 Not Modified" with no body.
+    - Last-Modified is the newest mtime of those same inputs, so clients
+      that only send If-Modified-Since get 304s too. (If-None-Match wins
+      when both are sent, as the HTTP spec says.)
+    - Cache-Control: max-age lets browsers/CDNs reuse the page for a while
+      without even asking. Box-office data changes about once a day.
+    - The query string is normalized first (sorted keys), so ?a=1&b=2 and
+      ?b=2&a=1 get the same ETag. The ETag is also the key for the server
+      side response cache (see response_cache.py), 'ttl' is how long an
+      entry lives there.
+    - Mark a route handler with @cacheable(...) to turn all this on:
+        @router.route("/box-office")
+        @cacheable(templates=["box_office.html"], datasets=[box_office])
+        def read_box_office_data(environ): ...
+"""
+
+import email.utils
+import hashlib
+import typing as t
+
+import settings
+from request import normalize_query
+from templates import engine
+
+
+class Conditional:
+    """
+    What a route's response depends on, used to build its validators
+    (ETag + Last-Modified) without rendering it.
+
+    Params:
+        templates = Template names the handler renders
+        datasets = DatasetStores the handler reads from
+        max_age = Seconds for Cache-Control: max-age
+        version = Anything else the output depends on (e.g. code version)
+        ttl = Seconds to keep the rendered page in the response cache
+        variant = function(environ) -> str for anything else the response
+            depends on, e.g. the format picked from the Accept header.
+            Adds "Vary: Accept".
+    """
+
+    def __init__(
+        self,
+        templates: t.Iterable[str] = (),
+        datasets: t.Iterable[t.Any] = (),
+        max_age: t.Optional[int] = None,
+        version: str = "",
+        ttl: t.Optional[float] = None,
+        variant: t.Optional[t.Callable[[t.Dict], str]] = None,
+    ):
+        self.templates = tuple(templates)
+        self.datasets = tuple(datasets)
+        self.max_age = settings.CACHE_MAX_AGE if max_age is None else max_age
+        self.version = version
+        self.ttl = settings.RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.variant = variant
+
+    def validators(self, environ: t.Dict) -> t.Tuple[str, float]:
+        """Return (strong ETag, Last-Modified timestamp) for a request."""
+        parts = [
+            self.version,
+            environ.get("PATH_INFO", ""),
+            normalize_query(environ.get("QUERY_STRING", "")),
+        ]
+        if self.variant is not None:
+            parts.append(self.variant(environ))
+        last_modified = 0.0
+        for template_name in self.templates:
+            mtime_ns = engine.get_template(template_name).mtime_ns
+            parts.append(str(mtime_ns))
+            last_modified = max(last_modified, mtime_ns / 1e9)
+        for store in self.datasets:
+            dataset = store.get()
+            parts.append(dataset.version)
+            last_modified = max(last_modified, dataset.mtime)
+        digest = hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+        return f'"{digest[:24]}"', last_modified
+
+    def headers(
+        self, etag: str, last_modified: float
+    ) -> t.List[t.Tuple[str, str]]:
+        headers = [
+            ("ETag", etag),
+            ("Last-Modified", http_date(last_modified)),
+            ("Cache-Control", f"public, max-age={self.max_age}"),
+        ]
+        if self.variant is not None:
+            headers.append(("Vary", "Accept"))
+        return headers
+
+
+def cacheable(
+    templates: t.Iterable[str] = (),
+    datasets: t.Iterable[t.Any] = (),
+    max_age: t.Optional[int] = None,
+    version: str = "",
+    ttl: t.Optional[float] = None,
+    variant: t.Optional[t.Callable[[t.Dict], str]] = None,
+) -> t.Callable:
+    """Decorator that attaches a Conditional to a route handler."""
+
+    def decorator(handler):
+        handler.conditional = Conditional(
+            templates, datasets, max_age, version, ttl, variant
+        )
+        return handler
+
+    return decorator
+
+
+def http_date(timestamp: float) -> str:
+    """1596000000 -> 'Wed, 29 Jul 2020 05:20:00 GMT'"""
+    return email.utils.formatdate(int(timestamp), usegmt=True)
+
+
+def parse_http_date(value: str) -> t.Optional[float]:
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header ('"abc", W/"def"' or '*') against
+    our ETag. If-None-Match uses weak comparison, so W/ is ignored.
+    """
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def is_not_modified(environ: t.Dict, etag: str, last_modified: float) -> bool:
+    """Should this GET/HEAD be answered with 304 Not Modified?"""
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+    if if_modified_since is not None:
+        since = parse_http_date(if_modified_since)
+        # HTTP dates only have 1 second precision
+        return since is not None and int(last_modified) <= since
+    return False
@@ -0,0 +1,414 @@
+"""
+NOTES:
+    - read_box_office_data() used to pd.read_csv() the whole cleaned dataset
+      (~12k rows) and then build a List[Dict] of every row with
+      df.to_dict("records") on EVERY request, just to show a handful of rows.
+    - Now the CSV is loaded ONCE per process into a Dataset: a Dict of
+      NumPy arrays (one per column). Numbers get compact fixed-width dtypes
+      (int32 Rank, int16 Year, etc.) and repeated strings like Filename are
+      stored as small integer codes + a lookup array of unique values.
+    - DatasetStore.get() hands out the current Dataset. Every
+      'check_interval' seconds it checks the CSV's mtime, and when the file
+      changed it loads a brand new Dataset and swaps the reference in one
+      assignment. Requests already holding the old Dataset keep using it, so
+      nobody ever sees a half-loaded dataset.
+    - Handlers ask for just the rows they need with head(n) or rows(start,
+      stop). Only those rows are turned into Dicts.
+    - query() answers sort/filter/pagination requests from indexes that are
+      built lazily the first time they're needed and then kept on the
+      Dataset (so they're thrown away together with it on reload):
+        * sort orders: np.argsort() of a column, plus the inverse
+          "position in that order" array so a small filtered subset can be
+          put in sorted order without sorting the whole column again.
+        * group indexes: value -> array of row positions (e.g. Year).
+        * a prefix index: casefolded titles sorted once, so a title prefix
+          is two np.searchsorted() calls.
+      An unfiltered page is just order[offset:offset + limit].
+    - to_shared() copies every column into ONE anonymous mmap. Anonymous
+      mmaps are MAP_SHARED, so when run.py loads the Dataset in the master
+      process and then forks, every worker reads the very same physical
+      pages instead of getting its own copy of the data. (Plain NumPy
+      arrays are shared copy-on-write after a fork too, but only until
+      something writes near them.) Python str objects can't live in a
+      buffer, so string columns are stored as all their UTF-8 bytes back to
+      back plus an array of where each row starts, and only the rows a
+      request needs are decoded.
+"""
+
+import mmap
+import os
+import threading
+import time
+import typing as t
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+BOX_OFFICE_CSV = os.path.join(DATA_DIR, "movies-box-office-dataset-cleaned.csv")
+
+# Column name -> NumPy dtype. "category" columns are stored as codes.
+BOX_OFFICE_SCHEMA: t.Dict[str, str] = {
+    "Rank": "int32",
+    "Release_Group": "object",
+    "Worldwide": "int64",
+    "Domestic": "int64",
+    "Domestic_%": "float64",
+    "Foreign": "int64",
+    "Foreign_%": "float64",
+    "Year": "int16",
+    "Filename": "category",
+}
+
+
+class Dataset:
+    """
+    An immutable, column oriented snapshot of a CSV file.
+
+    Params:
+        columns = Column name -> NumPy array (all the same length)
+        categories = Column name -> array of unique values for
+            columns stored as integer codes
+        version = Identifies the source file contents (size + mtime)
+        strings = Column name -> (UTF-8 bytes, row start offsets) for
+            string columns packed into a buffer (see to_shared())
+    """
+
+    def __init__(
+        self,
+        columns: t.Dict[str, np.ndarray],
+        categories: t.Optional[t.Dict[str, np.ndarray]] = None,
+        version: str = "",
+        mtime: float = 0.0,
+        strings: t.Optional[
+            t.Dict[str, t.Tuple[np.ndarray, np.ndarray]]
+        ] = None,
+        names: t.Optional[t.List[str]] = None,
+    ):
+        self.columns = columns
+        self.categories = categories or {}
+        self.strings = strings or {}
+        self.names: t.List[str] = names or list(columns)
+        self.version = version
+        self.mtime = mtime
+        self.length = len(next(iter(columns.values()))) if columns else 0
+        for array in columns.values():
+            array.setflags(write=False)
+        for data, offsets in self.strings.values():
+            self.length = len(offsets) - 1
+            data.setflags(write=False)
+            offsets.setflags(write=False)
+        # Lazily built indexes, see sort_order()/group_index()/prefix_index()
+        self._indexes: t.Dict[t.Tuple, t.Any] = {}
+
+    def __len__(self) -> int:
+        return self.length
+
+    def column(self, name: str) -> np.ndarray:
+        """Return the decoded values of a column."""
+        if name in self.strings:
+            values = np.empty(self.length, dtype=object)
+            values[:] = self._decode(name, slice(None))
+            return values
+        values = self.columns[name]
+        if name in self.categories:
+            return self.categories[name][values]
+        return values
+
+    def _decode(
+        self, name: str, selection: t.Union[slice, np.ndarray]
+    ) -> t.List[str]:
+        data, offsets = self.strings[name]
+        rows = np.arange(self.length)[selection]
+        view = memoryview(data)
+        return [
+            str(view[start:end], "utf-8")
+            for start, end in zip(
+                offsets[rows].tolist(), offsets[rows + 1].tolist()
+            )
+        ]
+
+    def _to_rows(
+        self, selection: t.Union[slice, np.ndarray]
+    ) -> t.List[t.Dict[str, t.Any]]:
+        # .tolist() turns NumPy scalars back into plain int/float/str
+        values = []
+        for name in self.names:
+            if name in self.strings:
+                values.append(self._decode(name, selection))
+                continue
+            column = self.columns[name][selection]
+            if name in self.categories:
+                column = self.categories[name][column]
+            values.append(column.tolist())
+        return [dict(zip(self.names, row)) for row in zip(*values)]
+
+    def rows(
+        self, start: int = 0, stop: t.Optional[int] = None
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """Materialize rows[start:stop] as a List of Dicts."""
+        return self._to_rows(slice(start, stop))
+
+    def head(self, n: int) -> t.List[t.Dict[str, t.Any]]:
+        return self.rows(0, max(n, 0))
+
+    def take(self, indices: t.Sequence[int]) -> t.List[t.Dict[str, t.Any]]:
+        """Materialize the rows at the given positions, in that order."""
+        return self._to_rows(np.asarray(indices, dtype=np.intp))
+
+    def iter_chunks(
+        self, indices: t.Sequence[int], chunk_size: int = 500
+    ) -> t.Iterator[t.List[t.Dict[str, t.Any]]]:
+        """
+        Like take() but yields the rows chunk_size at a time, so only
+        one chunk of Dicts exists at once.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        for start in range(0, len(indices), chunk_size):
+            yield self._to_rows(indices[start : start + chunk_size])
+
+    def memoize(self, key: t.Hashable, build: t.Callable[[], t.Any]) -> t.Any:
+        """
+        Compute something from this Dataset once and keep it for as
+        long as this version of the data is around.
+        """
+        value = self._indexes.get(key)
+        if value is None:
+            value = self._indexes[key] = build()
+        return value
+
+    def sort_order(
+        self, name: str, descending: bool = False
+    ) -> t.Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (order, position) for a column where order lists row
+        positions sorted by the column and position[row] is where that
+        row lands in order. Ties keep the original (Rank) order.
+        """
+        key = ("sort", name, descending)
+        index = self._indexes.get(key)
+        if index is None:
+            values = self.column(name)
+            if values.dtype == object:
+                values = np.array([str(v).casefold() for v in values])
+            if descending:
+                # Sort the reversed column then flip back, so ties still
+                # come out in their original (Rank) order.
+                reverse = np.argsort(values[::-1], kind="stable")
+                order = (self.length - 1 - reverse)[::-1]
+            else:
+                order = np.argsort(values, kind="stable")
+            position = np.empty(self.length, dtype=np.intp)
+            position[order] = np.arange(self.length)
+            index = self._indexes[key] = (order, position)
+        return index
+
+    def group_index(self, name: str) -> t.Dict[t.Any, np.ndarray]:
+        """Return value -> row positions (in row order) for a column."""
+        key = ("group", name)
+        index = self._indexes.get(key)
+        if index is None:
+            values = self.column(name)
+            order = np.argsort(values, kind="stable")
+            uniques, starts = np.unique(values[order], return_index=True)
+            groups = np.split(order, starts[1:])
+            index = self._indexes[key] = dict(zip(uniques.tolist(), groups))
+        return index
+
+    def prefix_index(self, name: str) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Return (sorted casefolded values, row positions) for a column."""
+        key = ("prefix", name)
+        index = self._indexes.get(key)
+        if index is None:
+            folded = np.array([str(v).casefold() for v in self.column(name)])
+            order = np.argsort(folded, kind="stable")
+            index = self._indexes[key] = (folded[order], order)
+        return index
+
+    def query(
+        self,
+        sort: t.Optional[str] = None,
+        descending: bool = False,
+        filters: t.Optional[t.Dict[str, t.Any]] = None,
+        prefix: t.Optional[t.Tuple[str, str]] = None,
+        offset: int = 0,
+        limit: t.Optional[int] = None,
+    ) -> t.Tuple[int, np.ndarray]:
+        """
+        Find the row positions for one page of results.
+
+        Params:
+            sort = Column to order by (default: row order, i.e. Rank)
+            descending = Reverse the sort
+            filters = Column -> value that must match exactly (e.g. Year)
+            prefix = (column, text) the column must start with (any case)
+            offset, limit = The page to return
+
+        Returns:
+            (total number of matching rows, positions for the page)
+        """
+        offset = max(offset, 0)
+        stop = None if limit is None else offset + max(limit, 0)
+
+        candidates: t.Optional[np.ndarray] = None
+        if prefix is not None:
+            name, text = prefix
+            folded, order = self.prefix_index(name)
+            text = text.casefold()
+            lo = np.searchsorted(folded, text, side="left")
+            hi = np.searchsorted(folded, text + "\U0010ffff", side="left")
+            candidates = np.sort(order[lo:hi])
+        for name, value in (filters or {}).items():
+            group = self.group_index(name).get(value)
+            if group is None:
+                return 0, np.empty(0, dtype=np.intp)
+            if candidates is None:
+                candidates = group
+            else:
+                candidates = np.intersect1d(candidates, group)
+
+        if candidates is None:
+            # No filters, the page is a slice of the precomputed order
+            if sort is None:
+                end = self.length if stop is None else min(stop, self.length)
+                return self.length, np.arange(min(offset, end), end)
+            order, _ = self.sort_order(sort, descending)
+            return self.length, order[offset:stop]
+
+        if sort is not None:
+            _, position = self.sort_order(sort, descending)
+            candidates = candidates[np.argsort(position[candidates])]
+        return len(candidates), candidates[offset:stop]
+
+    def to_shared(self) -> "Dataset":
+        """
+        Return a copy of this Dataset with all columns in one anonymous
+        shared mmap, so forked workers don't each get a copy.
+        """
+        arrays: t.Dict[str, np.ndarray] = {}
+        for name, array in self.columns.items():
+            if array.dtype == object:
+                encoded = [str(value).encode("utf-8") for value in array]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(value) for value in encoded], out=offsets[1:])
+                arrays[name + ":data"] = np.frombuffer(
+                    b"".join(encoded), dtype=np.uint8
+                )
+                arrays[name + ":offsets"] = offsets
+            else:
+                arrays[name] = array
+        # Keep every array 8 byte aligned
+        starts: t.Dict[str, int] = {}
+        size = 0
+        for key, array in arrays.items():
+            starts[key] = size
+            size += -(-array.nbytes // 8) * 8
+        buffer = mmap.mmap(-1, max(size, 1))
+
+        shared: t.Dict[str, np.ndarray] = {}
+        for key, array in arrays.items():
+            shared[key] = np.frombuffer(
+                buffer, array.dtype, len(array), starts[key]
+            )
+            shared[key][:] = array
+        # The arrays keep 'buffer' alive for as long as they're around
+        columns = {name: shared[name] for name in self.names if name in shared}
+        strings = {
+            name: (shared[name + ":data"], shared[name + ":offsets"])
+            for name in self.names
+            if name not in shared
+        }
+        return Dataset(
+            columns,
+            self.categories,
+            self.version,
+            self.mtime,
+            strings=strings,
+            names=self.names,
+        )
+
+    @classmethod
+    def from_csv(
+        cls, path: str, schema: t.Optional[t.Dict[str, str]] = None
+    ) -> "Dataset":
+        stat = os.stat(path)
+        df = pd.read_csv(path)
+        schema = schema or {}
+        columns: t.Dict[str, np.ndarray] = {}
+        categories: t.Dict[str, np.ndarray] = {}
+        for name in df.columns:
+            dtype = schema.get(name)
+            if dtype == "category":
+                codes, uniques = pd.factorize(df[name], sort=True)
+                columns[name] = codes.astype(np.min_scalar_type(len(uniques)))
+                categories[name] = np.asarray(uniques, dtype=object)
+            elif dtype == "object":
+                columns[name] = df[name].to_numpy(dtype=object)
+            else:
+                columns[name] = df[name].to_numpy(dtype=dtype)
+        return cls(
+            columns,
+            categories,
+            version=f"{stat.st_size:x}-{stat.st_mtime_ns:x}",
+            mtime=stat.st_mtime,
+        )
+
+
+class DatasetStore:
+    """
+    Process wide holder of the latest Dataset for a CSV file.
+
+    Params:
+        path = CSV file to load
+        schema = Column name -> dtype (see BOX_OFFICE_SCHEMA)
+        check_interval = Seconds between mtime checks
+        shared = Keep the columns in shared memory (see to_shared()).
+            Only makes sense in a process that forks afterwards.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        schema: t.Optional[t.Dict[str, str]] = None,
+        check_interval: float = 1.0,
+        shared: bool = False,
+    ):
+        self.path = path
+        self.schema = schema
+        self.check_interval = check_interval
+        self.shared = shared
+        self._dataset: t.Optional[Dataset] = None
+        self._mtime_ns: int = -1
+        self._checked_at: float = 0.0
+        self._lock = threading.Lock()
+
+    def _reload(self) -> Dataset:
+        with self._lock:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+            if self._dataset is None or mtime_ns != self._mtime_ns:
+                dataset = Dataset.from_csv(self.path, self.schema)
+                if self.shared:
+                    dataset = dataset.to_shared()
+                # Single reference swap, readers see old or new, never both
+                self._dataset = dataset
+                self._mtime_ns = mtime_ns
+            self._checked_at = time.monotonic()
+            return self._dataset
+
+    def get(self) -> Dataset:
+        """Return the current Dataset, reloading if the file changed."""
+        dataset = self._dataset
+        if dataset is None:
+            return self._reload()
+
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if os.stat(self.path).st_mtime_ns != self._mtime_ns:
+                return self._reload()
+        return dataset
+
+
+# One store per process (per gunicorn worker)
+box_office = DatasetStore(BOX_OFFICE_CSV, schema=BOX_OFFICE_SCHEMA)
@@ -0,0 +1,448 @@
+"""
+NOTES:
+    - A POST from an HTML <form> puts the fields in the request BODY, which
+      the WSGI server hands us as a file-like environ["wsgi.input"]. We must
+      not read more than CONTENT_LENGTH bytes from it (the next request on
+      a keep-alive connection comes right after), and reading it all into
+      memory first would let anyone make us allocate as much as they like.
+    - Two encodings browsers use:
+        application/x-www-form-urlencoded = name=Ann&msg=Hi+there, the
+            default. Small, so read (up to max_memory_size) + parse_qs().
+        multipart/form-data = <form enctype="multipart/form-data">, needed
+            for file uploads. Parts separated by "--boundary" lines, each
+            with its own headers:
+              --boundary
+              Content-Disposition: form-data; name="photo"; filename="a.png"
+              Content-Type: image/png
+
+              <raw bytes>
+              --boundary--
+    - MultipartParser is fed the body in CHUNK_SIZE pieces and keeps only
+      the unparsed tail in memory. A boundary can be split across two
+      chunks, so it holds back len(delimiter) - 1 bytes until it knows.
+      Text fields go into memory (max_memory_size in total), files go into
+      a SpooledTemporaryFile, which moves to disk past spool_size bytes.
+    - Limits: max_body_size for the whole body (413 before we read a byte
+      if Content-Length says so), max_fields parts/fields, max_memory_size
+      for all the text fields. Anything off gives a 400/413 via HTTPError.
+    - Nothing is parsed until a handler asks: form(environ) / files(environ)
+      parse once and keep the result in environ, GET routes pay nothing.
+      Values are {name: [values]} like get_query(), so get_str()/get_int()
+      work on forms too.
+    - After the response app() calls finish(environ): uploads get closed
+      (temp files deleted), and a small body nobody read is read and thrown
+      away so it can't be mistaken for the next request. (gunicorn skips
+      leftovers itself, not every server does.) Bodies over max_body_size
+      are left alone, the server has to close that connection anyway.
+"""
+
+import os
+import tempfile
+import typing as t
+from urllib.parse import parse_qs
+
+import settings
+from request import BadRequest, PayloadTooLarge
+
+# How much of the body we read at a time
+CHUNK_SIZE = 64 * 1024
+# Longest header block of one multipart part
+MAX_HEADER_SIZE = 16 * 1024
+
+# environ key for the parsed (form, files), set once the body's been read
+FORM_KEY = "app.form"
+
+Form = t.Dict[str, t.List[str]]
+
+
+class UploadedFile:
+    """
+    A file from a multipart/form-data upload.
+
+    Params:
+        name = Form field name
+        filename = Name on the client's disk (no directories)
+        content_type = Content-Type the client sent for the part
+        spool_size = Bytes kept in memory before moving to a temp file
+    """
+
+    def __init__(
+        self, name: str, filename: str, content_type: str, spool_size: int
+    ):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+
+    def write(self, data: t.Union[bytes, bytearray, memoryview]) -> None:
+        self.size += len(data)
+        self.file.write(data)
+
+    def read(self) -> bytes:
+        self.file.seek(0)
+        return self.file.read()
+
+    def save(self, path: str) -> None:
+        """Copy the upload to path, chunk by chunk."""
+        self.file.seek(0)
+        with open(path, "wb") as f:
+            while True:
+                chunk = self.file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __repr__(self) -> str:
+        return f"<UploadedFile {self.name}={self.filename!r} {self.size}B>"
+
+
+def parse_options(value: str) -> t.Tuple[str, t.Dict[str, str]]:
+    """
+    Split a header like Content-Type/Content-Disposition into its value
+    and params:
+        'form-data; name="a;b"; filename="x.txt"'
+        -> ("form-data", {"name": "a;b", "filename": "x.txt"})
+    """
+    main, _, rest = value.partition(";")
+    params: t.Dict[str, str] = {}
+    i, n = 0, len(rest)
+    while i < n:
+        while i < n and rest[i] in " \t;":
+            i += 1
+        start = i
+        while i < n and rest[i] not in "=;":
+            i += 1
+        key = rest[start:i].strip().lower()
+        if i >= n or rest[i] == ";":
+            continue
+        i += 1  # the "="
+        while i < n and rest[i] in " \t":
+            i += 1
+        if i < n and rest[i] == '"':
+            i += 1
+            chars = []
+            while i < n and rest[i] != '"':
+                # Only \" and \\ are escapes, browsers send Windows paths
+                # (C:\x\a.txt) as is
+                if rest[i] == "\\" and rest[i + 1 : i + 2] in ('"', "\\"):
+                    i += 1
+                chars.append(rest[i])
+                i += 1
+            i += 1  # the closing quote
+            param = "".join(chars)
+        else:
+            start = i
+            while i < n and rest[i] != ";":
+                i += 1
+            param = rest[start:i].strip()
+        if key:
+            params[key] = param
+    return main.strip().lower(), params
+
+
+# MultipartParser states
+_PREAMBLE, _DELIMITER_LINE, _HEADERS, _BODY, _DONE = range(5)
+
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser, see the NOTES above.
+
+    Params:
+        boundary = From the request's Content-Type
+        max_fields = Max parts in the body
+        max_memory_size = Max bytes of all the text fields together
+        spool_size = Bytes of each file kept in memory before a temp file
+    """
+
+    def __init__(
+        self,
+        boundary: bytes,
+        max_fields: int,
+        max_memory_size: int,
+        spool_size: int,
+    ):
+        self.delimiter = b"\r\n--" + boundary
+        self.max_fields = max_fields
+        self.max_memory_size = max_memory_size
+        self.spool_size = spool_size
+        self.form: Form = {}
+        self.files: t.Dict[str, t.List[UploadedFile]] = {}
+        # Starting with CRLF makes the first boundary look like the others
+        self._buffer = bytearray(b"\r\n")
+        self._state = _PREAMBLE
+        self._fields = 0
+        self._memory = 0
+        self._part: t.Optional[t.Union[bytearray, UploadedFile]] = None
+        self._name = ""
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+        buffer = self._buffer
+        while True:
+            if self._state == _PREAMBLE:
+                index = buffer.find(self.delimiter)
+                if index < 0:
+                    # Nobody cares about the preamble, keep a possible
+                    # start of the boundary only
+                    del buffer[: max(len(buffer) - len(self.delimiter), 0)]
+                    return
+                del buffer[: index + len(self.delimiter)]
+                self._state = _DELIMITER_LINE
+            elif self._state == _DELIMITER_LINE:
+                if buffer[:2] == b"--":
+                    self._state = _DONE
+                    del buffer[:]
+                    return
+                index = buffer.find(b"\r\n")
+                if index < 0:
+                    if len(buffer) > MAX_HEADER_SIZE:
+                        raise BadRequest("Malformed multipart boundary")
+                    return
+                if buffer[:index].strip(b" \t"):
+                    raise BadRequest("Malformed multipart boundary")
+                del buffer[: index + 2]
+                self._state = _HEADERS
+            elif self._state == _HEADERS:
+                if buffer[:2] == b"\r\n":
+                    # A part with no headers at all
+                    index, end = 0, 2
+                else:
+                    index = buffer.find(b"\r\n\r\n")
+                    end = index + 4
+                if index < 0:
+                    if len(buffer) > MAX_HEADER_SIZE:
+                        raise BadRequest("Multipart headers too large")
+                    return
+                self._start_part(bytes(buffer[:index]))
+                del buffer[:end]
+                self._state = _BODY
+            elif self._state == _BODY:
+                index = buffer.find(self.delimiter)
+                if index < 0:
+                    keep = len(self.delimiter) - 1
+                    if len(buffer) > keep:
+                        self._write(memoryview(buffer)[: len(buffer) - keep])
+                        del buffer[: len(buffer) - keep]
+                    return
+                self._write(memoryview(buffer)[:index])
+                self._end_part()
+                del buffer[: index + len(self.delimiter)]
+                self._state = _DELIMITER_LINE
+            else:
+                # The epilogue after the last boundary is ignored too
+                del buffer[:]
+                return
+
+    def close(self) -> None:
+        """The body is over, it had better have had its last boundary."""
+        if self._state != _DONE:
+            raise BadRequest("Incomplete multipart body")
+
+    def _start_part(self, raw_headers: bytes) -> None:
+        self._fields += 1
+        if self._fields > self.max_fields:
+            raise PayloadTooLarge(f"More than {self.max_fields} form fields")
+        headers = {}
+        for line in raw_headers.decode("utf-8", "replace").split("\r\n"):
+            name, colon, value = line.partition(":")
+            if not colon:
+                raise BadRequest("Malformed multipart header")
+            headers[name.strip().lower()] = value.strip()
+        disposition, params = parse_options(
+            headers.get("content-disposition", "")
+        )
+        if disposition != "form-data" or "name" not in params:
+            raise BadRequest("Multipart part without a form-data name")
+        self._name = params["name"]
+        filename = params.get("filename")
+        if filename is None:
+            self._part = bytearray()
+        elif filename:
+            # Some browsers send the full path, C:\Users\... included
+            filename = os.path.basename(filename.replace("\\", "/"))
+            content_type = headers.get(
+                "content-type", "application/octet-stream"
+            )
+            self._part = UploadedFile(
+                self._name, filename, content_type, self.spool_size
+            )
+            self.files.setdefault(self._name, []).append(self._part)
+        else:
+            # <input type="file"> with nothing chosen
+            self._part = None
+
+    def _write(self, data: memoryview) -> None:
+        if isinstance(self._part, UploadedFile):
+            self._part.write(data)
+        elif self._part is not None:
+            self._memory += len(data)
+            if self._memory > self.max_memory_size:
+                raise PayloadTooLarge("Form fields too large")
+            self._part += data
+
+    def _end_part(self) -> None:
+        if isinstance(self._part, bytearray):
+            try:
+                value = self._part.decode("utf-8")
+            except UnicodeDecodeError:
+                raise BadRequest(f"Form field {self._name!r} isn't UTF-8")
+            self.form.setdefault(self._name, []).append(value)
+        self._part = None
+
+    def close_files(self) -> None:
+        for uploads in self.files.values():
+            for upload in uploads:
+                upload.close()
+
+
+class FormParser:
+    """
+    Lazily parse request bodies, see the NOTES above.
+
+    Params:
+        max_body_size = Largest request body we read (bytes)
+        max_fields = Max fields/parts in one body
+        max_memory_size = Max bytes of text fields kept in memory
+        spool_size = Bytes of an upload kept in memory before a temp file
+    """
+
+    def __init__(
+        self,
+        max_body_size: int = 1024 * 1024,
+        max_fields: int = 1000,
+        max_memory_size: int = 256 * 1024,
+        spool_size: int = 64 * 1024,
+    ):
+        self.max_body_size = max_body_size
+        self.max_fields = max_fields
+        self.max_memory_size = max_memory_size
+        self.spool_size = spool_size
+
+    def form(self, environ: t.Dict) -> Form:
+        """The body's fields as {name: [values]}, parsed on first use."""
+        return self.parse(environ)[0]
+
+    def files(self, environ: t.Dict) -> t.Dict[str, t.List[UploadedFile]]:
+        """The body's uploads as {name: [UploadedFile]}."""
+        return self.parse(environ)[1]
+
+    def parse(
+        self, environ: t.Dict
+    ) -> t.Tuple[Form, t.Dict[str, t.List[UploadedFile]]]:
+        parsed = environ.get(FORM_KEY)
+        if parsed is None:
+            # Remember a failure too, or finish() would read the body again
+            environ[FORM_KEY] = ({}, {})
+            parsed = environ[FORM_KEY] = self._parse(environ)
+        return parsed
+
+    def _parse(
+        self, environ: t.Dict
+    ) -> t.Tuple[Form, t.Dict[str, t.List[UploadedFile]]]:
+        content_type, params = parse_options(environ.get("CONTENT_TYPE", ""))
+        if content_type == "application/x-www-form-urlencoded":
+            data = b"".join(
+                self._read(environ, self.max_memory_size, "Form too large")
+            )
+            try:
+                form = parse_qs(
+                    data.decode("ascii"),
+                    keep_blank_values=True,
+                    strict_parsing=False,
+                    max_num_fields=self.max_fields,
+                    errors="strict",
+                )
+            except ValueError as e:
+                # Non-ASCII bytes, bad UTF-8 in a %xx or too many fields
+                raise BadRequest(f"Malformed form data: {e}")
+            return form, {}
+
+        if content_type == "multipart/form-data":
+            boundary = params.get("boundary", "")
+            if not boundary or len(boundary) > 70:
+                raise BadRequest("Missing or invalid multipart boundary")
+            parser = MultipartParser(
+                boundary.encode("latin-1"),
+                self.max_fields,
+                self.max_memory_size,
+                self.spool_size,
+            )
+            try:
+                for chunk in self._read(environ, self.max_body_size):
+                    parser.feed(chunk)
+                parser.close()
+            except BaseException:
+                parser.close_files()
+                raise
+            return parser.form, parser.files
+
+        # JSON etc. isn't a form, leave the body to the handler
+        return {}, {}
+
+    def _read(
+        self, environ: t.Dict, limit: int, message: str = "Body too large"
+    ) -> t.Iterator[bytes]:
+        """Yield the body in chunks, never more than CONTENT_LENGTH."""
+        stream = environ.get("wsgi.input")
+        length = content_length(environ)
+        if stream is None or length == 0:
+            return
+        if length is None:
+            # Chunked request: only if the server tells us the stream
+            # ends with the body (gunicorn, asgi.py) may we read to EOF
+            if not environ.get("wsgi.input_terminated"):
+                return
+            remaining = limit + 1
+        elif length > limit:
+            raise PayloadTooLarge(message)
+        else:
+            remaining = length
+        received = 0
+        while remaining > 0:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                if length is not None:
+                    raise BadRequest("Incomplete request body")
+                break
+            received += len(chunk)
+            if received > limit:
+                raise PayloadTooLarge(message)
+            remaining -= len(chunk)
+            yield chunk
+
+    def finish(self, environ: t.Dict) -> None:
+        """Close uploads and skip a small body nobody read (see NOTES)."""
+        parsed = environ.get(FORM_KEY)
+        if parsed is not None:
+            for uploads in parsed[1].values():
+                for upload in uploads:
+                    upload.close()
+            return
+        length = content_length(environ)
+        if length and length <= self.max_body_size:
+            environ[FORM_KEY] = ({}, {})
+            try:
+                for _ in self._read(environ, self.max_body_size):
+                    pass
+            except (BadRequest, OSError):
+                # The client hung up, nothing left to skip
+                pass
+
+
+def content_length(environ: t.Dict) -> t.Optional[int]:
+    """CONTENT_LENGTH as an int, None when missing or not a number."""
+    value = environ.get("CONTENT_LENGTH", "")
+    return int(value) if value.isdigit() else None
+
+
+form_parser = FormParser(
+    max_body_size=settings.MAX_BODY_SIZE,
+    max_fields=settings.FORM_MAX_FIELDS,
+    max_memory_size=settings.FORM_MAX_MEMORY_SIZE,
+    spool_size=settings.FORM_SPOOL_SIZE,
+)
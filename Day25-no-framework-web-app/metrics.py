@@ -0,0 +1,386 @@
+"""
+NOTES:
+    - MetricsMiddleware wraps the whole app and records, per route, how
+      many requests we served (by method + status), how many bytes we sent
+      and how long each one took. GET /metrics shows it all in the
+      Prometheus text format, so Prometheus (or curl) can scrape it.
+    - Latencies go in HDR-style ("high dynamic range") histograms: buckets
+      are powers of two split into 8 linear sub-buckets, so a 10µs request
+      and a 10s one are both recorded within ~6% in a fixed list of 240
+      ints, no matter how many requests we count. Percentiles (p50, p99,
+      ...) come straight from the bucket counts.
+    - A request is also split into phases, timed separately:
+        routing = router.match() + ETag check
+        data = reading the dataset (box_office.get(), query(), ...)
+        render = templates / JSON, i.e. the rest of the handler
+        encode = str -> bytes and compression
+      Phases nest: time spent in "data" inside the handler is NOT counted
+      as "render" too. Handlers mark their own phases:
+        with phase(environ, "data"):
+            movies = box_office.get()
+    - Streamed bodies are recorded when the server closes them, so their
+      duration and bytes include sending the whole body. Bodies with a
+      Content-Length (and sendfile()d files) are recorded right away.
+    - Recording takes no locks: every thread gets its own set of counters
+      (threading.local) and /metrics adds them up. A scrape can miss a
+      request that's being recorded right then, it shows up next time.
+    - The numbers are per process. Each gunicorn worker has its own, so a
+      scrape through the master's port sees whichever worker answered.
+      The 'pid' label tells them apart.
+"""
+
+import contextlib
+import os
+import threading
+import time
+import typing as t
+
+from response import StreamingBody
+
+# 2^3 = 8 sub-buckets per power of two, i.e. values within 1/8 = 12.5%
+# of each other share a bucket (~6% error using the bucket's midpoint)
+SUB_BUCKET_BITS = 3
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Values are stored in microseconds, up to 2^31µs (~35 minutes)
+MAX_EXPONENT = 31
+_BUCKETS = (MAX_EXPONENT - SUB_BUCKET_BITS + 2) * _SUB_BUCKETS
+
+# Prometheus 'le' buckets for latency histograms (seconds)
+PROMETHEUS_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def bucket_index(value: int) -> int:
+    """Which HDR bucket a value (in µs) falls in."""
+    if value < _SUB_BUCKETS:
+        return max(value, 0)
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    # value >> shift is in [8, 16): the top 4 bits of the value
+    index = (shift + 1) * _SUB_BUCKETS + (value >> shift) - _SUB_BUCKETS
+    return min(index, _BUCKETS - 1)
+
+
+def bucket_bounds(index: int) -> t.Tuple[int, int]:
+    """The [low, high) range of values (µs) in a bucket."""
+    if index < _SUB_BUCKETS:
+        return index, index + 1
+    shift = index // _SUB_BUCKETS - 1
+    low = (index % _SUB_BUCKETS + _SUB_BUCKETS) << shift
+    return low, low + (1 << shift)
+
+
+class Histogram:
+    """HDR-style histogram of durations, see the NOTES above."""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        # Sum of the recorded durations in seconds
+        self.total = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bucket_index(int(seconds * 1_000_000))] += 1
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other: "Histogram") -> None:
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> float:
+        """Approximate value (seconds) below which a q fraction falls."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                low, high = bucket_bounds(i)
+                return (low + high) / 2 / 1_000_000
+        return 0.0
+
+    def cumulative(
+        self, bounds: t.Sequence[float]
+    ) -> t.List[t.Tuple[float, int]]:
+        """[(le, requests <= le)] for Prometheus buckets (in seconds)."""
+        result = []
+        i = seen = 0
+        for bound in bounds:
+            limit = bound * 1_000_000
+            # Buckets that end at or below the bound are all <= bound
+            while i < _BUCKETS and bucket_bounds(i)[1] <= limit:
+                seen += self.counts[i]
+                i += 1
+            result.append((bound, seen))
+        return result
+
+
+class _Shard:
+    """One thread's counters. Only that thread ever writes to it."""
+
+    def __init__(self):
+        # (route, method, status) -> requests
+        self.requests: t.Dict[t.Tuple[str, str, str], int] = {}
+        # route -> bytes sent
+        self.bytes_sent: t.Dict[str, int] = {}
+        # route -> latency histogram
+        self.latency: t.Dict[str, Histogram] = {}
+        # (route, phase) -> histogram
+        self.phases: t.Dict[t.Tuple[str, str], Histogram] = {}
+
+
+class Metrics:
+    """Per process request metrics, see the NOTES above."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: t.List[_Shard] = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()  # only to add a new thread's shard
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Forked (gunicorn worker): start from zero
+                    self._shards = []
+                    self._local = threading.local()
+                    self._pid = os.getpid()
+                shard = self._local.shard = _Shard()
+                self._shards.append(shard)
+        return shard
+
+    def observe(
+        self,
+        route: str,
+        method: str,
+        status: str,
+        bytes_sent: int,
+        duration: float,
+        phases: t.Optional[t.Dict[str, float]] = None,
+    ) -> None:
+        shard = self._shard()
+        key = (route, method, status[:3])
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        shard.bytes_sent[route] = shard.bytes_sent.get(route, 0) + bytes_sent
+        histogram = shard.latency.get(route)
+        if histogram is None:
+            histogram = shard.latency[route] = Histogram()
+        histogram.record(duration)
+        for name, seconds in (phases or {}).items():
+            histogram = shard.phases.get((route, name))
+            if histogram is None:
+                histogram = shard.phases[(route, name)] = Histogram()
+            histogram.record(seconds)
+
+    def snapshot(self) -> _Shard:
+        """All threads' counters added up."""
+        total = _Shard()
+        for shard in list(self._shards):
+            for key, n in list(shard.requests.items()):
+                total.requests[key] = total.requests.get(key, 0) + n
+            for route, n in list(shard.bytes_sent.items()):
+                total.bytes_sent[route] = total.bytes_sent.get(route, 0) + n
+            for route, histogram in list(shard.latency.items()):
+                total.latency.setdefault(route, Histogram()).merge(histogram)
+            for key, histogram in list(shard.phases.items()):
+                total.phases.setdefault(key, Histogram()).merge(histogram)
+        return total
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        pid = os.getpid()
+        lines = [
+            "# HELP http_requests_total Requests served.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (route, method, status), n in sorted(snapshot.requests.items()):
+            labels = _labels(route=route, method=method, status=status, pid=pid)
+            lines.append(f"http_requests_total{labels} {n}")
+
+        lines += [
+            "# HELP http_response_bytes_total Response body bytes sent.",
+            "# TYPE http_response_bytes_total counter",
+        ]
+        for route, n in sorted(snapshot.bytes_sent.items()):
+            labels = _labels(route=route, pid=pid)
+            lines.append(f"http_response_bytes_total{labels} {n}")
+
+        lines += [
+            "# HELP http_request_duration_seconds Time to serve a request.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for route, histogram in sorted(snapshot.latency.items()):
+            lines += _histogram_lines(
+                "http_request_duration_seconds", histogram, route=route, pid=pid
+            )
+
+        lines += [
+            "# HELP http_request_duration_quantile_seconds Latency "
+            "percentiles since the worker started.",
+            "# TYPE http_request_duration_quantile_seconds gauge",
+        ]
+        for route, histogram in sorted(snapshot.latency.items()):
+            for q in QUANTILES:
+                labels = _labels(route=route, quantile=q, pid=pid)
+                lines.append(
+                    "http_request_duration_quantile_seconds"
+                    f"{labels} {histogram.quantile(q):.6f}"
+                )
+
+        lines += [
+            "# HELP http_request_phase_seconds Time spent in each phase "
+            "(routing, data, render, encode).",
+            "# TYPE http_request_phase_seconds histogram",
+        ]
+        for (route, name), histogram in sorted(snapshot.phases.items()):
+            lines += _histogram_lines(
+                "http_request_phase_seconds",
+                histogram,
+                route=route,
+                phase=name,
+                pid=pid,
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels: t.Any) -> str:
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _histogram_lines(
+    name: str, histogram: Histogram, **labels: t.Any
+) -> t.List[str]:
+    lines = []
+    for bound, n in histogram.cumulative(PROMETHEUS_BUCKETS):
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {n}")
+    lines.append(
+        f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}'
+    )
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.total:.6f}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+
+class PhaseTimer:
+    """
+    Adds up the time spent in each phase of one request. Phases nest,
+    the time goes to the innermost one.
+    """
+
+    def __init__(self):
+        self.totals: t.Dict[str, float] = {}
+        # [phase name, when we started counting time for it]
+        self._stack: t.List[t.List[t.Any]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> t.Iterator[None]:
+        now = time.perf_counter()
+        if self._stack:
+            # Pause the phase we're inside of
+            outer = self._stack[-1]
+            self.totals[outer[0]] = (
+                self.totals.get(outer[0], 0.0) + now - outer[1]
+            )
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            _, started = self._stack.pop()
+            self.totals[name] = self.totals.get(name, 0.0) + end - started
+            if self._stack:
+                self._stack[-1][1] = end
+
+
+TIMER_KEY = "app.phase_timer"
+ROUTE_KEY = "app.route"
+
+
+def phase(environ: t.Dict, name: str) -> t.ContextManager:
+    """Time a block as one phase of the request (no-op without a timer)."""
+    timer = environ.get(TIMER_KEY)
+    if timer is None:
+        return contextlib.nullcontext()
+    return timer.phase(name)
+
+
+class MetricsMiddleware:
+    """
+    Record every request in a Metrics.
+
+    Params:
+        app = The WSGI app to wrap
+        metrics = Where to record
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    def __call__(self, environ: t.Dict, start_response):
+        started = time.perf_counter()
+        timer = environ[TIMER_KEY] = PhaseTimer()
+        response: t.Dict[str, t.Any] = {}
+
+        def capture(status, headers, exc_info=None):
+            response["status"] = status
+            response["headers"] = headers
+            return start_response(status, headers, exc_info)
+
+        body = self.app(environ, capture)
+
+        def record(bytes_sent: int) -> None:
+            self.metrics.observe(
+                environ.get(ROUTE_KEY, "unknown"),
+                environ.get("REQUEST_METHOD", "GET"),
+                response.get("status", "500"),
+                bytes_sent,
+                time.perf_counter() - started,
+                timer.totals,
+            )
+
+        length = None
+        for name, value in response.get("headers", []):
+            if name.lower() == "content-length":
+                length = int(value)
+        if length is not None or response.get("status", "")[:3] == "304":
+            # Already in memory or a file the server may sendfile(),
+            # don't wrap it in anything
+            head = environ.get("REQUEST_METHOD") == "HEAD"
+            record(0 if head or length is None else length)
+            return body
+        return StreamingBody(body, on_close=record)
+
+
+metrics = Metrics()
@@ -0,0 +1,165 @@
+"""
+NOTES:
+    - Helpers for pulling things out of the 'environ' Dict (our request
+      object) so route handlers don't have to split strings by hand.
+    - QUERY_STRING is parsed with urllib.parse.parse_qs(), which handles
+      '&', url-encoding (%20, +) and repeated keys (?year=2019&year=2020).
+    - Raise HTTPError (or BadRequest) from a handler and app() turns it
+      into an error page with the right status code.
+    - negotiate_format() picks a response format from ?format= or else the
+      Accept header (with q-values), e.g. "application/json" -> "json".
+    - POST bodies (forms and file uploads) are parsed in forms.py.
+"""
+
+import typing as t
+from urllib.parse import parse_qs, parse_qsl, urlencode
+
+
+class HTTPError(Exception):
+    """An error that should be sent to the client as a status code."""
+
+    status: str = "500 Internal Server Error"
+
+    def __init__(self, message: str = "", status: t.Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        if status is not None:
+            self.status = status
+        # Extra response headers, e.g. Allow for a 405
+        self.headers: t.List[t.Tuple[str, str]] = []
+
+
+class BadRequest(HTTPError):
+    status = "400 Bad Request"
+
+
+class PayloadTooLarge(HTTPError):
+    status = "413 Payload Too Large"
+
+
+def get_query(environ: t.Dict) -> t.Dict[str, t.List[str]]:
+    """Parse QUERY_STRING into {key: [values]}."""
+    return parse_qs(environ.get("QUERY_STRING", ""), keep_blank_values=False)
+
+
+def normalize_query(query_str: str) -> str:
+    """
+    Put a query string in a canonical form so equivalent URLs match:
+    "b=2&a=1&c=" -> "a=1&b=2". (Order of repeated keys is kept.)
+    """
+    if not query_str:
+        return ""
+    pairs = parse_qsl(query_str, keep_blank_values=False)
+    pairs.sort(key=lambda pair: pair[0])
+    return urlencode(pairs)
+
+
+def get_str(
+    query: t.Dict[str, t.List[str]], name: str, default: t.Optional[str] = None
+) -> t.Optional[str]:
+    """Return the last value given for name (?a=1&a=2 -> "2")."""
+    values = query.get(name)
+    if not values:
+        return default
+    return values[-1]
+
+
+def get_int(
+    query: t.Dict[str, t.List[str]],
+    name: str,
+    default: t.Optional[int] = None,
+    minimum: t.Optional[int] = None,
+    maximum: t.Optional[int] = None,
+) -> t.Optional[int]:
+    """
+    Return a query param as an int, raising BadRequest if it isn't one
+    or falls outside [minimum, maximum].
+    """
+    value = get_str(query, name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' must be an integer, got {value!r}")
+    if minimum is not None and number < minimum:
+        raise BadRequest(f"'{name}' must be >= {minimum}")
+    if maximum is not None and number > maximum:
+        raise BadRequest(f"'{name}' must be <= {maximum}")
+    return number
+
+
+def _parse_accept(accept: str) -> t.List[t.Tuple[str, float]]:
+    """ "text/html,*/*;q=0.8" -> [("text/html", 1.0), ("*/*", 0.8)]"""
+    ranges = []
+    for item in accept.split(","):
+        media_range, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_range = media_range.strip().lower()
+        if media_range:
+            ranges.append((media_range, quality))
+    return ranges
+
+
+def _accept_quality(
+    ranges: t.List[t.Tuple[str, float]], media_type: str
+) -> float:
+    # The most specific matching range wins: type/subtype > type/* > */*
+    main_type = media_type.split("/")[0]
+    best_specificity, quality = -1, 0.0
+    for media_range, range_quality in ranges:
+        if media_range == media_type:
+            specificity = 2
+        elif media_range == f"{main_type}/*":
+            specificity = 1
+        elif media_range == "*/*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best_specificity:
+            best_specificity, quality = specificity, range_quality
+    return quality
+
+
+def negotiate_format(
+    environ: t.Dict,
+    formats: t.Dict[str, str],
+    default: str,
+    param: str = "format",
+) -> str:
+    """
+    Decide which representation to send.
+
+    Params:
+        formats = Media type -> format name, in order of preference
+            e.g. {"text/html": "html", "application/json": "json"}
+        default = Format when nothing matches (or no Accept header)
+        param = Query param that overrides the Accept header
+
+    Raises:
+        BadRequest for an unknown ?format= value
+    """
+    names = set(formats.values())
+    requested = get_str(get_query(environ), param)
+    if requested is not None:
+        if requested not in names:
+            raise BadRequest(f"'{param}' must be one of {sorted(names)}")
+        return requested
+
+    accept = environ.get("HTTP_ACCEPT")
+    if not accept:
+        return default
+    ranges = _parse_accept(accept)
+    best, best_quality = default, 0.0
+    for media_type, name in formats.items():
+        quality = _accept_quality(ranges, media_type)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
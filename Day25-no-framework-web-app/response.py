@@ -0,0 +1,99 @@
+"""
+NOTES:
+    - A WSGI app can return ANY iterable of byte strings, not just
+      iter([data]). The server sends each item as soon as we yield it.
+    - StreamingBody wraps a generator of str chunks (e.g. from
+      engine.stream()) and encodes them one at a time, so a big page never
+      exists as one giant bytes object in memory and the first bytes go out
+      before the last rows are even formatted.
+    - We don't know the Content-Length up front, so we leave that header
+      out. Gunicorn then uses "Transfer-Encoding: chunked" for HTTP/1.1
+      (and closes the connection for HTTP/1.0 clients).
+    - The WSGI server calls close() on our iterable when it's done (or the
+      client went away). That's where we find out how many bytes were sent,
+      so on_close(bytes_sent) is the place to log the request.
+    - Route handlers can return a plain str (HTML), a generator of str, or a
+      Response when they need a different status/Content-Type/headers.
+"""
+
+import typing as t
+
+Body = t.Union[str, bytes, t.Iterable[t.Union[str, bytes]]]
+
+
+class Response:
+    """
+    What a route handler sends back.
+
+    Params:
+        body = str/bytes, or an iterable of str/bytes chunks to stream
+        status = e.g. "200 OK"
+        content_type = Content-Type header
+        headers = Any extra (name, value) headers
+        content_length = Size of an iterable body when it's known up front
+            (e.g. a file). The body is then handed to the WSGI server as is
+            instead of being streamed chunked.
+    """
+
+    def __init__(
+        self,
+        body: Body = b"",
+        status: str = "200 OK",
+        content_type: str = "text/html; charset=utf-8",
+        headers: t.Optional[t.List[t.Tuple[str, str]]] = None,
+        content_length: t.Optional[int] = None,
+    ):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or []
+        self.content_length = content_length
+
+    @property
+    def is_streaming(self) -> bool:
+        return not isinstance(self.body, bytes)
+
+
+class StreamingBody:
+    """
+    WSGI response iterable that encodes str chunks lazily.
+
+    Params:
+        chunks = Iterable of str (or bytes) pieces of the response
+        on_close = Called once with the number of bytes sent
+        encoding = How str chunks are encoded
+    """
+
+    def __init__(
+        self,
+        chunks: t.Iterable[t.Union[str, bytes]],
+        on_close: t.Optional[t.Callable[[int], None]] = None,
+        encoding: str = "utf-8",
+    ):
+        self.chunks = chunks
+        self.on_close = on_close
+        self.encoding = encoding
+        self.bytes_sent = 0
+        self._closed = False
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        encoding = self.encoding
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(encoding)
+            if chunk:
+                self.bytes_sent += len(chunk)
+                yield chunk
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        # Let generators run their finally: blocks
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+        if self.on_close is not None:
+            self.on_close(self.bytes_sent)
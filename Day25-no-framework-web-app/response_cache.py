@@ -0,0 +1,121 @@
+"""
+NOTES:
+    - home, contact_us, read_box_office_data, ... always give the same
+      bytes for the same path + query string + template/dataset versions.
+      That's exactly what the ETag from conditional.py fingerprints, so the
+      ETag is our cache key. A new dataset/template/code version means a new
+      ETag, so stale pages are never served, they just age out.
+    - Entries are the already ENCODED response (bytes + headers), so a hit
+      skips the handler, the template and .encode().
+    - LRU eviction: entries live in an OrderedDict in least -> most recently
+      used order. A hit moves the entry to the end. When the total size of
+      all cached bodies goes over max_bytes we pop from the front.
+    - Each route can have its own TTL (@cacheable(ttl=...)), after which an
+      entry is treated as a miss and replaced.
+    - Hits/misses/evictions are counted per route and shown at /stats.
+    - Streamed (generator) responses are not cached, they're only used for
+      pages too big to want to keep around anyway.
+    - The cache is per process, so each gunicorn worker has its own.
+"""
+
+import collections
+import threading
+import time
+import typing as t
+
+import settings
+from response import Response
+
+
+class _Entry:
+    __slots__ = ("response", "size", "expires_at", "route")
+
+    def __init__(self, response: Response, expires_at: float, route: str):
+        self.response = response
+        self.size = len(response.body)
+        self.expires_at = expires_at
+        self.route = route
+
+
+class ResponseCache:
+    """
+    Byte bounded LRU cache of encoded Responses.
+
+    Params:
+        max_bytes = Total body size to keep before evicting
+        max_entry_bytes = Don't cache bodies bigger than this
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: t.Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = (
+            max_bytes // 4 if max_entry_bytes is None else max_entry_bytes
+        )
+        self.size = 0
+        self._entries: "collections.OrderedDict[str, _Entry]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+        # route -> {"hits": n, "misses": n, "evictions": n, "expired": n}
+        self.counters: t.Dict[str, t.Dict[str, int]] = collections.defaultdict(
+            lambda: {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        )
+
+    def get(self, key: str, route: str = "") -> t.Optional[Response]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters[route]["misses"] += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.counters[route]["expired"] += 1
+                self.counters[route]["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters[route]["hits"] += 1
+            return entry.response
+
+    def put(
+        self, key: str, response: Response, ttl: float, route: str = ""
+    ) -> bool:
+        """Cache a response. Returns False if it can't be cached."""
+        if response.is_streaming or len(response.body) > self.max_entry_bytes:
+            return False
+        entry = _Entry(response, time.monotonic() + ttl, route)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, oldest = self._entries.popitem(last=False)
+                self.size -= oldest.size
+                self.counters[oldest.route]["evictions"] += 1
+        return True
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            routes = {route: dict(c) for route, c in self.counters.items()}
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": sum(c["hits"] for c in routes.values()),
+                "misses": sum(c["misses"] for c in routes.values()),
+                "routes": routes,
+            }
+
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_MAX_BYTES, settings.RESPONSE_CACHE_MAX_ENTRY_BYTES
+)
@@ -0,0 +1,209 @@
+"""
+NOTES:
+    - app() used to pick a handler with an if/elif chain on PATH_INFO. Every
+      new route meant another comparison and there was no way to say
+      /box-office/<year> or /movie/<rank>.
+    - Router keeps two tables, similar to what Flask/Starlette do:
+        * Static routes (no <params>) live in a plain Dict keyed by path, so
+          looking them up is a single hash lookup no matter how many routes
+          we have.
+        * Routes with <params> are split on "/" into a trie (a tree of Dicts
+          keyed by path segment). Matching walks one node per segment, so it
+          costs O(number of segments), not O(number of routes).
+    - Each route maps HTTP methods -> handler. HEAD is answered by the GET
+      handler. Unknown paths raise NotFound (404) and known paths with the
+      wrong method raise MethodNotAllowed (405) with an Allow header.
+    - Path params are written <name> or <converter:name>, e.g. <int:year>.
+      Converted values are passed to the handler as keyword args:
+        @router.route("/movie/<int:rank>")
+        def movie(environ, rank): ...
+    - A trailing "/" is ignored, so /contact/ and /contact are the same.
+    - <path:name> matches the REST of the path, slashes included, so it has
+      to be the last segment: /static/<path:filename> -> "css/style.css"
+"""
+
+import re
+import typing as t
+
+from request import HTTPError
+
+Handler = t.Callable[..., t.Any]
+
+
+def _to_int(segment: str) -> int:
+    # int() alone would also accept "-1", " 1" and "1_000"
+    if not segment.isdigit():
+        raise ValueError(f"{segment!r} is not a number")
+    return int(segment)
+
+
+def _to_path(segments: str) -> str:
+    # Gets all the remaining segments joined with "/", see Router._walk()
+    return segments
+
+
+# converter name -> function that turns a path segment into a value.
+# Raise ValueError if the segment doesn't fit.
+CONVERTERS: t.Dict[str, t.Callable[[str], t.Any]] = {
+    "str": str,
+    "int": _to_int,
+    "path": _to_path,
+}
+
+_PARAM_RE = re.compile(r"^<(?:(?P<converter>\w+):)?(?P<name>\w+)>$")
+
+
+class NotFound(HTTPError):
+    status = "404 Not Found"
+
+
+class MethodNotAllowed(HTTPError):
+    status = "405 Method Not Allowed"
+
+
+class _Node:
+    """One path segment in the trie of parameterized routes."""
+
+    __slots__ = ("static", "params", "methods", "pattern")
+
+    def __init__(self):
+        self.static: t.Dict[str, "_Node"] = {}
+        # (param name, converter, child node) tried in the order added
+        self.params: t.List[t.Tuple[str, t.Callable, "_Node"]] = []
+        self.methods: t.Optional[t.Dict[str, Handler]] = None
+        self.pattern: str = ""
+
+
+def _normalize(path: str) -> str:
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+    return path or "/"
+
+
+def _split(path: str) -> t.List[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+class Router:
+    def __init__(self):
+        self.static_routes: t.Dict[str, t.Dict[str, Handler]] = {}
+        self.root = _Node()
+        self.routes: t.List[t.Tuple[str, t.Tuple[str, ...], Handler]] = []
+
+    def add_route(
+        self,
+        pattern: str,
+        handler: Handler,
+        methods: t.Iterable[str] = ("GET",),
+    ) -> None:
+        methods = tuple(method.upper() for method in methods)
+        pattern = _normalize(pattern)
+        self.routes.append((pattern, methods, handler))
+
+        if "<" not in pattern:
+            table = self.static_routes.setdefault(pattern, {})
+        else:
+            node = self.root
+            segments = _split(pattern)
+            for i, segment in enumerate(segments):
+                match = _PARAM_RE.match(segment)
+                if match is None:
+                    node = node.static.setdefault(segment, _Node())
+                    continue
+                name = match.group("name")
+                converter_name = match.group("converter") or "str"
+                if converter_name not in CONVERTERS:
+                    raise ValueError(
+                        f"{pattern}: unknown converter {converter_name!r}"
+                    )
+                converter = CONVERTERS[converter_name]
+                if converter is _to_path and i != len(segments) - 1:
+                    raise ValueError(f"{pattern}: <path:...> must come last")
+                for param_name, param_converter, child in node.params:
+                    if param_name == name and param_converter is converter:
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.params.append((name, converter, child))
+                    node = child
+            if node.methods is None:
+                node.methods = {}
+                node.pattern = pattern
+            table = node.methods
+
+        for method in methods:
+            if method in table:
+                raise ValueError(f"{method} {pattern} is already routed")
+            table[method] = handler
+
+    def route(
+        self, pattern: str, methods: t.Iterable[str] = ("GET",)
+    ) -> t.Callable[[Handler], Handler]:
+        """Decorator version of add_route()."""
+
+        def decorator(handler: Handler) -> Handler:
+            self.add_route(pattern, handler, methods)
+            return handler
+
+        return decorator
+
+    def _walk(
+        self, node: _Node, segments: t.List[str], i: int, params: t.Dict
+    ) -> t.Optional[_Node]:
+        if i == len(segments):
+            return node if node.methods is not None else None
+        segment = segments[i]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._walk(child, segments, i + 1, params)
+            if found is not None:
+                return found
+        # Static segments win, then params in the order they were added
+        for name, converter, child in node.params:
+            if converter is _to_path:
+                if child.methods is not None:
+                    params[name] = "/".join(segments[i:])
+                    return child
+                continue
+            try:
+                value = converter(segment)
+            except ValueError:
+                continue
+            found = self._walk(child, segments, i + 1, params)
+            if found is not None:
+                params[name] = value
+                return found
+        return None
+
+    def match(
+        self, method: str, path: str
+    ) -> t.Tuple[Handler, t.Dict[str, t.Any]]:
+        """
+        Find the handler for a request.
+
+        Returns:
+            (handler, path params)
+        Raises:
+            NotFound, MethodNotAllowed
+        """
+        path = _normalize(path)
+        params: t.Dict[str, t.Any] = {}
+        methods = self.static_routes.get(path)
+        if methods is None:
+            node = self._walk(self.root, _split(path), 0, params)
+            if node is None:
+                raise NotFound(f"Page not found: {path}")
+            methods = node.methods
+
+        handler = methods.get(method)
+        if handler is None and method == "HEAD":
+            handler = methods.get("GET")
+        if handler is None:
+            allowed = set(methods)
+            if "GET" in allowed:
+                allowed.add("HEAD")
+            error = MethodNotAllowed(f"{method} isn't allowed on {path}")
+            error.headers.append(("Allow", ", ".join(sorted(allowed))))
+            raise error
+        return handler, params
@@ -0,0 +1,81 @@
+"""
+NOTES:
+    - 'gunicorn server:app -w 4' imports server.py separately in EVERY
+      worker, so each one loads the box-office CSV, compiles the templates
+      and builds the indexes on its own. 4 cores = 4 copies in memory.
+    - python run.py starts gunicorn from Python instead (gunicorn's
+      BaseApplication) with preload_app=True: load() runs ONCE in the
+      master process, then the workers are forked from it. A forked process
+      shares all of its parent's memory pages until one of them writes to
+      a page (copy-on-write), so the workers start warm and share one copy.
+    - The dataset's columns go in an anonymous shared mmap (see
+      Dataset.to_shared()), so those pages stay shared for good.
+    - Python objects (e.g. the memoized JSON rows) are shared too, but
+      CPython writes to an object whenever its reference count changes or
+      the garbage collector visits it, which copies the page. gc.freeze()
+      moves everything loaded so far out of the GC's sight, so at least the
+      GC doesn't un-share them.
+    - Worker count defaults to the number of CPUs (WORKERS setting). Each
+      worker only adds its own small heap on top of the shared pages.
+    - A worker that notices the CSV changed reloads it on its own (see
+      DatasetStore). Nothing could share that copy, so it's a plain private
+      Dataset, not another mmap. Restart (or send the master a HUP) to
+      share the new data again.
+    - Start it with:
+        python run.py
+        python run.py --workers 8 --bind 0.0.0.0:8000
+"""
+
+import argparse
+import gc
+import typing as t
+
+from gunicorn.app.base import BaseApplication
+
+import settings
+from datastore import box_office
+
+
+class Runner(BaseApplication):
+    """
+    Run server.app under gunicorn with everything loaded before forking.
+
+    Params:
+        options = gunicorn settings, e.g. {"bind": ..., "workers": 4}
+    """
+
+    def __init__(self, options: t.Dict[str, t.Any]):
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import server
+
+        # Only the master's copy is worth sharing, reloads in the workers
+        # are private to them
+        box_office.shared = True
+        try:
+            server.preload()
+        finally:
+            box_office.shared = False
+        # Keep the GC from touching (and so copying) the preloaded objects
+        gc.freeze()
+        return server.app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run server.app on every core")
+    parser.add_argument("--bind", default=settings.BIND)
+    parser.add_argument("--workers", type=int, default=settings.WORKERS)
+    args = parser.parse_args()
+    Runner(
+        {"bind": args.bind, "workers": args.workers, "preload_app": True}
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+NOTES:
+    - The HTML page formats a List of Dicts with repr(). For our dashboards
+      we want JSON, and building a Dict per row just to json.dumps() it
+      again is wasted work.
+    - Instead, the first time a Dataset version is serialized we encode
+      every row ONCE, straight from the NumPy columns: each column is turned
+      into a list of JSON value strings (ints with .astype(str), everything
+      else with json.dumps()), then the columns are stitched together with a
+      pre-built '{"Rank":%s,"Release_Group":%s,...}' format string. The
+      result is an array of ready-made JSON objects kept on the Dataset
+      (Dataset.memoize), so it's thrown away when the CSV changes.
+    - Any page after that is just ",".join() of the rows at its positions:
+      O(page size) string joins, no json.dumps(), no Dicts.
+    - NDJSON ("newline delimited JSON", one object per line) is the same
+      rows joined with "\\n". Big pages stream in chunks like the HTML does.
+"""
+
+import json
+import typing as t
+
+import numpy as np
+
+from datastore import Dataset
+
+JSON_TYPE = "application/json"
+NDJSON_TYPE = "application/x-ndjson"
+
+
+def _encode_column(values: np.ndarray) -> t.List[str]:
+    if values.dtype.kind in "iu":
+        return values.astype(str).tolist()
+    # json.dumps() gives the same float repr as Python and escapes strings
+    return [json.dumps(value) for value in values.tolist()]
+
+
+def _build_json_rows(dataset: Dataset) -> np.ndarray:
+    row_format = (
+        "{"
+        # Column names like "Domestic_%" need their % escaped
+        + ",".join(
+            json.dumps(name).replace("%", "%%") + ":%s"
+            for name in dataset.names
+        )
+        + "}"
+    )
+    columns = [_encode_column(dataset.column(name)) for name in dataset.names]
+    rows = np.empty(len(dataset), dtype=object)
+    rows[:] = [row_format % values for values in zip(*columns)]
+    return rows
+
+
+def json_rows(dataset: Dataset) -> np.ndarray:
+    """Every row of the Dataset as a JSON object string (cached)."""
+    return dataset.memoize(("json_rows",), lambda: _build_json_rows(dataset))
+
+
+def _join_chunks(
+    rows: np.ndarray, separator: str, chunk_size: int
+) -> t.Iterator[str]:
+    for start in range(0, len(rows), chunk_size):
+        chunk = separator.join(rows[start : start + chunk_size])
+        yield chunk if start == 0 else separator + chunk
+
+
+def to_json(
+    dataset: Dataset,
+    positions: np.ndarray,
+    meta: t.Dict[str, t.Any],
+    chunk_size: t.Optional[int] = None,
+) -> t.Union[str, t.Iterator[str]]:
+    """
+    {"total": ..., <meta>, "data": [rows at positions]}
+
+    With chunk_size, returns a generator of str chunks instead of one
+    big string.
+    """
+    rows = json_rows(dataset)[positions]
+    # '{"total": 5}' -> '{"total": 5, "data": ['
+    head = json.dumps(meta)[:-1] + (", " if meta else "") + '"data": ['
+    if chunk_size is None:
+        return head + ",".join(rows) + "]}"
+
+    def stream():
+        yield head
+        yield from _join_chunks(rows, ",", chunk_size)
+        yield "]}"
+
+    return stream()
+
+
+def to_ndjson(
+    dataset: Dataset,
+    positions: np.ndarray,
+    chunk_size: t.Optional[int] = None,
+) -> t.Union[str, t.Iterator[str]]:
+    """One JSON object per line for the rows at positions."""
+    rows = json_rows(dataset)[positions]
+    if len(rows) == 0:
+        return ""
+    if chunk_size is None:
+        return "\n".join(rows) + "\n"
+
+    def stream():
+        yield from _join_chunks(rows, "\n", chunk_size)
+        yield "\n"
+
+    return stream()
@@ -118,37 +118,112 @@ SERVER_PORT 8000
 PATH_INFO /
 SCRIPT_NAME
 """
+
 # ====== CHALLENGE: Pulling data from CSV to display on different routes
+import html
+import json
 import os
+import time
+import traceback
 import typing as t
-import pandas as pd
 
+import serializers
+import settings
+import stats
+from access_log import access_log
+from compression import CompressionMiddleware
+from conditional import cacheable, is_not_modified
+from datastore import box_office
+from forms import form_parser
+from metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    ROUTE_KEY,
+    MetricsMiddleware,
+    metrics,
+    phase,
+)
+from request import (
+    BadRequest,
+    HTTPError,
+    get_int,
+    get_query,
+    get_str,
+    negotiate_format,
+    normalize_query,
+)
+from response import Response, StreamingBody
+from response_cache import response_cache
+from static import StaticFiles
+from router import NotFound, Router
+from templates import engine
 
 # Access our data
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # 25-no-framework-web-app
 DATA_DIR = os.path.join(BASE_DIR, "data")  # /data
-dataset = os.path.join(DATA_DIR, "movies-box-office-dataset-cleaned.csv")
+STATIC_DIR = os.path.join(BASE_DIR, "static")  # /static
+
+# ?sort= values (any case) -> dataset column
+SORT_FIELDS: t.Dict[str, str] = {
+    name.lower(): name
+    for name in (
+        "Rank",
+        "Release_Group",
+        "Worldwide",
+        "Domestic",
+        "Domestic_%",
+        "Foreign",
+        "Foreign_%",
+        "Year",
+    )
+}
+
+# Part of every ETag, so restarting with changed code busts client caches
+CODE_VERSION = str(
+    max(
+        os.stat(os.path.join(BASE_DIR, name)).st_mtime_ns
+        for name in os.listdir(BASE_DIR)
+        if name.endswith(".py")
+    )
+)
+
+# Maps paths (and methods) to our route handlers. See router.py
+router = Router()
 
 
 # Added box-office data from day 17
 def render_template(
-    template_name: str = "index.html", context: t.Dict[str, str] = {}
+    template_name: str = "index.html",
+    context: t.Optional[t.Dict[str, t.Any]] = None,
 ):
     """
     Render HTML instead of plain text. This will now
     be the 'data/payload' that we send.
 
-    We read the template_name file's HTML and return that HTML.
+    The template is compiled once and cached by the engine
+    (see templates.py), so we no longer open/read/parse the
+    file on every request.
     """
-    html_str: str
-    with open(template_name, "r") as f:
-        html_str = f.read()
-        html_str = html_str.format(**context)
-    return html_str
+    return engine.render(template_name, context)
     # return f"<h1>Hello {path=}</h1>\n{template_name=}"
 
 
+def stream_list_repr(chunks: t.Iterable[t.List]) -> t.Iterator[str]:
+    """
+    Yield the same text str(list) would give for all the rows in
+    chunks, one chunk at a time.
+    """
+    yield "["
+    separator = ""
+    for rows in chunks:
+        if rows:
+            yield separator + ", ".join(map(repr, rows))
+            separator = ", "
+    yield "]"
+
+
 # Create some route handler functions
+@router.route("/")
+@cacheable(templates=["index.html"], version=CODE_VERSION)
 def home(environ):
     """
     This is a route handler/function!
@@ -165,6 +240,8 @@ def home(environ):
     return render_template(template_name="index.html", context={})
 
 
+@router.route("/contact")
+@cacheable(templates=["contact.html"], version=CODE_VERSION)
 def contact_us(environ):
     """
     This is a route handler/function!
@@ -172,87 +249,505 @@ def contact_us(environ):
     Params:
         environ = The actual request object
     """
+    sent = get_str(get_query(environ), "sent") is not None
+    return render_contact_form(
+        environ, notice="Thanks! We got your message." if sent else ""
+    )
+
+
+def render_contact_form(
+    environ, notice: str = "", values: t.Optional[t.Dict[str, str]] = None
+) -> str:
+    values = values or {}
     return render_template(
-        template_name="contact.html", context={"path": environ.get("PATH_INFO")}
+        template_name="contact.html",
+        context={
+            "path": html.escape(environ.get("PATH_INFO", "")),
+            "notice": html.escape(notice),
+            **{
+                field: html.escape(values.get(field, ""))
+                for field in ("name", "email", "message")
+            },
+        },
+    )
+
+
+@router.route("/contact", methods=["POST"])
+def send_contact_message(environ):
+    """
+    Route handler for the /contact form (POST). Saves the message and
+    redirects back to /contact?sent=1, so refreshing the page doesn't
+    post it again.
+    """
+    form = form_parser.form(environ)
+    values = {
+        field: (get_str(form, field) or "").strip()
+        for field in ("name", "email", "message")
+    }
+    errors = []
+    if not values["name"]:
+        errors.append("Please tell us your name.")
+    if "@" not in values["email"]:
+        errors.append("Please enter a valid email address.")
+    if not values["message"]:
+        errors.append("Please write a message.")
+    if errors:
+        return Response(
+            render_contact_form(environ, " ".join(errors), values),
+            status=BadRequest.status,
+        )
+
+    # One line per message, a single append so workers don't interleave
+    record = json.dumps({"time": time.time(), **values}, ensure_ascii=False)
+    with open(settings.CONTACT_MESSAGES_FILE, "a", encoding="utf-8") as f:
+        f.write(record + "\n")
+    return Response(
+        status="303 See Other", headers=[("Location", "/contact?sent=1")]
     )
 
 
-def read_box_office_data(environ):
+# Media type -> format name for /box-office, in order of preference
+BOX_OFFICE_FORMATS: t.Dict[str, str] = {
+    "text/html": "html",
+    serializers.JSON_TYPE: "json",
+    serializers.NDJSON_TYPE: "ndjson",
+}
+
+
+def box_office_format(environ) -> str:
+    """Which representation of /box-office the client wants."""
+    return negotiate_format(environ, BOX_OFFICE_FORMATS, default="html")
+
+
+@router.route("/box-office")
+@router.route("/box-office/<int:year>")
+@cacheable(
+    templates=["box_office.html"],
+    datasets=[box_office],
+    version=CODE_VERSION,
+    variant=box_office_format,
+)
+def read_box_office_data(environ, year: t.Optional[int] = None):
     """
     Route handler for /box-office path. Trying to mimic
     FastAPI routing handler to display the movies data.
+
+    /box-office/2019 is the same as /box-office?year=2019
+
+    Sends HTML, JSON or NDJSON depending on the Accept header
+    (or ?format=html|json|ndjson), see box_office_format().
+
+    Query params:
+        limit = Number of movies to show (?movies=N still works too)
+        offset = Number of movies to skip (for paging)
+        sort = Column to sort by, prefix with "-" for descending
+            e.g. ?sort=-Worldwide
+        year = Only movies from this year
+        q = Only movies whose title starts with this (any case)
     """
-    df = pd.read_csv(dataset)
-    data = df.to_dict("Rank")
-
-    # NOTE: Add QUERY_STRING for number of movies to display
-    query_str: str = environ.get("QUERY_STRING")
-    print(query_str)
-
-    # Add a query string to specify number of records to return
-    if query_str == "":
-        # Do I pass in the data via context? Can I return "data": df.to_dict("Rank")?
-        # print(df.to_dict("Rank")[0])  # List[0] -> Dict
-        return render_template(
-            template_name="box_office.html",
-            context={"path": environ.get("PATH_INFO"), "data": data},
+    # NOTE: The CSV is loaded once into NumPy columns (see datastore.py)
+    # and we only turn the rows we actually display into Dicts.
+    with phase(environ, "data"):
+        movies = box_office.get()
+    response_format = box_office_format(environ)
+
+    # NOTE: Add QUERY_STRING for number of movies to display.
+    # Normalized since equivalent query strings share a cached page.
+    query_str: str = normalize_query(environ.get("QUERY_STRING", ""))
+    query = get_query(environ)
+
+    # ?movies=5 -> 5. Kept as an alias for ?limit=5
+    limit = get_int(query, "limit", get_int(query, "movies", minimum=0), 0)
+    offset = get_int(query, "offset", 0, minimum=0)
+    if year is None:
+        year = get_int(query, "year")
+    title = get_str(query, "q")
+
+    sort = get_str(query, "sort")
+    descending = False
+    if sort is not None:
+        descending = sort.startswith("-")
+        column = SORT_FIELDS.get(sort.lstrip("-").lower())
+        if column is None:
+            raise BadRequest(
+                f"Can't sort by {sort!r}, try one of {list(SORT_FIELDS.values())}"
+            )
+        sort = column
+
+    with phase(environ, "data"):
+        total, positions = movies.query(
+            sort=sort,
+            descending=descending,
+            filters={"Year": year} if year is not None else None,
+            prefix=("Release_Group", title) if title else None,
+            offset=offset,
+            limit=limit,
         )
-    else:
-        # Only single-digit numbers for now. Could parse further to
-        # get the actual value. Don't see anything in the request obj
-        # specifically. Could find '=' then take everything after and
-        # convert to INT.
-        num_movies: int = int(query_str.split("=")[-1])  # movies=5 -> 5
-        print(num_movies, type(num_movies))
-        return render_template(
-            template_name="box_office.html",
-            context={
-                "path": environ.get("PATH_INFO"),
-                "data": data[:num_movies],
-                "qs": query_str,
-                "movies": num_movies,
-            },
+    stream = len(positions) >= settings.STREAM_MIN_ROWS
+    chunk_size = settings.STREAM_CHUNK_ROWS if stream else None
+    if response_format == "json":
+        meta = {"total": total, "offset": offset, "limit": limit}
+        return Response(
+            serializers.to_json(movies, positions, meta, chunk_size),
+            content_type=serializers.JSON_TYPE,
+        )
+    if response_format == "ndjson":
+        return Response(
+            serializers.to_ndjson(movies, positions, chunk_size),
+            content_type=serializers.NDJSON_TYPE,
+        )
+
+    context = {
+        "path": environ.get("PATH_INFO"),
+        "qs": query_str,
+        "movies": len(positions),
+        "total": total,
+    }
+    if stream:
+        # Big page: hand back a generator. The <head> goes out right away
+        # and the rows follow STREAM_CHUNK_ROWS at a time.
+        context["data"] = stream_list_repr(
+            movies.iter_chunks(positions, settings.STREAM_CHUNK_ROWS)
+        )
+        return engine.stream("box_office.html", context)
+    with phase(environ, "data"):
+        context["data"] = movies.take(positions)
+    return render_template(template_name="box_office.html", context=context)
+
+
+# Largest ?n= for /box-office/stats/top
+MAX_TOP_N = 100
+
+
+def stats_years(query: t.Dict[str, t.List[str]]) -> t.Tuple:
+    """?year=2019 or ?from=2010&to=2015 -> (first, last), None = open"""
+    year = get_int(query, "year")
+    if year is not None:
+        return year, year
+    return get_int(query, "from"), get_int(query, "to")
+
+
+@router.route("/box-office/stats")
+@cacheable(datasets=[box_office], version=CODE_VERSION)
+def read_box_office_stats(environ):
+    """
+    Route handler for /box-office/stats: number of movies, Worldwide,
+    Domestic and Foreign totals and Domestic/Foreign shares per year
+    (and overall), as JSON. Computed once per dataset version (see
+    stats.py), so this only copies out the years asked for.
+
+    Query params:
+        year = Just this year
+        from, to = Only years in this range (both included)
+    """
+    first, last = stats_years(get_query(environ))
+    with phase(environ, "data"):
+        totals = stats.year_totals(box_office.get())
+        body = {"overall": totals.overall, "years": totals.between(first, last)}
+    return Response(json.dumps(body), content_type=serializers.JSON_TYPE)
+
+
+@router.route("/box-office/stats/top")
+@cacheable(datasets=[box_office], version=CODE_VERSION)
+def read_box_office_top(environ):
+    """
+    Route handler for /box-office/stats/top: the top N movies of every
+    year, as JSON {"2019": [movies...], ...}.
+
+    Query params:
+        n = Movies per year (default 10, at most MAX_TOP_N)
+        by = Worldwide (default), Domestic or Foreign
+        year, from, to = Which years, like /box-office/stats
+    """
+    query = get_query(environ)
+    n = get_int(query, "n", 10, minimum=1, maximum=MAX_TOP_N)
+    by = get_str(query, "by", "Worldwide")
+    column = SORT_FIELDS.get(by.lower())
+    if column not in stats.MONEY_COLUMNS:
+        raise BadRequest(f"'by' must be one of {list(stats.MONEY_COLUMNS)}")
+    first, last = stats_years(query)
+    with phase(environ, "data"):
+        top = stats.top_per_year(box_office.get(), column, n, first, last)
+    body = {"by": column, "n": n, "years": top}
+    return Response(json.dumps(body), content_type=serializers.JSON_TYPE)
+
+
+@router.route("/movie/<int:rank>")
+@cacheable(
+    templates=["movie.html"], datasets=[box_office], version=CODE_VERSION
+)
+def read_movie(environ, rank: int):
+    """
+    Route handler for a single movie by its Rank, e.g. /movie/1
+    """
+    with phase(environ, "data"):
+        movies = box_office.get()
+        _, positions = movies.query(filters={"Rank": rank}, limit=1)
+        if len(positions) == 0:
+            raise NotFound(f"There's no movie ranked {rank}")
+        movie = movies.take(positions)[0]
+    return render_template(
+        template_name="movie.html",
+        context={
+            "path": environ.get("PATH_INFO"),
+            "title": html.escape(movie["Release_Group"]),
+            "data": movie,
+        },
+    )
+
+
+# Files under /static and the dataset CSVs under /data (see static.py)
+static_files = StaticFiles(
+    STATIC_DIR, settings.STATIC_MAX_AGE, settings.STATIC_STAT_TTL
+)
+data_files = StaticFiles(
+    DATA_DIR, settings.STATIC_MAX_AGE, settings.STATIC_STAT_TTL
+)
+
+
+@router.route("/static/<path:filename>")
+def read_static_file(environ, filename: str):
+    return static_files.serve(environ, filename)
+
+
+@router.route("/data/<path:filename>")
+def read_data_file(environ, filename: str):
+    """Download the raw dataset, e.g. /data/movies-box-office-dataset-cleaned.csv"""
+    return data_files.serve(environ, filename)
+
+
+@router.route("/metrics")
+def read_metrics(environ):
+    """
+    Route handler for /metrics: request counts, bytes and latency
+    histograms for this worker, in the Prometheus text format.
+    """
+    return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.route("/stats")
+def read_stats(environ):
+    """
+    Route handler for /stats: response cache hit/miss counters
+    for this worker, as JSON.
+    """
+    return Response(
+        json.dumps({"pid": os.getpid(), "cache": response_cache.stats()}),
+        content_type="application/json",
+    )
+
+
+def preload() -> None:
+    """
+    Do the slow first request work up front: compile every template,
+    load the dataset and build the indexes and JSON rows the routes use.
+    run.py calls this once in the master process before it forks the
+    workers, so they all share the result.
+    """
+    for name in os.listdir(BASE_DIR):
+        if name.endswith(".html"):
+            engine.get_template(name)
+    movies = box_office.get()
+    for column in SORT_FIELDS.values():
+        movies.sort_order(column)
+        movies.sort_order(column, descending=True)
+    movies.group_index("Year")
+    movies.group_index("Rank")
+    movies.prefix_index("Release_Group")
+    serializers.json_rows(movies)
+    stats.year_totals(movies)
+    for column in stats.MONEY_COLUMNS:
+        stats.top_index(movies, column)
+
+
+def send_response(
+    environ: t.Dict,
+    start_response,
+    response: Response,
+    extra_headers: t.List[t.Tuple[str, str]],
+    started: float,
+):
+    """
+    Hand a Response to the WSGI server: set the headers, encode,
+    log and return the body iterable.
+    """
+    status = response.status
+    headers = list(response.headers) + extra_headers
+    if not status.startswith("304"):
+        headers.insert(0, ("Content-Type", response.content_type))
+    head_only = environ.get("REQUEST_METHOD") == "HEAD"
+
+    # Files (see static.py): the size is known, and the body may be a
+    # wsgi.file_wrapper the server can sendfile(), so pass it through as is
+    if response.is_streaming and response.content_length is not None:
+        headers.append(("Content-Length", str(response.content_length)))
+        start_response(status, headers)
+        access_log.log(
+            environ,
+            status,
+            0 if head_only else response.content_length,
+            time.perf_counter() - started,
+        )
+        if head_only:
+            close = getattr(response.body, "close", None)
+            if close is not None:
+                close()
+            return iter([])
+        return response.body
+
+    # Handlers can return a generator of str chunks for big pages.
+    # Stream those (no Content-Length) and log once the last chunk is out.
+    if response.is_streaming:
+        body = StreamingBody(
+            response.body,
+            on_close=lambda bytes_sent: access_log.log(
+                environ, status, bytes_sent, time.perf_counter() - started
+            ),
         )
+        start_response(status, headers)
+        if head_only:
+            body.close()
+            return iter([])
+        return body
+
+    # Response already holds the BYTE string (encoded once, and then
+    # reused as is when it comes out of the response cache)
+    data = response.body
+    if not status.startswith("304"):
+        headers.append(("Content-Length", str(len(data))))
+
+    # Gunicorn's start_response to get a response going
+    start_response(status, headers)
+    access_log.log(environ, status, len(data), time.perf_counter() - started)
+
+    # HEAD gets the same headers as GET but no body
+    if head_only:
+        return iter([])
+    # Where does this print to? Server logs I bet... YES!
+    # print(f"{data=}\n{iter([data])}")
+    return iter([data])  # <list_iterator object at 0x10f9f1340>
 
 
 def app(environ: t.Dict, start_response):
     """Expand app by adding routing by checking the path/route
     that is in the request (stored in 'environ') to render different
     things based on the specific routes."""
-    # Print the request object details in environ.items()
-    for k, v in environ.items():
-        print(k, v)
+    # NOTE: We used to print every environ.items() pair here on every
+    # request. Now a sampled access log line is queued at the end instead
+    # (see access_log.py). With a debug header and token configured,
+    # sending them logs the full environ for one request.
+    started = time.perf_counter()
 
     # Let's capture the request path
-    path = environ.get("PATH_INFO")
+    path = environ.get("PATH_INFO") or "/"
+    method = environ.get("REQUEST_METHOD", "GET")
 
     # Handle our different routes. Render different templates.
-    # Allow user to add "/" or not to URL string
-    # NOTE: Don't use elif statement! It skips 'data' assignment!
-    if path.endswith("/"):
-        path = path[:-1]  # remove the trailing "/"
-    if path == "":  # the root / index
-        data = home(environ)
-    elif path == "/contact":
-        data = contact_us(environ)
-    elif path == "/box-office":
-        data = read_box_office_data(environ)
-    else:
-        data = render_template(template_name="404.html", context={"path": path})
-
-    # Encode data to BYTE string
-    data = data.encode("utf-8")
+    # The router ignores a trailing "/" and finds the handler with a
+    # Dict lookup (or a short trie walk for paths like /movie/<rank>)
+    # instead of an if/elif chain.
+    response: t.Optional[Response] = None
+    cache_headers: t.List[t.Tuple[str, str]] = []
+    # Label for /metrics, until we know which handler it is
+    environ[ROUTE_KEY] = "not_found"
+    try:
+        with phase(environ, "routing"):
+            handler, params = router.match(method, path)
+            environ[ROUTE_KEY] = handler.__name__
+
+            # @cacheable routes get ETag/Last-Modified/Cache-Control
+            # headers. If the client already has this exact page, answer
+            # 304 without running the handler at all (see conditional.py).
+            # Otherwise we may still have the encoded page in the response
+            # cache.
+            conditional = getattr(handler, "conditional", None)
+            cache_key = None
+            if conditional is not None and method in ("GET", "HEAD"):
+                etag, last_modified = conditional.validators(environ)
+                cache_headers = conditional.headers(etag, last_modified)
+                if is_not_modified(environ, etag, last_modified):
+                    return send_response(
+                        environ,
+                        start_response,
+                        Response(status="304 Not Modified"),
+                        cache_headers,
+                        started,
+                    )
+                if conditional.ttl > 0:
+                    cache_key = etag
+                    response = response_cache.get(cache_key, handler.__name__)
+
+        if response is None:
+            with phase(environ, "render"):
+                data = handler(environ, **params)
+            with phase(environ, "encode"):
+                if not isinstance(data, Response):
+                    data = Response(data)
+            response = data
+            if cache_key is not None and response.status == "200 OK":
+                response_cache.put(
+                    cache_key, response, conditional.ttl, handler.__name__
+                )
+    except NotFound:
+        cache_headers = []
+        with phase(environ, "render"):
+            response = Response(
+                render_template(
+                    template_name="404.html",
+                    context={"path": html.escape(path)},
+                ),
+                status=NotFound.status,
+            )
+    except HTTPError as e:
+        # e.g. BadRequest for a query string we can't make sense of
+        # (error pages don't get the cache headers)
+        cache_headers = []
+        with phase(environ, "render"):
+            response = Response(
+                render_template(
+                    template_name="error.html",
+                    context={
+                        "status": e.status,
+                        "message": html.escape(e.message),
+                    },
+                ),
+                status=e.status,
+                headers=e.headers,
+            )
+    except Exception:
+        # A bug in a handler. Log it and send a 500 page ourselves, so it
+        # goes through the access log like any other response.
+        traceback.print_exc(file=environ.get("wsgi.errors"))
+        cache_headers = []
+        response = Response(
+            render_template(
+                template_name="error.html",
+                context={
+                    "status": HTTPError.status,
+                    "message": "Something went wrong on our end.",
+                },
+            ),
+            status=HTTPError.status,
+        )
+    finally:
+        # Close uploads and skip a request body nobody read (see forms.py)
+        form_parser.finish(environ)
 
-    # Gunicorn's start_response to get a response going
-    start_response(
-        f"200 OK",
-        [("Content-Type", "text/html"), ("Content-Length", str(len(data)))],
-        # You can remove these headers and the browser will still parse it.
-        # Modern browsers are smart enough to infer how to parse the request
+    return send_response(
+        environ, start_response, response, cache_headers, started
     )
-    # Where does this print to? Server logs I bet... YES!
-    # print(f"{data=}\n{iter([data])}")
-    return iter([data])  # <list_iterator object at 0x10f9f1340>
+
+
+# Wrap app in middleware. gunicorn server:app gets the wrapped version,
+# which gzips/brotlis responses for clients that accept it and times
+# every request for /metrics (outermost, so it includes compression).
+app = CompressionMiddleware(
+    app,
+    min_size=settings.COMPRESSION_MIN_SIZE,
+    level=settings.COMPRESSION_LEVEL,
+    types=settings.COMPRESSION_TYPES,
+)
+app = MetricsMiddleware(app, metrics)
 
 
 # # ====== Advanced: Handling MULTIPLE routes with helper functions
@@ -0,0 +1,92 @@
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# All settings can be overridden with environment variables, e.g.
+# ACCESS_LOG_SAMPLE_RATE=0.1 gunicorn server:app
+
+# ====== Access log (see access_log.py)
+# Fraction of requests to log, 0.0 - 1.0. Errors and debug requests are
+# always logged.
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1.0"))
+# Comma separated list of fields to include in each log line
+ACCESS_LOG_FIELDS = os.getenv(
+    "ACCESS_LOG_FIELDS", "time,method,path,query,status,bytes,duration_ms"
+).split(",")
+# Sending this header with ACCESS_LOG_DEBUG_TOKEN as its value logs the
+# full request 'environ' (cookies and credentials redacted). Debug logging
+# is off unless BOTH are set, e.g. "X-Debug" and a long random string.
+ACCESS_LOG_DEBUG_HEADER = os.getenv("ACCESS_LOG_DEBUG_HEADER", "")
+ACCESS_LOG_DEBUG_TOKEN = os.getenv("ACCESS_LOG_DEBUG_TOKEN", "")
+# Max log lines waiting to be written before new ones are dropped
+ACCESS_LOG_QUEUE_SIZE = int(os.getenv("ACCESS_LOG_QUEUE_SIZE", "10000"))
+
+# ====== Streaming (see response.py)
+# Pages with at least this many rows are streamed in chunks instead of
+# being rendered into one big string first
+STREAM_MIN_ROWS = int(os.getenv("STREAM_MIN_ROWS", "1000"))
+# Rows formatted per chunk when streaming
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "500"))
+
+# ====== HTTP caching (see conditional.py)
+# Default Cache-Control: max-age (seconds) for @cacheable routes
+CACHE_MAX_AGE = int(os.getenv("CACHE_MAX_AGE", "300"))
+
+# ====== Response cache (see response_cache.py)
+# Total size of cached response bodies per worker (bytes)
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+# Bodies bigger than this aren't cached (bytes)
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024))
+)
+# Default seconds a cached response is reused, per route with
+# @cacheable(ttl=...). 0 turns caching off for a route.
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+
+# ====== Compression (see compression.py)
+# Bodies smaller than this (bytes) are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# zlib level 1 (fast) - 9 (small)
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+# Comma separated Content-Types worth compressing
+COMPRESSION_TYPES = os.getenv(
+    "COMPRESSION_TYPES",
+    "text/html,application/json,application/x-ndjson,text/css,text/plain",
+).split(",")
+
+# ====== Static files (see static.py)
+# Cache-Control: max-age (seconds) for /static and /data files
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+# Seconds to reuse an os.stat() result before checking the file again
+STATIC_STAT_TTL = float(os.getenv("STATIC_STAT_TTL", "1.0"))
+
+# ====== ASGI (see asgi.py)
+# Threads running route handlers for uvicorn asgi:asgi_app
+ASGI_THREADS = int(
+    os.getenv("ASGI_THREADS", str(min(32, (os.cpu_count() or 1) + 4)))
+)
+
+# ====== Runner (see run.py)
+# Address to listen on
+BIND = os.getenv("BIND", "127.0.0.1:8000")
+# Worker processes. Route handlers are CPU bound, so one per core.
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+
+# ====== Request bodies (see forms.py)
+# Largest request body we accept (bytes), bigger ones get a 413
+MAX_BODY_SIZE = int(os.getenv("MAX_BODY_SIZE", str(1024 * 1024)))
+# Max fields (or multipart parts) in one form
+FORM_MAX_FIELDS = int(os.getenv("FORM_MAX_FIELDS", "1000"))
+# Max bytes of all text fields of a form together, kept in memory
+FORM_MAX_MEMORY_SIZE = int(os.getenv("FORM_MAX_MEMORY_SIZE", str(256 * 1024)))
+# Uploaded files bigger than this (bytes) are spooled to a temp file
+FORM_SPOOL_SIZE = int(os.getenv("FORM_SPOOL_SIZE", str(64 * 1024)))
+
+# ====== Contact form
+# Messages sent through /contact are appended here, one JSON object a line.
+# Next to this file by default, wherever gunicorn/uvicorn is started from.
+CONTACT_MESSAGES_FILE = os.getenv(
+    "CONTACT_MESSAGES_FILE", os.path.join(BASE_DIR, "contact-messages.ndjson")
+)
@@ -0,0 +1,247 @@
+"""
+NOTES:
+    - Serves files straight from a directory (CSS, images, the dataset
+      CSVs) so we don't need a separate server for them.
+    - Gunicorn puts a 'wsgi.file_wrapper' in environ. If our app returns
+      environ["wsgi.file_wrapper"](open_file) and sets Content-Length,
+      gunicorn hands the file to the kernel with os.sendfile(): the bytes go
+      from the page cache to the socket and never pass through Python.
+      Gunicorn's sendfile() starts at the file's current position and sends
+      Content-Length bytes, so a Range just means seek() + a smaller
+      Content-Length. Other servers (e.g. wsgiref) read the wrapper until
+      EOF, so a range that stops before the end of the file is read with a
+      small bounded generator instead.
+    - Range requests ("Range: bytes=100-199", "bytes=100-", "bytes=-500")
+      get "206 Partial Content", which lets clients resume big downloads.
+      Only a single range is supported; anything else gets the whole file.
+    - If the client accepts gzip and "<file>.gz" exists next to the file,
+      we send that instead with "Content-Encoding: gzip". Compress once at
+      deploy time (gzip -k -9 style.css) rather than on every request.
+    - os.stat() results are cached for 'stat_ttl' seconds, so finding a
+      hot asset (or its .gz) costs no syscalls. Misses are cached too, in an
+      LRU of at most 'max_stats' paths so random 404s can't grow it
+      forever. The size and mtime we actually send come from os.fstat() on
+      the file we opened, so a file replaced in the meantime can't get a
+      stale Content-Length.
+    - ETag/Last-Modified come from size + mtime and work with the usual
+      If-None-Match / If-Modified-Since (see conditional.py) and If-Range.
+    - Paths are resolved and must stay inside the directory, so
+      /static/../server.py is a 404.
+"""
+
+import mimetypes
+import os
+import stat
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+from compression import accepts
+from conditional import etag_matches, http_date, is_not_modified
+from request import HTTPError
+from response import Response
+from router import NotFound
+
+BLOCK_SIZE = 64 * 1024
+
+_CachedStat = t.Tuple[t.Optional[os.stat_result], float]
+
+
+class RangeNotSatisfiable(HTTPError):
+    status = "416 Range Not Satisfiable"
+
+
+def parse_range(header: str, size: int) -> t.Optional[t.Tuple[int, int]]:
+    """
+    "bytes=0-99" -> (0, 99), inclusive. Returns None when the header
+    should be ignored (not bytes, several ranges, garbage).
+
+    Raises:
+        RangeNotSatisfiable when the range is past the end of the file
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            # "bytes=-500" -> the last 500 bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable("Empty suffix range")
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else max(start, size - 1)
+    except ValueError:
+        return None
+    if start > end:
+        # e.g. "bytes=20-10" is invalid, so the header is ignored
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(f"Range starts past the end ({size} bytes)")
+    return start, min(end, size - 1)
+
+
+def _read_range(f: t.BinaryIO, length: int) -> t.Iterator[bytes]:
+    try:
+        while length > 0:
+            chunk = f.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+class StaticFiles:
+    """
+    Serve files from a directory.
+
+    Params:
+        directory = Folder to serve
+        max_age = Cache-Control: max-age for the files
+        stat_ttl = Seconds to reuse an os.stat() result
+        max_stats = Max number of paths to keep os.stat() results for
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_age: int = 3600,
+        stat_ttl: float = 1.0,
+        max_stats: int = 1024,
+    ):
+        self.directory = os.path.realpath(directory)
+        self.max_age = max_age
+        self.stat_ttl = stat_ttl
+        self.max_stats = max_stats
+        # path -> (stat result or None when missing, time we checked),
+        # least recently used first
+        self._stats: "OrderedDict[str, _CachedStat]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stat(self, path: str) -> t.Optional[os.stat_result]:
+        """Cached os.stat(); None for missing files and directories."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._stats.get(path)
+            if cached is not None:
+                if now - cached[1] < self.stat_ttl:
+                    self._stats.move_to_end(path)
+                    return cached[0]
+                del self._stats[path]
+        try:
+            result: t.Optional[os.stat_result] = os.stat(path)
+        except OSError:
+            result = None
+        if result is not None and not stat.S_ISREG(result.st_mode):
+            result = None
+        with self._lock:
+            self._stats[path] = (result, now)
+            while len(self._stats) > self.max_stats:
+                self._stats.popitem(last=False)
+        return result
+
+    def resolve(self, filename: str) -> str:
+        path = os.path.realpath(os.path.join(self.directory, filename))
+        if not path.startswith(self.directory + os.sep):
+            raise NotFound(f"Page not found: {filename}")
+        return path
+
+    def serve(self, environ: t.Dict, filename: str) -> Response:
+        path = self.resolve(filename)
+        st = self.stat(path)
+        if st is None:
+            raise NotFound(f"Page not found: {filename}")
+
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or "application/octet-stream"
+        if content_type.startswith("text/"):
+            content_type += "; charset=utf-8"
+
+        headers: t.List[t.Tuple[str, str]] = [
+            ("Accept-Ranges", "bytes"),
+            ("Vary", "Accept-Encoding"),
+        ]
+        etag_suffix = ""
+        if accepts(environ.get("HTTP_ACCEPT_ENCODING", ""), "gzip"):
+            gz_st = self.stat(path + ".gz")
+            if gz_st is not None and gz_st.st_mtime >= st.st_mtime:
+                path, etag_suffix = path + ".gz", "-gz"
+                headers.append(("Content-Encoding", "gzip"))
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            raise NotFound(f"Page not found: {filename}")
+        try:
+            # The file we opened may not be the one we stat()ed a moment
+            # ago, so size and validators come from the open file
+            st = os.fstat(f.fileno())
+            return self._respond(
+                environ, f, st, etag_suffix, content_type, headers
+            )
+        except BaseException:
+            f.close()
+            raise
+
+    def _respond(
+        self,
+        environ: t.Dict,
+        f: t.BinaryIO,
+        st: os.stat_result,
+        etag_suffix: str,
+        content_type: str,
+        headers: t.List[t.Tuple[str, str]],
+    ) -> Response:
+        """Build the response for an open file, which it takes over."""
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}{etag_suffix}"'
+        headers += [
+            ("ETag", etag),
+            ("Last-Modified", http_date(st.st_mtime)),
+            ("Cache-Control", f"public, max-age={self.max_age}"),
+        ]
+        if is_not_modified(environ, etag, st.st_mtime):
+            f.close()
+            return Response(status="304 Not Modified", headers=headers)
+
+        size = st.st_size
+        start, end = 0, size - 1
+        status = "200 OK"
+        range_header = environ.get("HTTP_RANGE")
+        if_range = environ.get("HTTP_IF_RANGE")
+        # If-Range: only honour Range if the client's copy is still current
+        if range_header and (if_range is None or etag_matches(if_range, etag)):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable as e:
+                e.headers.append(("Content-Range", f"bytes */{size}"))
+                raise
+            if byte_range is not None:
+                start, end = byte_range
+                status = "206 Partial Content"
+                headers.append(("Content-Range", f"bytes {start}-{end}/{size}"))
+        length = end - start + 1 if size else 0
+
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            f.close()
+            body: t.Iterable[bytes] = []
+        else:
+            if start:
+                f.seek(start)
+            file_wrapper = environ.get("wsgi.file_wrapper")
+            if file_wrapper is not None and end == size - 1:
+                # Up to EOF: safe for any server's file_wrapper to sendfile
+                body = file_wrapper(f, BLOCK_SIZE)
+            else:
+                body = _read_range(f, length)
+
+        return Response(
+            body,
+            status=status,
+            content_type=content_type,
+            headers=headers,
+            content_length=length,
+        )
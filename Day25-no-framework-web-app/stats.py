@@ -0,0 +1,173 @@
+"""
+NOTES:
+    - /box-office/stats answers "how did each year do?" questions: totals
+      per year, the top N movies of each year and how much of the money
+      came from the US (Domestic) vs the rest of the world (Foreign).
+    - Doing a pd.read_csv() + groupby() per request would cost O(whole
+      dataset) every time. Instead each aggregate is computed ONCE per
+      Dataset with Dataset.memoize(), so it's thrown away together with
+      the old data when the CSV changes, like the query() indexes.
+    - Group by without pandas: sort the rows by Year once (stable, so
+      Rank order is kept inside a year), find where each year starts in
+      that order, and np.add.reduceat() sums every column for all the
+      years in one vectorized call. Sums stay int64 so nothing is rounded.
+    - The shares are money weighted: Domestic_% of a year is its domestic
+      total / worldwide total, not the average of every movie's %.
+    - Top N per year: np.lexsort() orders rows by (Year, -column) once.
+      The top N of a year is then just order[start:start + N], so a
+      request costs O(rows it returns), not O(rows in the dataset).
+"""
+
+import typing as t
+
+import numpy as np
+
+from datastore import Dataset
+
+MONEY_COLUMNS = ("Worldwide", "Domestic", "Foreign")
+
+
+def _group_starts(sorted_values: np.ndarray) -> np.ndarray:
+    """Positions where a new value starts in an already sorted array."""
+    if len(sorted_values) == 0:
+        return np.empty(0, dtype=np.intp)
+    changes = np.flatnonzero(sorted_values[1:] != sorted_values[:-1]) + 1
+    return np.concatenate(([0], changes))
+
+
+def _shares(domestic: int, foreign: int, worldwide: int) -> t.Dict[str, float]:
+    if worldwide <= 0:
+        return {"Domestic_%": 0.0, "Foreign_%": 0.0}
+    return {
+        "Domestic_%": domestic / worldwide,
+        "Foreign_%": foreign / worldwide,
+    }
+
+
+class YearTotals:
+    """
+    Per year totals of a Dataset, see year_totals().
+
+    Params:
+        years = Sorted unique years
+        rows = One Dict per year: Year, Movies, money totals and shares
+        overall = The same for the whole dataset
+    """
+
+    def __init__(
+        self,
+        years: np.ndarray,
+        rows: t.List[t.Dict[str, t.Any]],
+        overall: t.Dict[str, t.Any],
+    ):
+        self.years = years
+        self.rows = rows
+        self.overall = overall
+
+    def between(
+        self, first: t.Optional[int] = None, last: t.Optional[int] = None
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """The rows for first <= Year <= last (either end can be open)."""
+        lo = 0 if first is None else np.searchsorted(self.years, first)
+        hi = (
+            len(self.years)
+            if last is None
+            else np.searchsorted(self.years, last, side="right")
+        )
+        return self.rows[lo:hi]
+
+
+def _build_year_totals(dataset: Dataset) -> YearTotals:
+    years = dataset.column("Year")
+    order = np.argsort(years, kind="stable")
+    starts = _group_starts(years[order])
+    unique_years = years[order][starts]
+    counts = np.diff(np.append(starts, len(order)))
+    sums = {
+        name: (
+            np.add.reduceat(dataset.column(name)[order], starts)
+            if len(starts)
+            else np.empty(0, dtype=np.int64)
+        )
+        for name in MONEY_COLUMNS
+    }
+
+    # Only len(years) values left, plain Python from here on
+    columns = {name: values.tolist() for name, values in sums.items()}
+    rows = []
+    for i, (year, count) in enumerate(zip(unique_years.tolist(), counts)):
+        totals = {name: columns[name][i] for name in MONEY_COLUMNS}
+        rows.append(
+            {
+                "Year": year,
+                "Movies": int(count),
+                **totals,
+                **_shares(
+                    totals["Domestic"], totals["Foreign"], totals["Worldwide"]
+                ),
+            }
+        )
+    overall_totals = {name: sum(columns[name]) for name in MONEY_COLUMNS}
+    overall = {
+        "Movies": len(dataset),
+        **overall_totals,
+        **_shares(
+            overall_totals["Domestic"],
+            overall_totals["Foreign"],
+            overall_totals["Worldwide"],
+        ),
+    }
+    return YearTotals(unique_years, rows, overall)
+
+
+def year_totals(dataset: Dataset) -> YearTotals:
+    """Totals and Domestic/Foreign shares per year, computed once."""
+    return dataset.memoize(
+        ("stats", "years"), lambda: _build_year_totals(dataset)
+    )
+
+
+def _build_top_index(
+    dataset: Dataset, column: str
+) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    years = dataset.column("Year")
+    # The last key sorts first. lexsort is stable, so ties keep Rank order.
+    order = np.lexsort((-dataset.column(column), years))
+    starts = _group_starts(years[order])
+    ends = np.append(starts[1:], len(order))
+    return order, years[order][starts], starts, ends
+
+
+def top_index(
+    dataset: Dataset, column: str
+) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return (order, years, starts, ends): order has the rows sorted by Year
+    and then column (highest first), order[starts[i]:ends[i]] are the rows
+    of years[i]. Computed once per Dataset and column.
+    """
+    return dataset.memoize(
+        ("stats", "top", column), lambda: _build_top_index(dataset, column)
+    )
+
+
+def top_per_year(
+    dataset: Dataset,
+    column: str,
+    n: int,
+    first: t.Optional[int] = None,
+    last: t.Optional[int] = None,
+) -> t.Dict[int, t.List[t.Dict[str, t.Any]]]:
+    """
+    The n movies with the highest column (e.g. Worldwide) of every year
+    between first and last: {year: [row Dicts]}.
+    """
+    order, years, starts, ends = top_index(dataset, column)
+    lo = 0 if first is None else np.searchsorted(years, first)
+    hi = len(years) if last is None else np.searchsorted(years, last, "right")
+    return {
+        year: dataset.take(order[start : min(start + n, end)])
+        for year, start, end in zip(
+            years[lo:hi].tolist(), starts[lo:hi], ends[lo:hi]
+        )
+    }
@@ -0,0 +1,230 @@
+"""
+NOTES:
+    - render_template() used to open() + read() the HTML file and then run
+      .format(**context) on EVERY request. That's a syscall plus a full
+      parse of the template string for each hit on /, /contact, /box-office.
+    - Instead we "compile" each template ONCE: string.Formatter().parse()
+      splits the HTML into (literal_text, field_name, format_spec, conversion)
+      tuples. We keep those pieces in a list and rendering is just a join
+      of the literal text + looked up context values. Same {placeholder}
+      syntax as str.format() so the .html files don't change.
+    - Compiled templates are cached by their absolute path. We remember the
+      file's mtime so editing an .html file is picked up without restarting
+      gunicorn. To keep os.stat() off the hot path too, we only re-check the
+      mtime every 'check_interval' seconds (0 = check every time).
+    - Missing context keys still raise KeyError just like str.format() would.
+    - stream() is render() for big pages: any context value that is an
+      iterator/generator of strings is passed through chunk by chunk instead
+      of being turned into one big string, and the text around it is yielded
+      as soon as it's ready. e.g. box_office.html's {data} can be a generator
+      of row chunks so the <head> goes out before any rows are formatted.
+"""
+
+import collections.abc
+import os
+import string
+import threading
+import time
+import typing as t
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_formatter = string.Formatter()
+
+
+def _make_getter(
+    field_name: str, format_spec: str, conversion: t.Optional[str]
+) -> t.Callable[[t.Mapping[str, t.Any]], str]:
+    """
+    Build a small function that pulls a single {placeholder} value
+    out of the context and formats it.
+
+    Most of our placeholders are plain names like {path} with no
+    conversion/format spec, so those get a fast path: context[name].
+    Anything fancier ({movie.title!r:>10}) goes through Formatter.
+    """
+    if field_name.isidentifier() and not format_spec and conversion is None:
+
+        def getter(context):
+            value = context[field_name]
+            return value if type(value) is str else format(value)
+
+        return getter
+
+    def getter(context):
+        obj, _ = _formatter.get_field(field_name, (), context)
+        obj = _formatter.convert_field(obj, conversion)
+        # Nested fields in the format spec, e.g. {value:>{width}}
+        spec = _formatter.vformat(format_spec, (), context)
+        return _formatter.format_field(obj, spec)
+
+    return getter
+
+
+class CompiledTemplate:
+    """
+    A template that has been parsed once and can be rendered many
+    times with different context Dicts.
+    """
+
+    def __init__(self, path: str, source: str, mtime_ns: int = 0):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.checked_at = time.monotonic()
+        self.parts: t.List[t.Union[str, t.Callable]] = []
+        # Simple {name} placeholders, by index into parts (for stream())
+        self.names: t.Dict[int, str] = {}
+        self.fields: t.Set[str] = set()
+
+        for literal, field_name, format_spec, conversion in _formatter.parse(
+            source
+        ):
+            if literal:
+                # Merge neighbouring literal chunks into one string
+                if self.parts and isinstance(self.parts[-1], str):
+                    self.parts[-1] += literal
+                else:
+                    self.parts.append(literal)
+            if field_name is not None:
+                if field_name == "" or field_name.isdigit():
+                    raise ValueError(
+                        f"{path}: positional fields aren't supported, "
+                        "use named {placeholders}"
+                    )
+                self.fields.add(field_name)
+                if field_name.isidentifier() and not format_spec:
+                    self.names[len(self.parts)] = field_name
+                self.parts.append(
+                    _make_getter(field_name, format_spec or "", conversion)
+                )
+
+    def render(self, context: t.Optional[t.Mapping[str, t.Any]] = None) -> str:
+        """Fill the compiled template with values from context."""
+        if context is None:
+            context = {}
+        return "".join(
+            [
+                part if type(part) is str else part(context)
+                for part in self.parts
+            ]
+        )
+
+    def stream(
+        self, context: t.Optional[t.Mapping[str, t.Any]] = None
+    ) -> t.Iterator[str]:
+        """
+        Like render() but yields the output in pieces. Context values
+        that are iterators are yielded chunk by chunk.
+        """
+        if context is None:
+            context = {}
+        buffer: t.List[str] = []
+        for i, part in enumerate(self.parts):
+            if type(part) is str:
+                buffer.append(part)
+                continue
+            name = self.names.get(i)
+            value = context[name] if name is not None else None
+            if isinstance(value, collections.abc.Iterator):
+                if buffer:
+                    yield "".join(buffer)
+                    buffer = []
+                yield from value
+            else:
+                buffer.append(part(context))
+        if buffer:
+            yield "".join(buffer)
+
+
+class TemplateEngine:
+    """
+    Compiles templates on first use and caches them keyed by path/mtime.
+
+    Params:
+        template_dir = Where relative template names are looked up.
+        check_interval = Seconds between mtime checks per template.
+    """
+
+    def __init__(
+        self, template_dir: str = BASE_DIR, check_interval: float = 1.0
+    ):
+        self.template_dir = template_dir
+        self.check_interval = check_interval
+        self._cache: t.Dict[str, CompiledTemplate] = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, template_name: str) -> str:
+        return os.path.join(self.template_dir, template_name)
+
+    def _compile(self, path: str) -> CompiledTemplate:
+        with self._lock:
+            # Another thread may have compiled it while we waited
+            mtime_ns = os.stat(path).st_mtime_ns
+            cached = self._cache.get(path)
+            if cached is not None and cached.mtime_ns == mtime_ns:
+                cached.checked_at = time.monotonic()
+                return cached
+            with open(path, "r") as f:
+                source = f.read()
+            compiled = CompiledTemplate(path, source, mtime_ns)
+            self._cache[path] = compiled
+            return compiled
+
+    def get_template(self, template_name: str) -> CompiledTemplate:
+        """
+        Return the compiled template, recompiling if the file
+        changed on disk since we last compiled it.
+        """
+        path = self.get_path(template_name)
+        cached = self._cache.get(path)
+        if cached is None:
+            return self._compile(path)
+
+        now = time.monotonic()
+        if now - cached.checked_at >= self.check_interval:
+            if os.stat(path).st_mtime_ns != cached.mtime_ns:
+                return self._compile(path)
+            cached.checked_at = now
+        return cached
+
+    def render(
+        self,
+        template_name: str,
+        context: t.Optional[t.Mapping[str, t.Any]] = None,
+    ) -> str:
+        return self.get_template(template_name).render(context)
+
+    def stream(
+        self,
+        template_name: str,
+        context: t.Optional[t.Mapping[str, t.Any]] = None,
+    ) -> t.Iterator[str]:
+        return self.get_template(template_name).stream(context)
+
+    def render_many(
+        self,
+        items: t.Iterable[t.Tuple[str, t.Optional[t.Mapping[str, t.Any]]]],
+    ) -> t.List[str]:
+        """
+        Bulk render a sequence of (template_name, context) pairs.
+        Each template is looked up once no matter how many times
+        it shows up in items.
+        """
+        compiled: t.Dict[str, CompiledTemplate] = {}
+        rendered: t.List[str] = []
+        for template_name, context in items:
+            template = compiled.get(template_name)
+            if template is None:
+                template = compiled[template_name] = self.get_template(
+                    template_name
+                )
+            rendered.append(template.render(context))
+        return rendered
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+# Shared engine for the whole process (one per gunicorn worker)
+engine = TemplateEngine()
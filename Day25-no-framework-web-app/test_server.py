@@ -0,0 +1,1022 @@
+# Run with: python -m pytest Day25-no-framework-web-app
+import asyncio
+import gzip
+import io
+import json
+import os
+import sys
+from wsgiref.util import setup_testing_defaults
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import asgi  # noqa: E402
+import server  # noqa: E402
+import metrics  # noqa: E402
+import serializers  # noqa: E402
+import stats  # noqa: E402
+from access_log import AccessLog  # noqa: E402
+from asgi import ASGIApp, build_environ  # noqa: E402
+from datastore import BOX_OFFICE_SCHEMA, Dataset, DatasetStore  # noqa: E402
+from forms import FormParser, MultipartParser  # noqa: E402
+from request import BadRequest, PayloadTooLarge  # noqa: E402
+from response import Response  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+from router import MethodNotAllowed, NotFound, Router  # noqa: E402
+from static import RangeNotSatisfiable, StaticFiles, parse_range  # noqa: E402
+from templates import CompiledTemplate, TemplateEngine  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def quiet_access_log():
+    sample_rate = server.access_log.sample_rate
+    debug_key = server.access_log.debug_key
+    server.access_log.sample_rate = 0
+    server.access_log.debug_key = None
+    yield
+    server.access_log.sample_rate = sample_rate
+    server.access_log.debug_key = debug_key
+
+
+def call(path, query="", method="GET", body=None, **headers):
+    """Call server.app like a WSGI server would: (status, headers, chunks)"""
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update(PATH_INFO=path, QUERY_STRING=query, REQUEST_METHOD=method)
+    if body is not None:
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+    for name, value in headers.items():
+        if name != "content_type":
+            name = "HTTP_" + name
+        environ[name.upper()] = value
+    started = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        started["status"] = status
+        started["headers"] = dict(response_headers)
+
+    body = server.app(environ, start_response)
+    try:
+        chunks = list(body)
+    finally:
+        getattr(body, "close", lambda: None)()
+    return started["status"], started["headers"], chunks
+
+
+def get(path, query="", **kwargs):
+    """call() with the body joined into one bytes"""
+    status, headers, chunks = call(path, query, **kwargs)
+    return status, headers, b"".join(chunks)
+
+
+# ====== Templates
+HTML_FILES = sorted(
+    n for n in os.listdir(server.BASE_DIR) if n.endswith(".html")
+)
+
+
+@pytest.mark.parametrize("name", HTML_FILES)
+def test_compiled_templates_render_like_str_format(name):
+    with open(os.path.join(server.BASE_DIR, name)) as f:
+        source = f.read()
+    template = CompiledTemplate(name, source)
+    context = {field: f"<{field} & 1>" for field in template.fields}
+    assert template.render(context) == source.format(**context)
+    assert "".join(template.stream(context)) == source.format(**context)
+
+
+def test_compiled_template_fancy_fields():
+    source = "{{x}} {a.real:>6} {b!r} {c[k]} {d:>{width}} {e:,}"
+    context = dict(a=3, b="q", c={"k": "v"}, d="z", width=4, e=1234567)
+    template = CompiledTemplate("inline", source)
+    assert template.render(context) == source.format(**context)
+    with pytest.raises(KeyError):
+        template.render({})
+
+
+def test_template_reloads_after_check_interval(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("templates.time.monotonic", lambda: now[0])
+    path = tmp_path / "page.html"
+    path.write_text("old {x}")
+    engine = TemplateEngine(str(tmp_path), check_interval=5)
+    assert engine.render("page.html", {"x": 1}) == "old 1"
+
+    path.write_text("new {x}")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    # Not checked again before check_interval is up
+    now[0] += 4
+    assert engine.render("page.html", {"x": 1}) == "old 1"
+    now[0] += 1
+    assert engine.render("page.html", {"x": 1}) == "new 1"
+
+
+def test_render_many_matches_render():
+    engine = TemplateEngine()
+    items = [
+        ("404.html", {"path": "/a"}),
+        ("error.html", {"status": 500, "message": "<oops>"}),
+        ("404.html", {"path": "/b"}),
+    ]
+    expected = [engine.render(name, context) for name, context in items]
+    assert engine.render_many(items) == expected
+
+
+# ====== Dataset.query()
+TITLES = ["b", "Star Wars", "a", "star trek", "Alien", "B", "starship"]
+YEARS = [2019, 2018, 2019, 2020, 2018, 2019, 2020]
+
+
+@pytest.fixture
+def dataset():
+    return Dataset(
+        {
+            "Rank": np.arange(1, 8, dtype=np.int32),
+            "Title": np.array(TITLES, dtype=object),
+            "Year": np.array(YEARS, dtype=np.int16),
+            "Gross": np.array([5, 3, 5, 1, 9, 5, 2], dtype=np.int64),
+        }
+    )
+
+
+def brute_force(key=None, reverse=False, year=None, prefix=None):
+    rows = list(range(len(TITLES)))
+    if year is not None:
+        rows = [i for i in rows if YEARS[i] == year]
+    if prefix is not None:
+        rows = [i for i in rows if TITLES[i].casefold().startswith(prefix)]
+    if key is not None:
+        # sorted() is stable, ties keep row order even when reversed
+        rows = sorted(rows, key=lambda i: -key(i) if reverse else key(i))
+    return rows
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_query_sort_keeps_row_order_for_ties(dataset, descending):
+    gross = dataset.column("Gross")
+    total, positions = dataset.query(sort="Gross", descending=descending)
+    assert total == 7
+    assert positions.tolist() == brute_force(
+        lambda i: int(gross[i]), descending
+    )
+
+
+def test_query_sorts_strings_ignoring_case(dataset):
+    _, positions = dataset.query(sort="Title")
+    assert [TITLES[i] for i in positions] == [
+        "a",
+        "Alien",
+        "b",
+        "B",
+        "star trek",
+        "Star Wars",
+        "starship",
+    ]
+
+
+def test_query_filters_sort_and_page(dataset):
+    gross = dataset.column("Gross")
+    expected = brute_force(lambda i: int(gross[i]), True, year=2019)
+    total, positions = dataset.query(
+        sort="Gross", descending=True, filters={"Year": 2019}, offset=1, limit=1
+    )
+    assert total == len(expected)
+    assert positions.tolist() == expected[1:2]
+
+
+def test_query_prefix_and_filter(dataset):
+    total, positions = dataset.query(
+        prefix=("Title", "STAR"), filters={"Year": 2020}
+    )
+    assert positions.tolist() == brute_force(year=2020, prefix="star")
+    assert total == 2
+
+
+def test_query_no_matches(dataset):
+    assert dataset.query(filters={"Year": 1999})[0] == 0
+    assert dataset.query(prefix=("Title", "zzz"))[0] == 0
+    assert dataset.query(offset=100)[1].tolist() == []
+
+
+def test_shared_dataset_matches(dataset):
+    shared = dataset.to_shared()
+    assert shared.rows() == dataset.rows()
+    assert shared.take([3, 1]) == dataset.take([3, 1])
+    assert (
+        shared.query(sort="Title")[1].tolist()
+        == dataset.query(sort="Title")[1].tolist()
+    )
+    assert (
+        shared.query(prefix=("Title", "sta"))[1].tolist()
+        == dataset.query(prefix=("Title", "sta"))[1].tolist()
+    )
+
+
+def test_shared_store_serves_the_same_rows(small_csv):
+    plain = DatasetStore(str(small_csv), BOX_OFFICE_SCHEMA).get()
+    shared = DatasetStore(str(small_csv), BOX_OFFICE_SCHEMA, shared=True).get()
+    assert shared.rows() == plain.rows()
+    assert list(serializers.json_rows(shared)) == list(
+        serializers.json_rows(plain)
+    )
+
+
+# ====== Router
+def test_router_prefers_static_segments_and_backtracks():
+    router = Router()
+    router.add_route("/movie/<int:rank>", "by_rank")
+    router.add_route("/movie/<name>/cast", "cast")
+    router.add_route("/movie/top", "top")
+    router.add_route("/files/<path:name>", "files")
+    assert router.match("GET", "/movie/top/") == ("top", {})
+    assert router.match("GET", "/movie/7") == ("by_rank", {"rank": 7})
+    # "7" converts to an int, but only <name> has a /cast child
+    assert router.match("GET", "/movie/7/cast") == ("cast", {"name": "7"})
+    assert router.match("HEAD", "/files/a/b.css") == (
+        "files",
+        {"name": "a/b.css"},
+    )
+    with pytest.raises(NotFound):
+        router.match("GET", "/movie/7/crew")
+    with pytest.raises(MethodNotAllowed) as error:
+        router.match("POST", "/movie/7")
+    assert ("Allow", "GET, HEAD") in error.value.headers
+
+
+def test_app_routes():
+    assert get("/box-office/stats")[0] == "200 OK"  # not <int:year>
+    assert get("/nope")[0] == "404 Not Found"
+    status, headers, _ = get("/", method="DELETE")
+    assert status == "405 Method Not Allowed"
+    assert headers["Allow"] == "GET, HEAD"
+
+
+# ====== Access log
+@pytest.fixture
+def queued(monkeypatch):
+    """An AccessLog without its writer thread, records stay on the queue"""
+
+    def make(**kwargs):
+        log = AccessLog(fields=["path", "status"], **kwargs)
+        monkeypatch.setattr(log, "_ensure_writer", lambda: None)
+        return log
+
+    return make
+
+
+def drain(log):
+    records = []
+    while not log.queue.empty():
+        records.append(log.queue.get_nowait())
+    return records
+
+
+def test_access_log_samples_but_keeps_errors(queued, monkeypatch):
+    log = queued(sample_rate=0.25)
+    rolls = iter([0.1, 0.5, 0.24, 0.25])
+    monkeypatch.setattr("access_log.random.random", lambda: next(rolls))
+    for path in ["/a", "/b", "/c", "/d"]:
+        log.log({"PATH_INFO": path}, "200 OK", 0, 0.0)
+    log.log({"PATH_INFO": "/e"}, "500 Internal Server Error", 0, 0.0)
+    assert [record["path"] for record in drain(log)] == ["/a", "/c", "/e"]
+
+    log.sample_rate = 0
+    log.log({"PATH_INFO": "/f"}, "404 Not Found", 0, 0.0)
+    assert drain(log) == []
+
+
+def test_access_log_debug_needs_the_token(queued):
+    assert queued(debug_header="X-Debug").debug_key is None
+    log = queued(sample_rate=0, debug_header="X-Debug", debug_token="s3cret")
+    environ = {
+        "PATH_INFO": "/",
+        "HTTP_COOKIE": "session=abc",
+        "HTTP_AUTHORIZATION": "Basic dXNlcjpwdw==",
+        "HTTP_USER_AGENT": "curl",
+    }
+    log.log({**environ, "HTTP_X_DEBUG": "1"}, "200 OK", 0, 0.0)
+    assert drain(log) == []
+
+    log.log({**environ, "HTTP_X_DEBUG": "s3cret"}, "200 OK", 0, 0.0)
+    (record,) = drain(log)
+    assert record["environ"]["HTTP_USER_AGENT"] == "curl"
+    for key in ["HTTP_COOKIE", "HTTP_AUTHORIZATION", "HTTP_X_DEBUG"]:
+        assert record["environ"][key] == "[redacted]"
+    assert "abc" not in json.dumps(record) and "s3cret" not in json.dumps(
+        record
+    )
+
+
+def test_access_log_drops_records_when_the_queue_is_full(queued):
+    log = queued(queue_size=2)
+    for path in ["/a", "/b", "/c", "/d"]:
+        log.log({"PATH_INFO": path}, "200 OK", 0, 0.0)
+    assert log.dropped == 2
+    assert [record["path"] for record in drain(log)] == ["/a", "/b"]
+
+
+def test_access_log_writes_json_lines():
+    stream = io.StringIO()
+    log = AccessLog(stream, fields=["method", "path", "status", "bytes"])
+    log.log({"REQUEST_METHOD": "GET", "PATH_INFO": "/"}, "200 OK", 12, 0.1)
+    log.close()
+    assert json.loads(stream.getvalue()) == {
+        "method": "GET",
+        "path": "/",
+        "status": 200,
+        "bytes": 12,
+    }
+
+
+# ====== Streaming
+def test_streamed_page_is_the_same_as_the_buffered_one(monkeypatch):
+    query = "limit=1200&sort=-worldwide"
+    monkeypatch.setattr(server.settings, "STREAM_CHUNK_ROWS", 500)
+    # Buffered pages are kept in the response cache, don't get one of those
+    server.response_cache.clear()
+    status, headers, chunks = call("/box-office", query)
+    assert status == "200 OK"
+    assert "Content-Length" not in headers
+    # The head/opening and 3 chunks of rows at least
+    assert len([chunk for chunk in chunks if chunk]) > 3
+
+    monkeypatch.setattr(server.settings, "STREAM_MIN_ROWS", 10**9)
+    server.response_cache.clear()
+    _, buffered_headers, buffered = get("/box-office", query)
+    server.response_cache.clear()
+    assert int(buffered_headers["Content-Length"]) == len(buffered)
+    assert b"".join(chunks) == buffered
+
+
+def test_head_of_a_streamed_page_has_no_body():
+    server.response_cache.clear()
+    status, headers, chunks = call("/box-office", "limit=1200", method="HEAD")
+    assert status == "200 OK"
+    assert "Content-Length" not in headers
+    assert chunks == []
+
+
+# ====== ETags and 304s
+def test_not_modified_repeats_the_etag_of_the_200():
+    status, headers, _ = get("/")
+    etag = headers["ETag"]
+    assert status == "200 OK"
+    assert (
+        headers["Cache-Control"]
+        == f"public, max-age={server.settings.CACHE_MAX_AGE}"
+    )
+    status, headers, body = get("/", if_none_match=etag)
+    assert status == "304 Not Modified"
+    assert headers["ETag"] == etag
+    assert body == b""
+    assert get("/", if_none_match='"other"')[0] == "200 OK"
+
+
+def test_etag_ignores_the_order_of_the_query():
+    etag = get("/box-office", "limit=5&offset=2")[1]["ETag"]
+    assert get("/box-office", "offset=2&limit=5")[1]["ETag"] == etag
+    assert get("/box-office", "offset=3&limit=5")[1]["ETag"] != etag
+
+
+def test_if_modified_since():
+    _, headers, _ = get("/contact")
+    status, _, _ = get("/contact", if_modified_since=headers["Last-Modified"])
+    assert status == "304 Not Modified"
+    # If-None-Match wins when both are sent
+    status, _, _ = get(
+        "/contact",
+        if_modified_since=headers["Last-Modified"],
+        if_none_match='"other"',
+    )
+    assert status == "200 OK"
+
+
+# ====== Response cache
+def test_response_cache_evicts_by_bytes():
+    cache = ResponseCache(max_bytes=10, max_entry_bytes=6)
+    assert cache.put("a", Response(b"aaaa"), ttl=60)
+    assert cache.put("b", Response(b"bbbb"), ttl=60)
+    assert cache.get("a") is not None  # "b" is now least recently used
+    assert cache.put("c", Response(b"cccc"), ttl=60)
+    assert cache.get("b") is None
+    assert cache.size == 8
+    assert not cache.put("d", Response(b"d" * 7), ttl=60)
+    assert cache.put("a", Response(b"aa"), ttl=60)  # replacing an entry
+    assert cache.size == 6
+    assert cache.put("e", Response(b"e"), ttl=0)
+    assert cache.get("e") is None
+    assert cache.size == 6
+
+
+def test_app_reuses_the_cached_page():
+    server.response_cache.clear()
+    counters = server.response_cache.counters["read_box_office_data"]
+    hits, misses = counters["hits"], counters["misses"]
+    first = get("/box-office", "limit=7")
+    assert get("/box-office", "limit=7") == first
+    assert counters["misses"] == misses + 1 and counters["hits"] == hits + 1
+
+
+# ====== Compression
+@pytest.mark.parametrize("query", ["limit=50", "limit=1200"])
+def test_gzip_body_decompresses_to_the_identity_body(query):
+    _, headers, identity = get("/box-office", query)
+    status, headers, body = get("/box-office", query, accept_encoding="gzip")
+    assert status == "200 OK"
+    assert headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in headers["Vary"]
+    assert len(body) < len(identity)
+    assert gzip.decompress(body) == identity
+
+
+def test_small_pages_are_not_compressed():
+    status, headers, _ = get("/", accept_encoding="gzip")
+    # "/" is too small to compress, so no -gzip variant anywhere
+    assert "Content-Encoding" not in headers
+    assert not headers["ETag"].endswith('-gzip"')
+    status, headers, _ = get(
+        "/", accept_encoding="gzip", if_none_match=headers["ETag"]
+    )
+    assert status == "304 Not Modified"
+
+
+def test_not_modified_for_a_compressed_variant():
+    status, headers, _ = get("/box-office", "limit=50", accept_encoding="gzip")
+    etag = headers["ETag"]
+    assert headers["Content-Encoding"] == "gzip" and etag.endswith('-gzip"')
+    status, headers, _ = get(
+        "/box-office", "limit=50", accept_encoding="gzip", if_none_match=etag
+    )
+    assert status == "304 Not Modified"
+    assert headers["ETag"] == etag
+    # The gzip variant doesn't validate the identity (or deflate) body
+    assert get("/box-office", "limit=50", if_none_match=etag)[0] == "200 OK"
+    status, _, _ = get(
+        "/box-office", "limit=50", accept_encoding="deflate", if_none_match=etag
+    )
+    assert status == "200 OK"
+
+
+def test_static_files_are_never_given_a_variant_etag():
+    _, headers, _ = get("/static/style.css", accept_encoding="gzip")
+    etag = headers["ETag"]
+    assert "Content-Encoding" not in headers
+    status, headers, _ = get(
+        "/static/style.css", accept_encoding="gzip", if_none_match=etag
+    )
+    assert status == "304 Not Modified"
+    assert headers["ETag"] == etag
+
+
+# ====== JSON / NDJSON
+SMALL_CSV = "\n".join(
+    [
+        "Rank,Release_Group,Worldwide,Domestic_%,Year,Filename",
+        '1,"Say ""Hi""",300,0.5,2019,2019.csv',
+        "2,Amélie \\ Co,200,0.25,2001,2001.csv",
+        '3,"Tab\tand, comma",100,1e-05,2019,2019.csv',
+        "",
+    ]
+)
+
+
+@pytest.fixture
+def small_csv(tmp_path):
+    path = tmp_path / "small.csv"
+    path.write_text(SMALL_CSV, encoding="utf-8")
+    return path
+
+
+def test_to_json_parses_to_the_rows(small_csv):
+    dataset = Dataset.from_csv(str(small_csv), BOX_OFFICE_SCHEMA)
+    positions = np.array([2, 0])
+    expected = dataset.take(positions)
+    body = serializers.to_json(dataset, positions, {"total": 3})
+    assert json.loads(body) == {"total": 3, "data": expected}
+    chunks = list(serializers.to_json(dataset, positions, {}, chunk_size=1))
+    assert json.loads("".join(chunks)) == {"data": expected}
+    assert json.loads(serializers.to_json(dataset, positions[:0], {})) == {
+        "data": []
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 2])
+def test_to_ndjson_is_one_object_per_line(small_csv, chunk_size):
+    dataset = Dataset.from_csv(str(small_csv), BOX_OFFICE_SCHEMA)
+    body = serializers.to_ndjson(dataset, np.arange(3), chunk_size)
+    body = body if isinstance(body, str) else "".join(body)
+    assert body.endswith("\n")
+    lines = body[:-1].split("\n")
+    assert [json.loads(line) for line in lines] == dataset.take(range(3))
+    assert serializers.to_ndjson(dataset, np.arange(0)) == ""
+
+
+def test_json_rows_are_rebuilt_for_a_new_version(small_csv):
+    store = DatasetStore(str(small_csv), BOX_OFFICE_SCHEMA, check_interval=0)
+    rows = serializers.json_rows(store.get())
+    assert serializers.json_rows(store.get()) is rows
+
+    small_csv.write_text(SMALL_CSV.replace("300", "301"), encoding="utf-8")
+    stat = os.stat(small_csv)
+    os.utime(small_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    new_rows = serializers.json_rows(store.get())
+    assert new_rows is not rows
+    assert json.loads(new_rows[0])["Worldwide"] == 301
+
+
+@pytest.mark.parametrize(
+    "query, accept, content_type",
+    [
+        ("format=json", "", serializers.JSON_TYPE),
+        ("", "application/json", serializers.JSON_TYPE),
+        ("format=ndjson", "text/html", serializers.NDJSON_TYPE),
+    ],
+)
+def test_box_office_formats(query, accept, content_type):
+    status, headers, body = get(
+        "/box-office", query + "&limit=3", accept=accept
+    )
+    assert status == "200 OK"
+    assert headers["Content-Type"] == content_type
+    assert "Accept" in headers["Vary"]
+    if content_type == serializers.JSON_TYPE:
+        data = json.loads(body)
+        assert data["limit"] == 3 and len(data["data"]) == 3
+    else:
+        assert len([json.loads(line) for line in body.splitlines()]) == 3
+
+
+@pytest.mark.parametrize("response_format", ["json", "ndjson"])
+def test_streamed_json_is_the_same_as_the_buffered_one(
+    response_format, monkeypatch
+):
+    query = f"limit=1200&sort=-worldwide&format={response_format}"
+    monkeypatch.setattr(server.settings, "STREAM_CHUNK_ROWS", 500)
+    server.response_cache.clear()
+    _, headers, chunks = call("/box-office", query)
+    assert "Content-Length" not in headers and len(chunks) > 3
+
+    monkeypatch.setattr(server.settings, "STREAM_MIN_ROWS", 10**9)
+    server.response_cache.clear()
+    _, _, buffered = get("/box-office", query)
+    server.response_cache.clear()
+    assert b"".join(chunks) == buffered
+
+
+# ====== Range requests
+DATA_CSV = "/data/movies-box-office-dataset-cleaned.csv"
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=90-", (90, 99)),
+        ("bytes=90-500", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-500", (0, 99)),
+        ("bytes=20-10", None),
+        ("bytes=0-1,5-6", None),
+        ("items=0-9", None),
+        ("bytes=abc", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=999-1000", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 100)
+
+
+def test_range_requests():
+    _, headers, full = get(DATA_CSV)
+    size = len(full)
+    assert headers["Content-Length"] == str(size)
+
+    status, headers, body = get(DATA_CSV, range="bytes=10-19")
+    assert status == "206 Partial Content"
+    assert headers["Content-Range"] == f"bytes 10-19/{size}"
+    assert body == full[10:20]
+
+    status, headers, body = get(DATA_CSV, range="bytes=-5")
+    assert body == full[-5:]
+
+    status, headers, _ = get(DATA_CSV, range=f"bytes={size}-")
+    assert status == "416 Range Not Satisfiable"
+    assert headers["Content-Range"] == f"bytes */{size}"
+
+    # If-Range with an old validator: send the whole (new) file
+    status, _, body = get(DATA_CSV, range="bytes=0-9", if_range='"old"')
+    assert status == "200 OK" and body == full
+
+
+def test_static_files_stay_inside_their_directory():
+    assert get("/static/../server.py")[0] == "404 Not Found"
+    assert get("/static/nope.css")[0] == "404 Not Found"
+
+
+def test_if_range_with_the_current_etag_sends_the_range():
+    _, headers, full = get(DATA_CSV)
+    status, _, body = get(DATA_CSV, range="bytes=0-9", if_range=headers["ETag"])
+    assert status == "206 Partial Content" and body == full[:10]
+
+
+def test_precompressed_files(tmp_path):
+    (tmp_path / "app.js").write_bytes(b"let x = 1;\n" * 100)
+    with gzip.open(tmp_path / "app.js.gz", "wb") as f:
+        f.write(b"let x = 1;\n" * 100)
+    files = StaticFiles(str(tmp_path))
+
+    def serve(**environ):
+        response = files.serve(environ, "app.js")
+        try:
+            return dict(response.headers), b"".join(response.body)
+        finally:
+            response.body.close()
+
+    headers, body = serve(HTTP_ACCEPT_ENCODING="gzip")
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["ETag"].endswith('-gz"')
+    assert gzip.decompress(body) == b"let x = 1;\n" * 100
+    headers, body = serve()
+    assert "Content-Encoding" not in headers
+    assert body == b"let x = 1;\n" * 100
+
+
+# ====== ASGI
+def run_asgi(asgi_app, scope, messages=(), on_send=None):
+    """Run one ASGI call. Returns the messages it sent."""
+    sent = []
+
+    async def main():
+        received = asyncio.Queue()
+        for message in messages:
+            received.put_nowait(message)
+
+        async def send(message):
+            sent.append(message)
+            if on_send is not None:
+                on_send(message, received)
+
+        await asgi_app(scope, received.get, send)
+
+    asyncio.run(main())
+    return sent
+
+
+def http_scope(path, query=b"", method="GET", headers=()):
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": list(headers),
+    }
+
+
+def test_build_environ():
+    scope = http_scope(
+        "/box-office/café",
+        b"limit=5&q=%C3%A9",
+        method="POST",
+        headers=[
+            (b"content-type", b"text/plain"),
+            (b"x-thing", b"a"),
+            (b"cookie", b"a=1"),
+            (b"cookie", b"b=2"),
+        ],
+    )
+    scope.update(server=("example.com", 8000), client=("10.0.0.1", 5555))
+    environ = build_environ(scope, io.BytesIO())
+    assert environ["REQUEST_METHOD"] == "POST"
+    # WSGI wants the utf-8 bytes as a latin-1 str
+    assert environ["PATH_INFO"].encode("latin-1").decode() == "/box-office/café"
+    assert environ["QUERY_STRING"] == "limit=5&q=%C3%A9"
+    assert environ["CONTENT_TYPE"] == "text/plain"
+    assert environ["HTTP_X_THING"] == "a"
+    assert environ["HTTP_COOKIE"] == "a=1; b=2"
+    assert environ["SERVER_PORT"] == "8000"
+    assert environ["REMOTE_ADDR"] == "10.0.0.1"
+
+
+def test_asgi_runs_the_wsgi_app():
+    sent = run_asgi(
+        ASGIApp(server.app),
+        http_scope("/box-office", b"limit=2&format=json"),
+        [{"type": "http.request", "body": b""}],
+    )
+    assert sent[0]["type"] == "http.response.start"
+    assert sent[0]["status"] == 200
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    assert len(json.loads(body)["data"]) == 2
+    assert sent[-1] == {"type": "http.response.body", "body": b""}
+
+
+@pytest.mark.parametrize(
+    "headers, messages",
+    [
+        # Known up front
+        (
+            [(b"content-length", b"11")],
+            [{"type": "http.request", "body": b"x" * 11}],
+        ),
+        # Found out while reading it
+        (
+            [],
+            [
+                {"type": "http.request", "body": b"x" * 6, "more_body": True},
+                {"type": "http.request", "body": b"x" * 6},
+            ],
+        ),
+    ],
+)
+def test_asgi_rejects_a_body_that_is_too_large(headers, messages):
+    calls = []
+    asgi_app = ASGIApp(lambda *args: calls.append(args), max_body_size=10)
+    sent = run_asgi(
+        asgi_app, http_scope("/", method="POST", headers=headers), messages
+    )
+    assert sent[0]["status"] == 413
+    assert calls == []
+
+
+def test_asgi_lifespan_preloads(monkeypatch):
+    calls = []
+    monkeypatch.setattr(asgi, "preload", lambda: calls.append("preload"))
+    sent = run_asgi(
+        ASGIApp(server.app),
+        {"type": "lifespan"},
+        [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}],
+    )
+    assert calls == ["preload"]
+    assert [message["type"] for message in sent] == [
+        "lifespan.startup.complete",
+        "lifespan.shutdown.complete",
+    ]
+
+    def fail():
+        raise OSError("no dataset")
+
+    monkeypatch.setattr(asgi, "preload", fail)
+    sent = run_asgi(
+        ASGIApp(server.app),
+        {"type": "lifespan"},
+        [{"type": "lifespan.startup"}],
+    )
+    assert sent[0]["type"] == "lifespan.startup.failed"
+    assert "no dataset" in sent[0]["message"]
+
+
+def test_asgi_stops_streaming_when_the_client_disconnects():
+    pulled = []
+    closed = []
+
+    def chunks():
+        try:
+            for i in range(1000):
+                pulled.append(i)
+                yield b"chunk %d\n" % i
+        finally:
+            closed.append(True)
+
+    def wsgi_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return chunks()
+
+    def hang_up(message, received):
+        if message.get("body"):
+            received.put_nowait({"type": "http.disconnect"})
+
+    sent = run_asgi(
+        ASGIApp(wsgi_app),
+        http_scope("/"),
+        [{"type": "http.request", "body": b""}],
+        on_send=hang_up,
+    )
+    assert closed == [True]
+    assert len(pulled) < 10
+    assert all(message.get("more_body") for message in sent[1:])
+
+
+# ====== Aggregates
+@pytest.fixture
+def money():
+    domestic = np.array([5, 3, 5, 1, 9, 0, 2], dtype=np.int64)
+    foreign = np.array([1, 4, 5, 7, 0, 6, 2], dtype=np.int64)
+    return Dataset(
+        {
+            "Rank": np.arange(1, 8, dtype=np.int32),
+            "Year": np.array(YEARS, dtype=np.int16),
+            "Worldwide": domestic + foreign,
+            "Domestic": domestic,
+            "Foreign": foreign,
+        }
+    )
+
+
+def test_year_totals(money):
+    totals = stats.year_totals(money)
+    assert stats.year_totals(money) is totals  # memoized
+    rows = {row["Year"]: row for row in totals.rows}
+    for year in set(YEARS):
+        rows_of_year = [i for i, y in enumerate(YEARS) if y == year]
+        domestic = sum(int(money.column("Domestic")[i]) for i in rows_of_year)
+        worldwide = sum(int(money.column("Worldwide")[i]) for i in rows_of_year)
+        assert rows[year]["Movies"] == len(rows_of_year)
+        assert rows[year]["Domestic"] == domestic
+        assert rows[year]["Domestic_%"] == pytest.approx(domestic / worldwide)
+    assert totals.overall["Worldwide"] == 50
+    assert [row["Year"] for row in totals.between(2019, None)] == [2019, 2020]
+    assert totals.between(2021, 2030) == []
+
+
+def test_top_per_year_keeps_rank_order_for_ties(money):
+    top = stats.top_per_year(money, "Worldwide", 2)
+    # 2019: rank 3 made 10, ranks 1 and 6 tie at 6
+    assert [row["Rank"] for row in top[2019]] == [3, 1]
+    assert [row["Rank"] for row in top[2018]] == [5, 2]
+    assert list(stats.top_per_year(money, "Domestic", 1, 2020, 2020)) == [2020]
+
+
+# ====== Metrics
+def test_histogram_buckets_and_quantiles():
+    for value in list(range(5000)) + [2**20 + 12345, 2**30]:
+        low, high = metrics.bucket_bounds(metrics.bucket_index(value))
+        assert low <= value < high
+        assert high - low <= max(low // 8, 1)
+    histogram = metrics.Histogram()
+    for ms in range(1, 101):
+        histogram.record(ms / 1000)
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == pytest.approx(0.050, rel=0.07)
+    assert histogram.quantile(0.99) == pytest.approx(0.099, rel=0.07)
+    assert dict(histogram.cumulative([0.01, 1.0]))[1.0] == 100
+
+
+def test_phase_timer_gives_time_to_the_innermost_phase(monkeypatch):
+    now = iter([0.0, 1.0, 3.0, 6.0])
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: next(now))
+    timer = metrics.PhaseTimer()
+    with timer.phase("render"):
+        with timer.phase("data"):
+            pass
+    assert timer.totals == {"render": 4.0, "data": 2.0}
+
+
+def test_metrics_endpoint_counts_requests():
+    get("/movie/1")
+    status, headers, body = get("/metrics")
+    assert headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = body.decode()
+    assert (
+        'http_requests_total{route="read_movie",method="GET",status="200"'
+        in text
+    )
+    assert (
+        'http_request_phase_seconds_count{route="read_movie",phase="data"'
+        in text
+    )
+
+
+# ====== Forms
+MULTIPART = (
+    b"preamble\r\n"
+    b"--XyZ\r\n"
+    b'Content-Disposition: form-data; name="title"\r\n'
+    b"\r\n"
+    b"Star Wars \xc3\xa9\r\n"
+    b"--XyZ\r\n"
+    b'Content-Disposition: form-data; name="poster"; filename="C:\\x\\a.txt"'
+    b"\r\nContent-Type: text/plain\r\n"
+    b"\r\n"
+    b"line 1\r\n--Xy\r\nline 3\r\n"
+    b"--XyZ\r\n"
+    b'Content-Disposition: form-data; name="empty"; filename=""\r\n'
+    b"\r\n"
+    b"\r\n"
+    b"--XyZ--\r\n"
+    b"epilogue"
+)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, len(MULTIPART)])
+def test_multipart_parser_handles_any_chunking(chunk_size):
+    parser = MultipartParser(b"XyZ", 10, 1000, spool_size=4)
+    for i in range(0, len(MULTIPART), chunk_size):
+        parser.feed(MULTIPART[i : i + chunk_size])
+    parser.close()
+    assert parser.form == {"title": ["Star Wars \u00e9"]}
+    [upload] = parser.files["poster"]
+    assert upload.filename == "a.txt" and upload.content_type == "text/plain"
+    assert upload.read() == b"line 1\r\n--Xy\r\nline 3"
+    assert upload.size == len(upload.read())
+    assert "empty" not in parser.files
+    parser.close_files()
+
+
+def multipart_environ(body, **limits):
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update(
+        REQUEST_METHOD="POST",
+        CONTENT_TYPE='multipart/form-data; boundary="XyZ"',
+        CONTENT_LENGTH=str(len(body)),
+    )
+    environ["wsgi.input"] = io.BytesIO(body)
+    return FormParser(**limits), environ
+
+
+def test_form_parser_is_lazy_and_parses_once():
+    parser, environ = multipart_environ(MULTIPART)
+    assert environ["wsgi.input"].tell() == 0
+    assert parser.form(environ) == {"title": ["Star Wars \u00e9"]}
+    assert parser.files(environ)["poster"][0].filename == "a.txt"
+    assert environ["wsgi.input"].tell() == len(MULTIPART)
+    parser.finish(environ)
+    assert parser.files(environ)["poster"][0].file.closed
+
+
+@pytest.mark.parametrize(
+    "limits, error",
+    [
+        ({"max_body_size": 100}, PayloadTooLarge),
+        ({"max_fields": 2}, PayloadTooLarge),
+        ({"max_memory_size": 5}, PayloadTooLarge),
+    ],
+)
+def test_form_parser_limits(limits, error):
+    parser, environ = multipart_environ(MULTIPART, **limits)
+    with pytest.raises(error):
+        parser.form(environ)
+
+
+def test_form_parser_rejects_a_truncated_body():
+    body = MULTIPART[: MULTIPART.index(b"--XyZ--")]
+    parser, environ = multipart_environ(body)
+    with pytest.raises(BadRequest):
+        parser.form(environ)
+
+
+def test_unread_body_is_skipped():
+    body = b"x" * 1000
+    environ = {}
+    setup_testing_defaults(environ)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ["wsgi.input"] = io.BytesIO(body + b"GET /next HTTP/1.1")
+    FormParser().finish(environ)
+    assert environ["wsgi.input"].read() == b"GET /next HTTP/1.1"
+
+
+def test_contact_form(tmp_path, monkeypatch):
+    messages = tmp_path / "messages.ndjson"
+    monkeypatch.setattr(server.settings, "CONTACT_MESSAGES_FILE", str(messages))
+    form = b"name=Ann&email=ann%40example.com&message=Hi+%3Cthere%3E"
+    status, headers, _ = get(
+        "/contact",
+        method="POST",
+        body=form,
+        content_type="application/x-www-form-urlencoded",
+    )
+    assert status == "303 See Other"
+    assert headers["Location"] == "/contact?sent=1"
+    assert '"message": "Hi <there>"' in messages.read_text()
+    assert b"Thanks!" in get("/contact", "sent=1")[2]
+
+    status, _, body = get(
+        "/contact",
+        method="POST",
+        body=b"name=%3Cb%3E&email=nope&message=",
+        content_type="application/x-www-form-urlencoded",
+    )
+    assert status == "400 Bad Request"
+    assert b'value="&lt;b&gt;"' in body and b"valid email" in body
+    assert len(messages.read_text().splitlines()) == 1
+
+
+def test_contact_form_too_large(monkeypatch):
+    monkeypatch.setattr(server.form_parser, "max_memory_size", 10)
+    status, _, _ = get(
+        "/contact",
+        method="POST",
+        body=b"message=" + b"x" * 100,
+        content_type="application/x-www-form-urlencoded",
+    )
+    assert status == "413 Payload Too Large"
+
+
+def test_stats_endpoints():
+    status, headers, body = get("/box-office/stats", "year=2019")
+    assert status == "200 OK" and "ETag" in headers
+    assert [row["Year"] for row in json.loads(body)["years"]] == [2019]
+    status, _, body = get("/box-office/stats/top", "n=3&from=2018&to=2019")
+    top = json.loads(body)["years"]
+    assert list(top) == ["2018", "2019"]
+    assert all(len(rows) == 3 for rows in top.values())
+    assert get("/box-office/stats/top", "by=Rank")[0] == "400 Bad Request"